@@ -0,0 +1,325 @@
+"""
+Запись цикла синхронизации в HTTP-кассету и его воспроизведение без сети:
+сравнение количества запросов, байтов ответов и времени цикла между версиями
+
+    python -m benchmarks.cassette record cycle.jsonl.gz --mock --items 20
+    python -m benchmarks.cassette record cycle.jsonl.gz --tenants tenants.json
+    python -m benchmarks.cassette replay cycle.jsonl.gz --speed 10 --engine async
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from collections.abc import MutableSet
+
+from src.services.bitrix import BitrixService
+from src.services.cassette import Cassette
+from src.services.http import HttpClient
+from src.services.itigris import ItigrisService
+from src.services.state import StateStore
+from src.services.sync import SyncEngine
+from src.services.tenants import (
+    Tenant,
+    default_tenant,
+    load_tenants,
+    register_tenant,
+    use_tenant,
+)
+
+ENGINES = ("sync", "async")
+
+# Таблицы состояния, снимок которых сохраняется в кассете
+STATE_TABLES = (
+    "record_id_to_lead_id",
+    "explored_order_ids",
+    "watermarks",
+    "lead_versions",
+    "lead_hashes",
+    "lead_appointments",
+)
+
+
+# MARK: State
+def snapshot(state: StateStore) -> dict[str, list]:
+    """Состояние компании перед циклом (воспроизведение начинается с него)"""
+
+    data = {}
+    for table in STATE_TABLES:
+        stored = getattr(state, table)
+        data[table] = (
+            sorted(stored)
+            if isinstance(stored, MutableSet)
+            else [list(item) for item in stored.items()]
+        )
+
+    return data
+
+
+def restore(state: StateStore, data: dict[str, list]) -> None:
+    """Заполнение пустого хранилища снимком из кассеты"""
+
+    for table in STATE_TABLES:
+        stored = getattr(state, table)
+        if isinstance(stored, MutableSet):
+            for key in data.get(table, []):
+                stored.add(key)
+        else:
+            stored.update(dict(data.get(table, [])))
+
+    state.flush()
+
+
+# MARK: Cycle
+def run_cycle(tenants: list[Tenant], engine: str) -> float:
+    """Один цикл синхронизации компаний, возвращает его длительность"""
+
+    started = time.perf_counter()
+    for tenant in tenants:
+        state = tenant.state
+        with use_tenant(tenant):
+            if engine == "async":
+                sync_engine = SyncEngine()
+                try:
+                    asyncio.run(
+                        sync_engine.run_cycle(
+                            state.record_id_to_lead_id,
+                            state.explored_order_ids,
+                            state.watermarks,
+                            state.lead_versions,
+                            state.lead_hashes,
+                            state.lead_appointments,
+                        )
+                    )
+                finally:
+                    sync_engine.close()
+            else:
+                BitrixService.handle_new_leads(
+                    state.record_id_to_lead_id,
+                    state.watermarks,
+                    state.lead_versions,
+                    lead_appointments=state.lead_appointments,
+                )
+                ItigrisService.handle_finished_records(
+                    state.record_id_to_lead_id,
+                    state.explored_order_ids,
+                    state.watermarks,
+                    lead_hashes=state.lead_hashes,
+                )
+        state.flush()
+
+    return time.perf_counter() - started
+
+
+# MARK: Record
+def record(args: argparse.Namespace) -> dict:
+    """
+    Запись цикла. С реальными компаниями выполняется обычный цикл
+    синхронизации (с изменениями в Bitrix24 и Itigris), поэтому для
+    сравнения версий удобнее записывать его на заглушках (--mock)
+    """
+
+    with contextlib.ExitStack() as stack:
+        if args.mock:
+            tenants = [mock_tenant(stack, args.items)]
+        elif args.tenants:
+            tenants = load_tenants(args.tenants)
+        else:
+            tenants = [default_tenant()]
+
+        cassette = Cassette(
+            args.cassette,
+            mode="record",
+            meta={
+                "engine": args.engine,
+                "tenants": {tenant.name: snapshot(tenant.state) for tenant in tenants},
+            },
+        )
+        HttpClient.use_cassette(cassette)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = run_cycle(tenants, args.engine)
+        finally:
+            HttpClient.use_cassette(None)
+
+        stats = cassette.stats()
+        cassette.meta["recorded"] = {
+            "requests": stats["requests"],
+            "bytes": stats["bytes"],
+            "seconds": round(seconds, 3),
+        }
+        cassette.save()
+
+    return cassette.meta["recorded"]
+
+
+def mock_tenant(stack: contextlib.ExitStack, items: int) -> Tenant:
+    """Компания на локальных заглушках с items лидами и записями"""
+
+    from benchmarks.mocks import ItigrisData, MockBitrix, MockItigris
+
+    bitrix = MockBitrix().start()
+    data = ItigrisData()
+    itigris_old, itigris_new = (MockItigris(data).start() for _ in range(2))
+    for server in (bitrix, itigris_old, itigris_new):
+        stack.callback(server.stop)
+
+    directory = stack.enter_context(tempfile.TemporaryDirectory())
+    tenant = Tenant(
+        name="benchmark",
+        **_placeholder_credentials(),
+        bitrix_webhook_url=f"{bitrix.url}/rest/1/benchmark",
+        itigris_url=f"{itigris_old.url}/zeleniychameleon",
+        itigris_url_new=itigris_new.url,
+        state_path=os.path.join(directory, "state.sqlite3"),
+    )
+    register_tenant(tenant)
+    stack.callback(tenant.state.close)
+
+    bitrix.seed_leads(items)
+    tenant.state.record_id_to_lead_id.update(data.seed_realized_records(items))
+    tenant.state.flush()
+    return tenant
+
+
+# MARK: Replay
+def replay(args: argparse.Namespace) -> dict:
+    """Воспроизведение цикла из кассеты на пустом состоянии из ее снимка"""
+
+    cassette = Cassette(args.cassette, mode="replay", speed=args.speed)
+
+    with contextlib.ExitStack() as stack:
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+
+        # Адреса не используются (ответы из кассеты), а хосты различаются,
+        # как у реальных API, из-за лимитов по хостам; по именам компаний
+        # запросы сопоставляются с записанными
+        tenants = []
+        for name, data in cassette.meta["tenants"].items():
+            tenant = Tenant(
+                name=name,
+                **_placeholder_credentials(),
+                bitrix_webhook_url=f"https://bitrix.{name}.invalid/rest/1/replay",
+                itigris_url=f"https://itigris.{name}.invalid/app",
+                itigris_url_new=f"https://itigris-v2.{name}.invalid",
+                state_path=os.path.join(directory, f"state-{name}.sqlite3"),
+            )
+            register_tenant(tenant)
+            stack.callback(tenant.state.close)
+            restore(tenant.state, data)
+            tenants.append(tenant)
+
+        HttpClient.use_cassette(cassette)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = run_cycle(tenants, args.engine or cassette.meta["engine"])
+        finally:
+            HttpClient.use_cassette(None)
+
+    stats = cassette.stats()
+    return {
+        "recorded": cassette.meta["recorded"],
+        "replayed": {
+            "requests": stats["requests"],
+            "bytes": stats["bytes"],
+            "seconds": round(seconds, 3),
+        },
+        "matched": {
+            kind: stats[kind] for kind in ("exact", "loose", "repeated", "unmatched")
+        },
+    }
+
+
+def _placeholder_credentials() -> dict:
+    """Учетные данные компании, не используемые заглушками и кассетой"""
+
+    return {
+        "itigris_company": "benchmark",
+        "itigris_login": "benchmark",
+        "itigris_password": "benchmark",
+        "itigris_department_id": 1,
+        "itigris_key": "benchmark",
+        "itigris_user_id": 1,
+        "itigris_service_type_id": 1,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="Вывод в формате JSON")
+
+    record_parser = commands.add_parser(
+        "record",
+        parents=[common],
+        help="Записать цикл в кассету",
+    )
+    record_parser.add_argument("cassette", help="Файл кассеты (.jsonl.gz)")
+    record_parser.add_argument("--engine", choices=ENGINES, default="sync")
+    record_parser.add_argument(
+        "--mock",
+        action="store_true",
+        help="Записать цикл на локальных заглушках, а не на реальных API",
+    )
+    record_parser.add_argument(
+        "--items",
+        type=int,
+        default=20,
+        help="Количество лидов и записей на заглушках",
+    )
+    record_parser.add_argument(
+        "--tenants",
+        help="JSON-файл со списком компаний (по умолчанию из переменных окружения)",
+    )
+
+    replay_parser = commands.add_parser(
+        "replay",
+        parents=[common],
+        help="Воспроизвести цикл",
+    )
+    replay_parser.add_argument("cassette", help="Файл кассеты (.jsonl.gz)")
+    replay_parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=None,
+        help="Движок цикла (по умолчанию тот, которым цикл записан)",
+    )
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Ускорение задержек ответов (1 - как при записи, 0 - без задержек)",
+    )
+    args = parser.parse_args()
+
+    result = record(args) if args.command == "record" else replay(args)
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    if args.command == "record":
+        print(
+            f"Записано запросов: {result['requests']}, байтов: {result['bytes']}, "
+            f"секунд: {result['seconds']}"
+        )
+        return
+
+    print(f"{'':<9} {'requests':>9} {'bytes':>10} {'sec':>8}")
+    for name in ("recorded", "replayed"):
+        row = result[name]
+        print(
+            f"{name:<9} {row['requests']:>9} {row['bytes']:>10} {row['seconds']:>8}"
+        )
+    print(
+        "Сопоставление запросов: "
+        + ", ".join(f"{kind}={count}" for kind, count in result["matched"].items())
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Локальная замена внешнего API: задержка ответа, доля ошибок 500
+    и ограничение частоты запросов (ответ 429 или 503 QUERY_LIMIT_EXCEEDED)
+    """
+
+    daemon_threads = True
+    throttle_status = 429
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float | None = None,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+
+        self.requests = 0
+        self.requests_by_endpoint: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._window_started = time.monotonic()
+        self._window_requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.requests_by_endpoint = {}
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        query: dict,
+        body: bytes,
+    ) -> tuple[int, object]:
+        """Общая обработка: учет, ограничения, задержка и маршрутизация"""
+
+        with self._lock:
+            self.requests += 1
+            self.requests_by_endpoint[path] = self.requests_by_endpoint.get(path, 0) + 1
+
+            throttled = False
+            if self.rate_limit:
+                now = time.monotonic()
+                if now - self._window_started >= 1:
+                    self._window_started = now
+                    self._window_requests = 0
+                self._window_requests += 1
+                throttled = self._window_requests > self.rate_limit
+
+        if throttled:
+            return self.throttle_status, {"error": "QUERY_LIMIT_EXCEEDED"}
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {"error": "INTERNAL_SERVER_ERROR"}
+
+        return self.route(method, path, query, body)
+
+    def route(
+        self,
+        method: str,
+        path: str,
+        query: dict,
+        body: bytes,
+    ) -> tuple[int, object]:
+        """Ответ на запрос (переопределяется заглушками конкретных API)"""
+
+        return 404, {"error": "not found"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self._respond("GET")
+
+    def do_POST(self) -> None:
+        self._respond("POST")
+
+    def _respond(self, method: str) -> None:
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        status, payload = self.server.handle(method, url.path, query, body)
+
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class MockBitrix(MockServer):
+    """
+    Bitrix24: crm.lead.list (с фильтром, select и постраничным выводом),
+    crm.lead.get, crm.lead.update (обновляет DATE_MODIFY, как Bitrix24) и batch
+    """
+
+    throttle_status = 503
+    page_size = 50
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.leads: dict[int, dict] = {}
+        self.updates: dict[int, dict] = {}
+
+    def seed_leads(self, count: int) -> None:
+        """Создание count лидов в статусе IN_PROCESS"""
+
+        now = datetime.now().astimezone()
+        for i in range(1, count + 1):
+            self.leads[i] = {
+                "ID": str(i),
+                "NAME": f"Имя{i}",
+                "SECOND_NAME": f"Фамилия{i}",
+                "LAST_NAME": f"Отчество{i}",
+                "STATUS_ID": "IN_PROCESS",
+                "DATE_MODIFY": now.isoformat(timespec="seconds"),
+                "PHONE": [{"VALUE": f"+7900{i:07d}"}],
+                "EMAIL": [{"VALUE": f"client{i}@example.com"}],
+                "UF_CRM_1762957506003": "223",
+                "UF_CRM_1760092417949": (now + timedelta(hours=1)).isoformat(
+                    timespec="seconds"
+                ),
+            }
+
+    def touch_leads(self) -> None:
+        """Изменение всех лидов (новый DATE_MODIFY) без изменения полей"""
+
+        with self._lock:
+            for lead in self.leads.values():
+                lead["DATE_MODIFY"] = _next_modify(lead["DATE_MODIFY"])
+
+    def route(self, method, path, query, body):
+        command = path.rsplit("/", 1)[-1]
+        payload = json.loads(body or b"{}")
+
+        if command == "batch":
+            return 200, {"result": self._batch(payload.get("cmd", {}))}
+
+        return self._call(command, payload)
+
+    def _call(self, command: str, payload: dict) -> tuple[int, object]:
+        if command == "crm.lead.list":
+            start = int(payload.get("start") or 0)
+            with self._lock:
+                ids = [
+                    id
+                    for id in sorted(self.leads)
+                    if _matches(self.leads[id], payload.get("filter") or {})
+                ]
+                page = [
+                    _select(self.leads[id], payload.get("select") or ["*"])
+                    for id in ids[start : start + self.page_size]
+                ]
+            result = {"result": page, "total": len(ids)}
+            if start + self.page_size < len(ids):
+                result["next"] = start + self.page_size
+            return 200, result
+
+        if command == "crm.lead.get":
+            lead = self.leads.get(int(payload.get("ID") or payload.get("id") or 0))
+            if lead is None:
+                return 400, {"error": "NOT_FOUND", "error_description": "Not found"}
+            return 200, {"result": lead}
+
+        if command == "crm.lead.update":
+            id = int(payload.get("id") or 0)
+            fields = payload.get("fields") or {}
+            with self._lock:
+                lead = self.leads.get(id)
+                if lead is None:
+                    return 400, {"error": "NOT_FOUND", "error_description": "Not found"}
+                lead.update(fields)
+                lead["DATE_MODIFY"] = _next_modify(lead["DATE_MODIFY"])
+                self.updates[id] = fields
+            return 200, {"result": True}
+
+        return 404, {"error": "ERROR_METHOD_NOT_FOUND"}
+
+    def _batch(self, commands: dict[str, str]) -> dict:
+        result, result_error = {}, {}
+        for key, command in commands.items():
+            method, _, query = command.partition("?")
+            params = {name: values[-1] for name, values in parse_qs(query).items()}
+            if method == "crm.lead.update":
+                params = {
+                    "id": params.get("id"),
+                    "fields": {
+                        name[len("fields[") : -1]: value
+                        for name, value in params.items()
+                        if name.startswith("fields[")
+                    },
+                }
+
+            status, data = self._call(method, params)
+            if status == 200:
+                result[key] = data["result"]
+            else:
+                result_error[key] = data
+
+        return {"result": result, "result_error": result_error}
+
+
+class MockItigris(MockServer):
+    """
+    Itigris: новый API (sign/in, clients, registry-records, prescription)
+    и старый API (remoteRegistry/register, remoteOrderHistory/list)
+    на одном сервере; для отдельных хостов запускаются два экземпляра
+    с общим хранилищем
+    """
+
+    def __init__(self, data: "ItigrisData | None" = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.data = data or ItigrisData()
+
+    def route(self, method, path, query, body):
+        data = self.data
+        parts = [part for part in path.split("/") if part]
+
+        if path == "/api/v2/sign/in":
+            return 200, {"accessToken": "benchmark-token"}
+
+        if path == "/api/v2/clients" and method == "GET":
+            if "searchString" not in query:
+                return 200, data.clients_page(
+                    int(query.get("page", 0)),
+                    int(query.get("size", 20)),
+                )
+
+            client_id = data.clients_by_phone.get(query["searchString"])
+            return 200, {"content": [{"id": client_id}] if client_id else []}
+
+        if path == "/api/v2/clients" and method == "POST":
+            payload = json.loads(body or b"{}")
+            client_id = data.create_client(payload.get("tel1"), payload)
+            return 201, {"id": client_id}
+
+        if len(parts) >= 5 and parts[:3] == ["api", "v2", "clients"]:
+            if parts[4] == "agreements":
+                return 200, {}
+            if parts[4] == "prescription":
+                return 200, data.prescriptions(int(parts[3]))
+
+        if path == "/api/v2/registry-records":
+            records = data.find_records(
+                status=query.get("status"),
+                client_id=query.get("clientId"),
+                appointment_from=query.get("appointmentFrom"),
+                appointment_to=query.get("appointmentTo"),
+            )
+            if "page" not in query:
+                return 200, records
+
+            page, size = int(query["page"]), int(query.get("size", 20))
+            return 200, {
+                "content": records[page * size : (page + 1) * size],
+                "last": (page + 1) * size >= len(records),
+            }
+
+        if path.endswith("/remoteRegistry/register"):
+            data.create_record(int(query["clientId"]), query.get("time"))
+            return 200, {}
+
+        if path.endswith("/remoteOrderHistory/list"):
+            return 200, data.orders(
+                int(query["clientId"]),
+                status=query.get("status"),
+                start_date=query.get("startDate"),
+                end_date=query.get("endDate"),
+            )
+
+        return 404, {"error": "not found"}
+
+
+class ItigrisData:
+    """Общие данные двух экземпляров MockItigris (старый и новый API)"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.clients: dict[int, dict] = {}
+        self.clients_by_phone: dict[str, int] = {}
+        self.records: dict[int, dict] = {}
+
+    def create_client(self, phone: str | None, fields: dict | None = None) -> int:
+        with self._lock:
+            client_id = next(self._ids)
+            self.clients[client_id] = {**(fields or {}), "id": client_id, "tel1": phone}
+            if phone:
+                self.clients_by_phone[phone] = client_id
+            return client_id
+
+    def clients_page(self, page: int, size: int) -> dict:
+        with self._lock:
+            ids = sorted(self.clients)
+            content = [self.clients[id] for id in ids[page * size : (page + 1) * size]]
+            return {"content": content, "last": (page + 1) * size >= len(ids)}
+
+    def create_record(
+        self,
+        client_id: int,
+        time: str | None,
+        status: str = "NEW",
+    ) -> int:
+        with self._lock:
+            record_id = next(self._ids)
+            self.records[record_id] = {
+                "id": record_id,
+                "status": status,
+                "appointment": time,
+                "client": {"id": client_id},
+            }
+            return record_id
+
+    def seed_realized_records(self, count: int) -> dict[int, int]:
+        """Создание count завершенных записей, возвращает ID записи -> ID лида"""
+
+        # Прием - сегодня: записи попадают в опрос реестра с текущей даты
+        appointment = datetime.now().strftime("%Y-%m-%dT10:00:00")
+
+        record_id_to_lead_id = {}
+        for i in range(1, count + 1):
+            client_id = self.create_client(f"+7901{i:07d}")
+            record_id = self.create_record(client_id, appointment, status="REALIZED")
+            record_id_to_lead_id[record_id] = i
+        return record_id_to_lead_id
+
+    def find_records(
+        self,
+        status: str | None = None,
+        client_id: str | None = None,
+        appointment_from: str | None = None,
+        appointment_to: str | None = None,
+    ) -> list[dict]:
+        """Записи по статусу, клиенту и дате приема (даты включительно)"""
+
+        with self._lock:
+            return [
+                record
+                for id, record in sorted(self.records.items())
+                if (not status or record["status"] == status)
+                and (not client_id or record["client"]["id"] == int(client_id))
+                and (
+                    not appointment_from
+                    or (record["appointment"] or "")[:10] >= appointment_from
+                )
+                and (
+                    not appointment_to
+                    or (record["appointment"] or "")[:10] <= appointment_to
+                )
+            ]
+
+    def records_count(self, phone: str | None) -> int:
+        """Количество записей клиента с телефоном"""
+
+        with self._lock:
+            client_id = self.clients_by_phone.get(phone)
+            return sum(
+                record["client"]["id"] == client_id for record in self.records.values()
+            )
+
+    def orders(
+        self,
+        client_id: int,
+        status: str | None = None,
+        start_date: str | None = None,
+        end_date: str | None = None,
+    ) -> list[dict]:
+        """
+        История заказов клиента: по заказу в год, последний - сегодня.
+        Статус и даты (ДД.ММ.ГГГГ, включительно) фильтруются, как в API
+        """
+
+        today = datetime.now().date()
+        start = _order_date(start_date)
+        end = _order_date(end_date)
+
+        orders = []
+        for i in range(3):
+            order_date = today - timedelta(days=365 * (2 - i))
+            if (start and order_date < start) or (end and order_date > end):
+                continue
+            if status and status != "DONE":
+                continue
+            orders.append(
+                {
+                    "id": client_id * 10 + i,
+                    "status": "DONE",
+                    "date": order_date.strftime("%d.%m.%Y"),
+                    "sum": 900,
+                    "discount": 100,
+                }
+            )
+        return orders
+
+    def prescriptions(self, client_id: int) -> dict:
+        return {
+            "prescriptions": [{"sphOd": "-1.0", "sphOs": "-1.25", "comments": ""}],
+            "contactLensPrescriptions": [
+                {
+                    "model": "Acuvue",
+                    "color": "",
+                    "leftEye": {"dioptre": "-1.0"},
+                    "rightEye": {"dioptre": "-1.25"},
+                }
+            ],
+        }
+
+
+# MARK: Filters
+_FILTER_OPERATORS = (">=", "<=", "!=", ">", "<", "=", "!")
+
+
+def _matches(lead: dict, filters: dict) -> bool:
+    """Проверка лида фильтром crm.lead.list (=, !, >, >=, <, <=; список - IN)"""
+
+    for key, expected in filters.items():
+        operator = next((op for op in _FILTER_OPERATORS if key.startswith(op)), "=")
+        field = key[len(operator) :] if key.startswith(operator) else key
+        value = lead.get(field)
+
+        if isinstance(expected, list):
+            matched = str(value) in {str(item) for item in expected}
+            if matched == (operator in ("!", "!=")):
+                return False
+            continue
+
+        if field.startswith("DATE_"):
+            if value is None:
+                return False
+            value, expected = _as_datetime(value), _as_datetime(expected)
+        else:
+            value, expected = str(value), str(expected)
+
+        if not {
+            "=": value == expected,
+            "!": value != expected,
+            "!=": value != expected,
+            ">": value > expected,
+            ">=": value >= expected,
+            "<": value < expected,
+            "<=": value <= expected,
+        }[operator]:
+            return False
+
+    return True
+
+
+def _select(lead: dict, select: list[str]) -> dict:
+    """Поля лида из select (* - все стандартные, UF_* - все пользовательские)"""
+
+    if "*" in select and "UF_*" in select:
+        return dict(lead)
+
+    result = {"ID": lead["ID"]}
+    for name, value in lead.items():
+        if (
+            name in select
+            or ("*" in select and not name.startswith("UF_"))
+            or ("UF_*" in select and name.startswith("UF_"))
+        ):
+            result[name] = value
+    return result
+
+
+def _as_datetime(value: str) -> datetime:
+    """Дата фильтра или лида; дата без часового пояса - в местном времени"""
+
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.astimezone()
+
+
+def _next_modify(previous: str) -> str:
+    """Новое значение DATE_MODIFY: текущее время, но позже предыдущего"""
+
+    now = datetime.now().astimezone().replace(microsecond=0)
+    return max(now, _as_datetime(previous) + timedelta(seconds=1)).isoformat()
+
+
+def _order_date(value: str | None) -> date | None:
+    """Дата параметра startDate/endDate (ДД.ММ.ГГГГ)"""
+
+    return datetime.strptime(value, "%d.%m.%Y").date() if value else None
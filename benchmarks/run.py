@@ -0,0 +1,377 @@
+"""
+Офлайн-бенчмарк конвейера синхронизации на локальных заглушках
+Bitrix24 и Itigris: пропускная способность, p50/p99 обработки
+одного лида или записи и количество запросов на элемент
+
+    python -m benchmarks.run --items 10 100 1000 --engine sync async queue sharded
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+
+from benchmarks.mocks import ItigrisData, MockBitrix, MockItigris
+from src.main import tenant_batches, tenant_handlers
+from src.services.bitrix import BitrixService
+from src.services.cache import orders_by_client, prescriptions_by_client
+from src.services.itigris import ItigrisService
+from src.services.shards import ShardPool
+from src.services.sync import SyncEngine
+from src.services.tenants import Tenant, register_tenant, use_tenant
+from src.services.work_queue import WorkerPool, WorkQueue
+
+# Учетные данные компании бенчмарка: Tenant.from_env читает из окружения
+# поля, не заданные явно (при создании компании в run_once)
+for name, value in {
+    "ITIGRIS_COMPANY": "benchmark",
+    "ITIGRIS_LOGIN": "benchmark",
+    "ITIGRIS_PASSWORD": "benchmark",
+    "ITIGRIS_DEPARTAMENT_ID": "1",
+    "ITIGRIS_KEY": "benchmark",
+    "ITIGRIS_USER_ID": "1",
+    "ITIGRIS_SERVICE_TYPE_ID": "1",
+    "BITRIX_WEBHOOK_URL": "http://127.0.0.1",
+}.items():
+    os.environ.setdefault(name, value)
+
+SCENARIOS = ("leads", "records")
+ENGINES = ("sync", "async", "queue", "sharded")
+
+# Этап, длительность которого считается временем обработки одного элемента
+ITEM_SPANS = {
+    "leads": "BitrixService.process_lead",
+    "records": "ItigrisService.process_record",
+}
+
+
+@dataclass
+class Result:
+    """Результат одного прогона"""
+
+    scenario: str
+    engine: str
+    items: int
+    succeeded: int
+    seconds: float
+    latencies: list[float]
+    requests: dict[str, int]
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def percentile(self, q: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100)[q - 1]
+
+    def as_dict(self) -> dict:
+        return {
+            "scenario": self.scenario,
+            "engine": self.engine,
+            "items": self.items,
+            "succeeded": self.succeeded,
+            "seconds": round(self.seconds, 3),
+            "items_per_second": round(self.throughput, 2),
+            "p50_ms": round(self.percentile(50), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "requests_per_item": {
+                host: round(count / self.items, 2)
+                for host, count in self.requests.items()
+            },
+        }
+
+
+class _SpanCollector(logging.Handler):
+    """Сбор длительностей этапов из JSON-строк лога dnk_crm.trace"""
+
+    def __init__(self, span: str) -> None:
+        super().__init__(logging.INFO)
+        self.span = span
+        self.durations: list[float] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        data = json.loads(record.getMessage())
+        if data.get("span") == self.span:
+            self.durations.append(data["duration_ms"])
+
+
+@contextlib.contextmanager
+def collect_spans(span: str):
+    """Включение лога этапов на время прогона без вывода в консоль"""
+
+    logger = logging.getLogger("dnk_crm.trace")
+    collector = _SpanCollector(span)
+    level, propagate = logger.level, logger.propagate
+
+    logger.addHandler(collector)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        yield collector
+    finally:
+        logger.removeHandler(collector)
+        logger.setLevel(level)
+        logger.propagate = propagate
+
+
+@contextlib.contextmanager
+def _silence_children():
+    """Вывод запускаемых в блоке процессов (наследуют stdout) в /dev/null"""
+
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def run_once(scenario: str, engine: str, items: int, options: dict) -> Result:
+    """Прогон одного сценария на свежих заглушках и пустом состоянии"""
+
+    bitrix = MockBitrix(
+        latency=options["latency"],
+        error_rate=options["error_rate"],
+        rate_limit=options["bitrix_rate_limit"],
+    ).start()
+    data = ItigrisData()
+    itigris_old, itigris_new = (
+        MockItigris(
+            data,
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            rate_limit=options["itigris_rate_limit"],
+        ).start()
+        for _ in range(2)
+    )
+
+    for cache in (orders_by_client, prescriptions_by_client):
+        cache.clear()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Своя компания на каждый прогон: заглушки, пустые токен, индекс
+        # клиентов и состояние; новые порты - новые лимиты по хостам
+        tenant = Tenant.from_env(
+            name="benchmark",
+            bitrix_webhook_url=f"{bitrix.url}/rest/1/benchmark",
+            itigris_url=f"{itigris_old.url}/zeleniychameleon",
+            itigris_url_new=itigris_new.url,
+            state_path=os.path.join(directory, "state.sqlite3"),
+            tokens=None,
+            client_index=None,
+        )
+        register_tenant(tenant)
+
+        state = tenant.state
+        # Лиды нужны и записям: crm.lead.update несуществующего лида - ошибка
+        bitrix.seed_leads(items)
+        if scenario == "records":
+            state.record_id_to_lead_id.update(data.seed_realized_records(items))
+
+        with collect_spans(ITEM_SPANS[scenario]) as collector:
+            with contextlib.redirect_stdout(io.StringIO()), use_tenant(tenant):
+                started = time.perf_counter()
+                run_engine(scenario, engine, tenant, options)
+                seconds = time.perf_counter() - started
+
+        servers = {"bitrix": bitrix, "itigris": itigris_old, "itigris_v2": itigris_new}
+        requests = {name: server.requests for name, server in servers.items()}
+
+        if scenario == "leads":
+            # Повторный опрос после изменения лидов (как после обновления лида
+            # по завершенной записи) вне замера: лид успешен, если у клиента
+            # ровно одна запись в Itigris
+            bitrix.touch_leads()
+            with contextlib.redirect_stdout(io.StringIO()), use_tenant(tenant):
+                run_engine(scenario, engine, tenant, options)
+
+        state.flush()
+        succeeded = (
+            sum(
+                data.records_count(lead["PHONE"][0]["VALUE"]) == 1
+                for lead in bitrix.leads.values()
+            )
+            if scenario == "leads"
+            else len(bitrix.updates)
+        )
+        state.close()
+
+    for server in servers.values():
+        server.stop()
+
+    return Result(
+        scenario=scenario,
+        engine=engine,
+        items=items,
+        succeeded=succeeded,
+        seconds=seconds,
+        latencies=collector.durations,
+        requests=requests,
+    )
+
+
+def run_engine(scenario: str, engine: str, tenant: Tenant, options: dict) -> None:
+    """Один цикл синхронизации выбранным движком от имени компании"""
+
+    state = tenant.state
+    mapping, explored = state.record_id_to_lead_id, state.explored_order_ids
+    hashes = state.lead_hashes
+
+    if engine == "sync":
+        if scenario == "leads":
+            BitrixService.handle_new_leads(
+                mapping,
+                lead_versions=state.lead_versions,
+                lead_appointments=state.lead_appointments,
+            )
+        else:
+            ItigrisService.handle_finished_records(
+                mapping,
+                explored,
+                lead_hashes=hashes,
+            )
+        return
+
+    if engine == "async":
+        sync_engine = SyncEngine(max_concurrency=options["concurrency"])
+        try:
+            if scenario == "leads":
+                coroutine = sync_engine.handle_new_leads(
+                    mapping,
+                    lead_versions=state.lead_versions,
+                    lead_appointments=state.lead_appointments,
+                )
+            else:
+                coroutine = sync_engine.handle_finished_records(
+                    mapping,
+                    explored,
+                    lead_hashes=hashes,
+                )
+            asyncio.run(coroutine)
+        finally:
+            sync_engine.close()
+        return
+
+    work_queue = WorkQueue(state, backoff_base_seconds=0.1, backoff_max_seconds=1)
+    if scenario == "leads":
+        BitrixService.handle_new_leads(
+            mapping,
+            lead_versions=state.lead_versions,
+            work_queue=work_queue,
+        )
+    else:
+        ItigrisService.handle_finished_records(mapping, explored, work_queue=work_queue)
+
+    if engine == "sharded":
+        shards = ShardPool([tenant], processes=options["processes"])
+        with _silence_children():
+            shards.start()
+        try:
+            while set(work_queue.stats()) - {"done", "dead"}:
+                if not shards.process(tenant, work_queue):
+                    time.sleep(0.01)
+        finally:
+            shards.stop()
+        return
+
+    pool = WorkerPool(
+        work_queue,
+        tenant_handlers(tenant),
+        workers=options["concurrency"],
+        poll_interval_seconds=0.01,
+        batches=tenant_batches(tenant),
+    )
+    pool.start()
+    while set(work_queue.stats()) - {"done", "dead"}:
+        time.sleep(0.01)
+    pool.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--scenario", choices=SCENARIOS, nargs="+", default=SCENARIOS)
+    parser.add_argument("--engine", choices=ENGINES, nargs="+", default=["sync"])
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=4,
+        help="Количество процессов-обработчиков движка sharded",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Задержка ответа заглушек, секунды",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Доля ответов 500 (от 0 до 1)",
+    )
+    parser.add_argument(
+        "--bitrix-rate-limit",
+        type=float,
+        default=None,
+        help="Запросов в секунду, сверх которых Bitrix24 отвечает 503",
+    )
+    parser.add_argument(
+        "--itigris-rate-limit",
+        type=float,
+        default=None,
+        help="Запросов в секунду, сверх которых Itigris отвечает 429",
+    )
+    parser.add_argument("--json", action="store_true", help="Вывод JSON-строками")
+    args = parser.parse_args()
+
+    options = {
+        "concurrency": args.concurrency,
+        "processes": args.processes,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "bitrix_rate_limit": args.bitrix_rate_limit,
+        "itigris_rate_limit": args.itigris_rate_limit,
+    }
+
+    if not args.json:
+        print(
+            f"{'scenario':<8} {'engine':<7} {'items':>6} {'ok':>6} {'sec':>8} "
+            f"{'items/s':>9} {'p50 ms':>8} {'p99 ms':>8}  requests/item"
+        )
+
+    for scenario in args.scenario:
+        for engine in args.engine:
+            for items in args.items:
+                result = run_once(scenario, engine, items, options).as_dict()
+                if args.json:
+                    print(json.dumps(result))
+                    continue
+
+                requests = ", ".join(
+                    f"{host}={count}"
+                    for host, count in result["requests_per_item"].items()
+                )
+                print(
+                    f"{scenario:<8} {engine:<7} {items:>6} {result['succeeded']:>6} "
+                    f"{result['seconds']:>8} {result['items_per_second']:>9} "
+                    f"{result['p50_ms']:>8} {result['p99_ms']:>8}  {requests}"
+                )
+
+
+if __name__ == "__main__":
+    main()
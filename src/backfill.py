@@ -0,0 +1,115 @@
+import argparse
+import json
+from datetime import date
+
+from src.constants import BACKFILL_CHUNK_DAYS, BACKFILL_WORKERS
+from src.services.backfill import Backfill, BackfillReport
+from src.services.tenants import default_tenant, load_tenants, use_tenant
+
+
+def main() -> None:
+    """Догрузка пропущенных лидов и записей за период"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--from",
+        dest="date_from",
+        type=date.fromisoformat,
+        required=True,
+        help="Начало периода (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--to",
+        dest="date_to",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="Конец периода включительно (по умолчанию сегодня)",
+    )
+    parser.add_argument("--chunk-days", type=int, default=BACKFILL_CHUNK_DAYS)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Только показать расхождения, ничего не изменяя",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="Перепроверить и уже обработанные записи (отправляются только изменения)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Обработать и отрезки, отмеченные в прошлых запусках",
+    )
+    parser.add_argument(
+        "--tenants",
+        help="JSON-файл со списком компаний (по умолчанию из переменных окружения)",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Вывести отчет в формате JSON",
+    )
+    args = parser.parse_args()
+
+    tenants = load_tenants(args.tenants) if args.tenants else [default_tenant()]
+
+    results: dict[str, list[BackfillReport]] = {}
+    for tenant in tenants:
+        with use_tenant(tenant):
+            results[tenant.name] = Backfill(
+                tenant.state,
+                args.date_from,
+                args.date_to,
+                chunk_days=args.chunk_days,
+                workers=args.workers,
+                dry_run=args.dry_run,
+                reconcile=args.reconcile,
+                restart=args.restart,
+            ).run()
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    name: [report.as_dict() for report in reports]
+                    for name, reports in results.items()
+                },
+                ensure_ascii=False,
+                indent=2,
+            )
+        )
+        return
+
+    for name, reports in results.items():
+        print(f"Компания {name}:")
+        for report in reports:
+            print(format_report(report, args.dry_run))
+
+
+def format_report(report: BackfillReport, dry_run: bool) -> str:
+    """Строка отчета по отрезку"""
+
+    if report.skipped:
+        return f"  {report.chunk}: обработан ранее"
+
+    action = "к обновлению" if dry_run else "обновлено"
+    line = (
+        f"  {report.chunk}: лидов {report.leads_found}, "
+        f"без записи {len(report.leads_missing)}; "
+        f"записей {report.records_found}, без лида {len(report.records_unmatched)}; "
+        f"лидов {action} {len(report.lead_updates)}"
+    )
+    if dry_run and report.leads_missing:
+        line += f"\n    лиды без записи: {report.leads_missing}"
+    if dry_run and report.lead_updates:
+        line += f"\n    лиды к обновлению: {sorted(report.lead_updates)}"
+    if report.errors:
+        line += f"\n    ошибки: {report.errors}"
+
+    return line
+
+
+if __name__ == "__main__":
+    main()
@@ -6,3 +6,99 @@ ITIGRIS_URL_NEW = (
 FETCH_PERIOD_MINUTES = (
     1  # Период паузы между поиском обновленных сущностей в Bitrix24 и Itigris
 )
+
+# Поля лида, запрашиваемые в crm.lead.list (полный лид получается через crm.lead.get)
+BITRIX_LEAD_LIST_FIELDS = ["ID", "NAME", "SECOND_NAME", "LAST_NAME", "DATE_MODIFY"]
+BITRIX_BATCH_SIZE = 50  # Максимум команд в одном запросе batch (ограничение Bitrix24)
+
+# Настройки общего HTTP-транспорта
+HTTP_POOL_CONNECTIONS = 10  # Количество пулов (хостов), которые держатся открытыми
+HTTP_POOL_MAXSIZE = 20  # Максимум keep-alive соединений в пуле одного хоста
+HTTP_CONNECT_TIMEOUT = 5  # Таймаут установки соединения, секунды
+HTTP_READ_TIMEOUT = 30  # Таймаут чтения ответа, секунды
+HTTP_RETRIES = 3  # Количество повторов при ошибках соединения
+HTTP_BACKOFF_FACTOR = 0.5  # Множитель экспоненциальной паузы между повторами
+HTTP_MAX_CONCURRENCY_PER_HOST = 10  # Максимум одновременных запросов к одному хосту
+
+# Настройки асинхронного движка синхронизации
+SYNC_MAX_CONCURRENCY = 20  # Максимум лидов и записей, обрабатываемых одновременно
+
+# Настройки кэширования токена Itigris
+ITIGRIS_TOKEN_TTL_SECONDS = 30 * 60  # Время жизни токена, если в нем нет поля exp
+ITIGRIS_TOKEN_REFRESH_MARGIN_SECONDS = 60  # За сколько секунд до истечения обновлять
+
+ITIGRIS_RECORDS_PAGE_SIZE = 100  # Размер страницы реестра записей Itigris
+ITIGRIS_CLIENTS_PAGE_SIZE = 500  # Размер страницы выгрузки клиентов Itigris
+ITIGRIS_STREAM_CHUNK_SIZE = 64 * 1024  # Размер части тела при потоковом разборе ответов
+
+# Настройки поиска созданной записи в реестре Itigris
+RECORD_RESOLVE_INITIAL_DELAY_SECONDS = 0.25  # Первая пауза между опросами реестра
+RECORD_RESOLVE_MAX_DELAY_SECONDS = 2  # Максимальная пауза между опросами реестра
+RECORD_RESOLVE_TIMEOUT_SECONDS = 15  # Сколько всего ждать появления записи
+
+# Настройки хранилища состояния синхронизации
+STATE_DB_PATH = "state.sqlite3"  # Файл SQLite с соответствиями записей и лидов
+STATE_TTL_DAYS = 180  # Через сколько дней без изменений записи удаляются
+
+# Настройки индекса клиентов Itigris (поиск по телефону и ФИО без запросов)
+CLIENT_INDEX_TTL_SECONDS = 24 * 60 * 60  # Через сколько индекс строится заново
+CLIENT_INDEX_RETRY_SECONDS = 5 * 60  # Пауза перед повтором неудачного построения
+CLIENT_INDEX_LOCK_STRIPES = 64  # Количество блокировок поиска и создания клиентов
+DEFAULT_PHONE_COUNTRY_CODE = "7"  # Код страны для номеров без кода (8 900..., 900...)
+
+# Настройки кэширования ответов Itigris
+CACHE_MAX_SIZE = 10_000  # Максимум записей в одном кэше
+CACHE_ORDERS_TTL_SECONDS = 60  # Заказы клиента (меняются при завершении записи)
+CACHE_PRESCRIPTIONS_TTL_SECONDS = 60  # Рецепты клиента
+
+# Настройки приема исходящих вебхуков Bitrix24
+WEBHOOK_HOST = "0.0.0.0"  # Адрес, на котором принимаются события
+WEBHOOK_PORT = 8080  # Порт, на котором принимаются события
+WEBHOOK_WORKERS = 4  # Количество потоков, получающих лиды из событий
+
+# Настройки очереди работ
+QUEUE_WORKERS = 8  # Количество потоков, разбирающих очередь
+QUEUE_MAX_ATTEMPTS = 8  # После стольких неудачных попыток работа уходит в dead_jobs
+QUEUE_BACKOFF_BASE_SECONDS = 5  # Пауза перед первым повтором, далее удваивается
+QUEUE_BACKOFF_MAX_SECONDS = 60 * 60  # Максимальная пауза между повторами
+QUEUE_POLL_INTERVAL_SECONDS = 1  # Пауза потока при пустой очереди
+
+# Настройки обработки очереди процессами по разделам клиентов (--mode sharded)
+SHARD_PROCESSES = 4  # Количество процессов-обработчиков
+SHARD_POLL_INTERVAL_SECONDS = 1  # Как часто проверяется, что процессы живы
+SHARD_JOB_TIMEOUT_SECONDS = 5 * 60  # Через сколько зависший процесс перезапускается
+
+# Настройки догрузки пропущенных лидов и записей за период (python -m src.backfill)
+BACKFILL_CHUNK_DAYS = 1  # Длина одного отрезка периода в днях
+BACKFILL_WORKERS = 4  # Сколько отрезков обрабатывается параллельно
+
+# Настройки ограничения частоты запросов и автоматического выключателя по хостам
+HTTP_RATE_LIMIT = None  # Частота запросов к хосту без известного лимита (не ограничена)
+HTTP_RATE_LIMIT_THROTTLED = 10  # Частота после первого 429/503 хоста без лимита
+HTTP_RATE_BURST = 20  # Сколько запросов можно отправить подряд без пауз
+HTTP_RATE_LIMIT_MAX = 50  # При этой частоте лимит хоста без ограничения снимается
+HTTP_RATE_LIMIT_MIN = 0.2  # Ниже какой частоты лимит не опускается при 429/503
+HTTP_RATE_LIMIT_INCREASE = 0.1  # Прибавка к частоте после каждого успешного ответа
+BITRIX_RATE_LIMIT = 2  # Частота запросов к Bitrix24 (ограничение вебхуков)
+BITRIX_RATE_BURST = 50  # Запас запросов к Bitrix24 (ограничение вебхуков)
+HTTP_THROTTLE_RETRIES = 3  # Повторы запроса после ответа 429/503
+CIRCUIT_FAILURE_THRESHOLD = 5  # Сколько ошибок подряд размыкают выключатель хоста
+CIRCUIT_COOLDOWN_SECONDS = 30  # Через сколько секунд пробовать хост снова
+
+# Настройки метрик
+METRICS_HOST = "0.0.0.0"  # Адрес, на котором отдаются метрики
+METRICS_PORT = 9100  # Порт, на котором отдаются метрики (/metrics)
+METRICS_HISTOGRAM_BUCKETS = (  # Границы корзин гистограмм длительностей, секунды
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
@@ -1,20 +1,103 @@
 import os
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
 
-from dotenv import load_dotenv
 
-load_dotenv()
+class EnvSettings:
+    """
+    Переменные окружения. Файл .env читается, а значения проверяются
+    при первом обращении к настройке, поэтому импорт сервисов не требует
+    окружения. Значения кэшируются; override подменяет их на время блока
+    """
 
+    # Переменная -> преобразование значения
+    FIELDS: dict[str, Callable[[str], Any]] = {
+        "ITIGRIS_COMPANY": str,
+        "ITIGRIS_LOGIN": str,
+        "ITIGRIS_PASSWORD": str,
+        "ITIGRIS_DEPARTAMENT_ID": int,
+        "ITIGRIS_KEY": str,
+        "ITIGRIS_USER_ID": int,
+        "ITIGRIS_SERVICE_TYPE_ID": int,
+        "BITRIX_WEBHOOK_URL": str,
+        # Токен исходящего вебхука: события с другим токеном отклоняются
+        "BITRIX_APPLICATION_TOKEN": str,
+    }
+    OPTIONAL = {"BITRIX_APPLICATION_TOKEN"}
 
-class EnvSettings:
-    ITIGRIS_COMPANY = str(os.getenv("ITIGRIS_COMPANY"))
-    ITIGRIS_LOGIN = str(os.getenv("ITIGRIS_LOGIN"))
-    ITIGRIS_PASSWORD = str(os.getenv("ITIGRIS_PASSWORD"))
-    ITIGRIS_DEPARTAMENT_ID = int(os.getenv("ITIGRIS_DEPARTAMENT_ID"))
-    ITIGRIS_KEY = str(os.getenv("ITIGRIS_KEY"))
-    ITIGRIS_USER_ID = int(os.getenv("ITIGRIS_USER_ID"))
-    ITIGRIS_SERVICE_TYPE_ID = int(os.getenv("ITIGRIS_SERVICE_TYPE_ID"))
-
-    BITRIX_WEBHOOK_URL = str(os.getenv("BITRIX_WEBHOOK_URL"))
+    def __init__(self, dotenv_path: str | None = None) -> None:
+        self._dotenv_path = dotenv_path
+        self._dotenv_loaded = False
+        self._values: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in self.FIELDS:
+            raise AttributeError(name)
+
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = self._read(name)
+            return self._values[name]
+
+    def validate(self) -> None:
+        """Чтение и проверка всех переменных (ошибка - сразу при запуске)"""
+
+        for name in self.FIELDS:
+            getattr(self, name)
+
+    @contextmanager
+    def override(self, **values: Any) -> Iterator["EnvSettings"]:
+        """Подмена значений настроек на время блока"""
+
+        unknown = set(values) - set(self.FIELDS)
+        if unknown:
+            raise AttributeError(f"Неизвестные настройки: {', '.join(sorted(unknown))}")
+
+        with self._lock:
+            missing = object()
+            previous = {name: self._values.get(name, missing) for name in values}
+            self._values.update(values)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                for name, value in previous.items():
+                    if value is missing:
+                        self._values.pop(name, None)
+                    else:
+                        self._values[name] = value
+
+    def reload(self) -> None:
+        """Сброс кэша: значения будут прочитаны заново при следующем обращении"""
+
+        with self._lock:
+            self._values.clear()
+            self._dotenv_loaded = False
+
+    def _read(self, name: str) -> Any:
+        """Чтение и преобразование одной переменной (под блокировкой)"""
+
+        if not self._dotenv_loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv(self._dotenv_path)
+            self._dotenv_loaded = True
+
+        value = os.getenv(name)
+        if not value:
+            if name in self.OPTIONAL:
+                return None
+            raise ValueError(f"Не задана переменная окружения {name}")
+
+        try:
+            return self.FIELDS[name](value)
+        except ValueError:
+            raise ValueError(
+                f"Некорректное значение переменной окружения {name}: {value!r}"
+            ) from None
 
 
 env_settings = EnvSettings()
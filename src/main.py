@@ -1,22 +1,324 @@
+import argparse
+import asyncio
+import logging
 import time
+from collections.abc import Callable
+from typing import Any
 
-from src.constants import FETCH_PERIOD_MINUTES
+from src.constants import (
+    FETCH_PERIOD_MINUTES,
+    METRICS_PORT,
+    QUEUE_WORKERS,
+    SHARD_PROCESSES,
+    WEBHOOK_PORT,
+)
+from src.models import Lead, RegistryRecord
 from src.services.bitrix import BitrixService
+from src.services.cache import TTLCache, bitrix_leads, client_searches
+from src.services.http import HttpClient
 from src.services.itigris import ItigrisService
-
-record_id_to_lead_id: dict[int, int] = {}  # ID записи -> ID лида
-explored_order_ids: set[int] = set()  # ID заказа, которые уже были обработаны
+from src.services.metrics import MetricsServer, metrics
+from src.services.shards import ShardPool
+from src.services.sync import SyncEngine
+from src.services.tenants import Tenant, default_tenant, load_tenants, use_tenant
+from src.services.work_queue import Job, JobDeferred, WorkerPool, WorkQueue
 
 
 def main() -> None:
     """Входная точка в приложение"""
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mode",
+        choices=["queue", "async", "sharded"],
+        default="queue",
+        help=(
+            "queue - опрос ставит лиды и записи в постоянную очередь с повторами, "
+            "async - опрос и обработка в одном асинхронном цикле, "
+            "sharded - очередь разбирают процессы, владеющие разделами клиентов"
+        ),
+    )
+    parser.add_argument("--workers", type=int, default=QUEUE_WORKERS)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=SHARD_PROCESSES,
+        help="Количество процессов-обработчиков в режиме sharded",
+    )
+    parser.add_argument(
+        "--tenants",
+        help=(
+            "JSON-файл со списком компаний для синхронизации одним процессом "
+            "(по умолчанию одна компания из переменных окружения)"
+        ),
+    )
+    parser.add_argument(
+        "--webhook",
+        action="store_true",
+        help="Принимать вебхуки Bitrix24 о лидах (опрос остается для сверки)",
+    )
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="Порт для метрик Prometheus (/metrics), 0 - не запускать",
+    )
+    parser.add_argument(
+        "--json-logs",
+        action="store_true",
+        help="Писать замеры этапов синхронизации в stdout JSON-строками",
+    )
+    args = parser.parse_args()
+
+    if args.json_logs:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.metrics_port:
+        MetricsServer(port=args.metrics_port).start()
+
+    # У каждой компании свое хранилище: ID записи -> ID лида, ID заказов,
+    # которые уже были обработаны, и курсоры опроса сохраняются между перезапусками
+    tenants = load_tenants(args.tenants) if args.tenants else [default_tenant()]
+    work_queues = {tenant.name: WorkQueue(tenant.state) for tenant in tenants}
+
+    if args.webhook:
+        from src.services.webhook import BitrixWebhookServer
+
+        BitrixWebhookServer(tenants, work_queues, port=args.port).start()
+
+    if args.mode == "queue":
+        run_queue(tenants, work_queues, args.workers)
+    elif args.mode == "sharded":
+        run_sharded(tenants, work_queues, args.processes)
+    else:
+        # Лиды из вебхуков ставятся в очереди работ, их разбирает пул потоков
+        if args.webhook:
+            start_pool(tenants, work_queues, args.workers)
+        run_async(tenants)
+
+
+def start_pool(
+    tenants: list[Tenant],
+    work_queues: dict[str, WorkQueue],
+    workers: int,
+) -> WorkerPool:
+    """Запуск общего пула потоков, разбирающего очереди компаний по кругу"""
+
+    pool = WorkerPool(workers=workers)
+    for tenant in tenants:
+        pool.add_queue(
+            work_queues[tenant.name],
+            tenant_handlers(tenant),
+            tenant_batches(tenant),
+        )
+    pool.start()
+    return pool
+
+
+def run_async(tenants: list[Tenant]) -> None:
+    """Цикл опроса с параллельной обработкой в асинхронном движке"""
+
+    engine = SyncEngine()
+
+    while True:
+        asyncio.run(engine.run_tenants(tenants))
+
+        for tenant in tenants:
+            tenant.state.flush()
+            tenant.state.compact()
+
+        print(f"Статистика HTTP-соединений: {HttpClient.stats()}")
+        print(f"Лимиты запросов по хостам: {HttpClient.limits_stats()}")
+        print(f"Статистика кэшей Itigris: {TTLCache.all_stats()}")
+        print(
+            "Объединенные запросы: "
+            f"{client_searches.name}={client_searches.stats()}, "
+            f"{bitrix_leads.name}={bitrix_leads.stats()}"
+        )
+
+        time.sleep(60 * FETCH_PERIOD_MINUTES)
+
+
+def run_queue(
+    tenants: list[Tenant],
+    work_queues: dict[str, WorkQueue],
+    workers: int,
+) -> None:
+    """
+    Цикл опроса, ставящий работы в очереди компаний, и общий пул потоков,
+    разбирающий их по кругу
+    """
+
+    start_pool(tenants, work_queues, workers)
+
+    while True:
+        for tenant in tenants:
+            work_queue = work_queues[tenant.name]
+
+            with (
+                use_tenant(tenant),
+                metrics.span("cycle", mode="queue", tenant=tenant.name),
+            ):
+                poll_tenant(tenant, work_queue)
+
+            compact_tenant(tenant, work_queue)
+
+        print(f"Статистика HTTP-соединений: {HttpClient.stats()}")
+        print(f"Лимиты запросов по хостам: {HttpClient.limits_stats()}")
+        print(f"Статистика кэшей Itigris: {TTLCache.all_stats()}")
+        print(
+            "Объединенные запросы: "
+            f"{client_searches.name}={client_searches.stats()}, "
+            f"{bitrix_leads.name}={bitrix_leads.stats()}"
+        )
+
+        time.sleep(60 * FETCH_PERIOD_MINUTES)
+
+
+def run_sharded(
+    tenants: list[Tenant],
+    work_queues: dict[str, WorkQueue],
+    processes: int,
+) -> None:
+    """
+    Цикл опроса, ставящий работы в очереди компаний, и процессы-обработчики,
+    каждый из которых владеет разделом клиентов (основной процесс - координатор)
+    """
+
+    pool = ShardPool(tenants, processes=processes)
+    pool.start()
+
     while True:
-        BitrixService.handle_new_leads(record_id_to_lead_id)
-        ItigrisService.handle_finished_records(record_id_to_lead_id, explored_order_ids)
+        for tenant in tenants:
+            work_queue = work_queues[tenant.name]
+
+            with (
+                use_tenant(tenant),
+                metrics.span("cycle", mode="sharded", tenant=tenant.name),
+            ):
+                poll_tenant(tenant, work_queue)
+                pool.process(tenant, work_queue)
+
+            compact_tenant(tenant, work_queue)
+
+        print(f"Статистика HTTP-соединений: {HttpClient.stats()}")
+        print(f"Лимиты запросов по хостам: {HttpClient.limits_stats()}")
 
         time.sleep(60 * FETCH_PERIOD_MINUTES)
 
 
+def poll_tenant(tenant: Tenant, work_queue: WorkQueue) -> None:
+    """Постановка новых лидов и завершенных записей компании в очередь"""
+
+    state = tenant.state
+    BitrixService.handle_new_leads(
+        state.record_id_to_lead_id,
+        state.watermarks,
+        state.lead_versions,
+        work_queue=work_queue,
+    )
+    ItigrisService.handle_finished_records(
+        state.record_id_to_lead_id,
+        state.explored_order_ids,
+        state.watermarks,
+        work_queue=work_queue,
+        lead_hashes=state.lead_hashes,
+    )
+
+
+def compact_tenant(tenant: Tenant, work_queue: WorkQueue) -> None:
+    """Запись состояния компании и удаление устаревших записей и работ"""
+
+    state = tenant.state
+    state.flush()
+    state.compact()
+    work_queue.compact(state.ttl_days)
+
+    print(f"Статистика очереди работ {tenant.name}: {work_queue.stats()}")
+
+
+def tenant_handlers(tenant: Tenant) -> dict[str, Callable[[dict], Any]]:
+    """Обработчики работ очереди компании (выполняются от ее имени)"""
+
+    state = tenant.state
+
+    def handle_lead(payload: dict) -> None:
+        with use_tenant(tenant):
+            BitrixService.process_lead(
+                Lead.from_payload(payload["lead"]),
+                tenant.tokens.get_token(),
+                state.record_id_to_lead_id,
+                lead_full=Lead.from_payload(payload["lead_full"])
+                if payload.get("lead_full")
+                else None,
+                lead_versions=state.lead_versions,
+                raise_errors=True,
+                lead_appointments=state.lead_appointments,
+            )
+        state.flush()
+
+    def handle_record(payload: dict) -> tuple[set[int], dict[int, dict]]:
+        # Обновление лида отправляется пачкой (tenant_batches), запись
+        # отмечается обработанной после него
+        record = RegistryRecord.from_payload(payload)
+        checked: set[int] = set()
+        updates: dict[int, dict] = {}
+        with use_tenant(tenant):
+            ItigrisService.process_record(
+                record,
+                tenant.tokens.get_token(),
+                state.record_id_to_lead_id,
+                checked,
+                updates=updates,
+                raise_errors=True,
+                lead_hashes=state.lead_hashes,
+            )
+
+        # Лида или заказа по записи еще нет: запись поставит следующий опрос
+        if record.id not in checked:
+            raise JobDeferred(f"запись {record.id} пока не сопоставлена с заказом")
+
+        return checked, updates
+
+    return {"lead": handle_lead, "record": handle_record}
+
+
+def tenant_batches(
+    tenant: Tenant,
+) -> dict[str, Callable[[list[tuple[Job, Any]]], dict[int, str]]]:
+    """
+    Отправка результатов работ очереди компании пачкой: обновления лидов
+    по записям, собранные за разбор очереди, уходят в Bitrix24 через batch
+    """
+
+    state = tenant.state
+
+    def flush_records(
+        results: list[tuple[Job, tuple[set[int], dict[int, dict]]]],
+    ) -> dict[int, str]:
+        updates: dict[int, dict] = {}
+        for _, (_, lead_updates) in results:
+            updates.update(lead_updates)
+
+        with use_tenant(tenant):
+            errors = ItigrisService.send_lead_updates(updates, state.lead_hashes)
+
+        failed = {}
+        for job, (checked, lead_updates) in results:
+            error = next((errors[id] for id in lead_updates if id in errors), None)
+            if error:
+                failed[job.id] = str(error)
+                continue
+
+            for record_id in checked:
+                state.explored_order_ids.add(record_id)
+
+        state.flush()
+        return failed
+
+    return {"record": flush_records}
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,238 @@
+from dataclasses import asdict, dataclass, fields
+
+# Поля рецепта очков в API Itigris, в порядке полей Prescription
+PRESCRIPTION_API_FIELDS = (
+    "sphOd",
+    "sphOs",
+    "cylOd",
+    "cylOs",
+    "axOd",
+    "axOs",
+    "prism1DioptreOd",
+    "prism1DioptreOs",
+    "prism2DioptreOd",
+    "prism2DioptreOs",
+    "prism1BaseOd",
+    "prism1BaseOs",
+    "prism2BaseOd",
+    "prism2BaseOs",
+    "addidationOd",
+    "addidationOs",
+    "dpp",
+    "dppOd",
+    "dppOs",
+    "visusOd",
+    "visusOs",
+    "comments",
+)
+
+# Поля линзы одного глаза в API Itigris, в порядке полей LensEye
+LENS_EYE_API_FIELDS = (
+    "dioptre",
+    "cylinder",
+    "axis",
+    "add",
+    "curvatureRadius",
+    "diameter",
+)
+
+
+@dataclass(slots=True)
+class Lead:
+    """Лид Bitrix24 (из crm.lead.list заполнены только ID, ФИО и DATE_MODIFY)"""
+
+    id: int
+    name: str | None = None
+    second_name: str | None = None
+    last_name: str | None = None
+    status_id: str | None = None
+    date_modify: str | None = None
+    phone: str | None = None
+    email: str | None = None
+    gender: bool = False
+    appointment: str | None = None
+
+    @classmethod
+    def from_bitrix(cls, data: dict) -> "Lead":
+        """Лид из ответа Bitrix24"""
+
+        return cls(
+            id=int(data["ID"]),
+            name=data.get("NAME"),
+            second_name=data.get("SECOND_NAME"),
+            last_name=data.get("LAST_NAME"),
+            status_id=data.get("STATUS_ID"),
+            date_modify=data.get("DATE_MODIFY"),
+            phone=_first_value(data.get("PHONE")),
+            email=_first_value(data.get("EMAIL")),
+            gender=data.get("UF_CRM_1762957506003") == "223",
+            appointment=data.get("UF_CRM_1760092417949"),
+        )
+
+    @classmethod
+    def from_payload(cls, data: dict) -> "Lead":
+        """Лид из работы очереди (в том числе поставленной до появления моделей)"""
+
+        return cls.from_bitrix(data) if "ID" in data else cls(**data)
+
+    def to_payload(self) -> dict:
+        """Лид для работы очереди"""
+
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class RegistryRecord:
+    """Запись реестра Itigris"""
+
+    id: int
+    client_id: int | None = None
+    status: str | None = None
+    appointment: str | None = None
+
+    @classmethod
+    def from_itigris(cls, data: dict) -> "RegistryRecord":
+        """Запись из ответа Itigris"""
+
+        return cls(
+            id=int(data.get("id", 0)),
+            client_id=(data.get("client") or {}).get("id"),
+            status=data.get("status"),
+            appointment=data.get("appointment"),
+        )
+
+    @classmethod
+    def from_payload(cls, data: dict) -> "RegistryRecord":
+        """Запись из работы очереди (в том числе поставленной до появления моделей)"""
+
+        return cls.from_itigris(data) if "client" in data else cls(**data)
+
+    def to_payload(self) -> dict:
+        """Запись для работы очереди"""
+
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class Order:
+    """Заказ клиента Itigris с заранее посчитанными суммой и скидкой"""
+
+    id: int
+    status: str | None
+    sum: float  # Сумма к оплате
+    discount: float
+    total: float  # Сумма заказа без скидки
+    discount_percent: int
+
+    @classmethod
+    def from_itigris(cls, data: dict) -> "Order":
+        """Заказ из ответа Itigris"""
+
+        amount = float(data.get("sum", 0))
+        discount = float(data.get("discount", 0))
+        total = amount + discount
+
+        return cls(
+            id=int(data.get("id", 0)),
+            status=data.get("status"),
+            sum=amount,
+            discount=discount,
+            total=total,
+            discount_percent=int(discount / total * 100) if total else 0,
+        )
+
+
+@dataclass(slots=True)
+class Prescription:
+    """Рецепт очков (поля в порядке PRESCRIPTION_API_FIELDS)"""
+
+    sph_od: object = None
+    sph_os: object = None
+    cyl_od: object = None
+    cyl_os: object = None
+    ax_od: object = None
+    ax_os: object = None
+    prism1_dioptre_od: object = None
+    prism1_dioptre_os: object = None
+    prism2_dioptre_od: object = None
+    prism2_dioptre_os: object = None
+    prism1_base_od: object = None
+    prism1_base_os: object = None
+    prism2_base_od: object = None
+    prism2_base_os: object = None
+    addidation_od: object = None
+    addidation_os: object = None
+    dpp: object = None
+    dpp_od: object = None
+    dpp_os: object = None
+    visus_od: object = None
+    visus_os: object = None
+    comments: object = None
+
+    @classmethod
+    def from_itigris(cls, data: dict) -> "Prescription":
+        """Рецепт из ответа Itigris"""
+
+        return cls(*(data.get(field) for field in PRESCRIPTION_API_FIELDS))
+
+    def api_items(self) -> list[tuple[str, object]]:
+        """Пары (поле API, значение) в порядке PRESCRIPTION_API_FIELDS"""
+
+        return [
+            (api_field, getattr(self, field.name))
+            for api_field, field in zip(PRESCRIPTION_API_FIELDS, fields(self))
+        ]
+
+
+@dataclass(slots=True)
+class LensEye:
+    """Параметры контактной линзы одного глаза (поля в порядке LENS_EYE_API_FIELDS)"""
+
+    dioptre: object = None
+    cylinder: object = None
+    axis: object = None
+    add: object = None
+    curvature_radius: object = None
+    diameter: object = None
+
+    @classmethod
+    def from_itigris(cls, data: dict | None) -> "LensEye":
+        """Параметры линзы из ответа Itigris"""
+
+        data = data or {}
+        return cls(*(data.get(field) for field in LENS_EYE_API_FIELDS))
+
+    def api_items(self) -> list[tuple[str, object]]:
+        """Пары (поле API, значение) в порядке LENS_EYE_API_FIELDS"""
+
+        return [
+            (api_field, getattr(self, field.name))
+            for api_field, field in zip(LENS_EYE_API_FIELDS, fields(self))
+        ]
+
+
+@dataclass(slots=True)
+class ContactLensPrescription:
+    """Рецепт контактных линз"""
+
+    model: object = None
+    color: object = None
+    left_eye: LensEye | None = None
+    right_eye: LensEye | None = None
+
+    @classmethod
+    def from_itigris(cls, data: dict) -> "ContactLensPrescription":
+        """Рецепт из ответа Itigris"""
+
+        return cls(
+            model=data.get("model"),
+            color=data.get("color"),
+            left_eye=LensEye.from_itigris(data.get("leftEye")),
+            right_eye=LensEye.from_itigris(data.get("rightEye")),
+        )
+
+
+def _first_value(values: list[dict] | None) -> str | None:
+    """Первое значение мультиполя Bitrix24 (PHONE, EMAIL)"""
+
+    return (values or [{}])[0].get("VALUE")
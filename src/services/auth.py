@@ -0,0 +1,123 @@
+import base64
+import json
+import threading
+import time
+from collections.abc import Callable
+
+from src.constants import (
+    ITIGRIS_TOKEN_REFRESH_MARGIN_SECONDS,
+    ITIGRIS_TOKEN_TTL_SECONDS,
+)
+
+
+class ItigrisTokenManager:
+    """
+    Кэш токена доступа Itigris: повторно использует accessToken до истечения,
+    обновляет его заранее в фоне и выполняет один вход на всех при ответе 401
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = ITIGRIS_TOKEN_TTL_SECONDS,
+        refresh_margin_seconds: float = ITIGRIS_TOKEN_REFRESH_MARGIN_SECONDS,
+        login: Callable[[], str] | None = None,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        # Функция входа (по умолчанию - с учетными данными из окружения)
+        self.login = login
+
+        self._token: str | None = None
+        self._expires_at: float = 0.0
+        self._lock = threading.Lock()
+        self._background_refresh: threading.Thread | None = None
+
+    # MARK: Tokens
+    def get_token(self) -> str:
+        """Получение действующего токена (вход выполняется только при необходимости)"""
+
+        now = time.time()
+        token = self._token
+
+        if token and now < self._expires_at - self.refresh_margin_seconds:
+            return token
+
+        if token and now < self._expires_at:
+            # Токен еще действует, но скоро истечет: обновляем в фоне
+            self._start_background_refresh()
+            return token
+
+        return self.refresh(stale_token=token)
+
+    def refresh(self, stale_token: str | None = None) -> str:
+        """
+        Повторный вход в систему. Если токен уже обновил другой поток,
+        возвращается новый токен без лишнего запроса
+        """
+
+        with self._lock:
+            if self._token and self._token != stale_token:
+                if time.time() < self._expires_at:
+                    return self._token
+
+            return self._login()
+
+    def invalidate(self) -> None:
+        """Сброс закэшированного токена"""
+
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+    def _login(self) -> str:
+        """Вход в Itigris и сохранение токена (вызывается под блокировкой)"""
+
+        if self.login is not None:
+            token = self.login()
+        else:
+            from src.services.itigris import ItigrisService
+
+            token = ItigrisService.login()
+
+        self._token = token
+        self._expires_at = self._token_expiry(token)
+        return token
+
+    def _start_background_refresh(self) -> None:
+        """Запуск фонового обновления токена, если оно еще не запущено"""
+
+        with self._lock:
+            if self._background_refresh and self._background_refresh.is_alive():
+                return
+
+            self._background_refresh = threading.Thread(
+                target=self._refresh_in_background,
+                args=(self._token,),
+                daemon=True,
+            )
+            self._background_refresh.start()
+
+    def _refresh_in_background(self, stale_token: str | None) -> None:
+        """Фоновое обновление токена; при ошибке остается старый токен"""
+
+        try:
+            self.refresh(stale_token=stale_token)
+        except Exception as e:
+            print(f"Ошибка при фоновом обновлении токена Itigris: {e}")
+
+    def _token_expiry(self, token: str) -> float:
+        """Время истечения токена: поле exp из JWT или настроенный TTL"""
+
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+            if exp:
+                return float(exp)
+        except Exception:
+            pass
+
+        return time.time() + self.ttl_seconds
+
+
+itigris_tokens = ItigrisTokenManager()
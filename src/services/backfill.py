@@ -0,0 +1,256 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from src.constants import BACKFILL_CHUNK_DAYS, BACKFILL_WORKERS, BITRIX_BATCH_SIZE
+from src.services.bitrix import BitrixService
+from src.services.itigris import ItigrisService
+from src.services.state import StateStore
+from src.services.tenants import current_tenant
+
+
+@dataclass
+class BackfillChunk:
+    """Отрезок периода догрузки: [start, end)"""
+
+    start: date
+    end: date
+
+    @property
+    def checkpoint_key(self) -> str:
+        """Ключ отметки об обработке отрезка в хранилище курсоров"""
+
+        return f"backfill:{self.start.isoformat()}:{self.end.isoformat()}"
+
+    def __str__(self) -> str:
+        return f"{self.start.isoformat()}..{self.end.isoformat()}"
+
+
+@dataclass
+class BackfillReport:
+    """Расхождения и результат обработки одного отрезка"""
+
+    chunk: str
+    skipped: bool = False  # Отрезок уже обработан (есть отметка)
+    leads_found: int = 0
+    leads_missing: list[int] = field(default_factory=list)  # Лиды без записи
+    records_found: int = 0
+    records_unmatched: list[int] = field(default_factory=list)  # Записи без лида
+    lead_updates: dict[int, dict] = field(default_factory=dict)  # ID лида -> поля
+    # lead:ID - обработка лида, record:ID - записи, lead-update:ID - обновление лида
+    errors: dict[str, str] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class Backfill:
+    """
+    Догрузка пропущенного за период (например, после простоя): период
+    делится на отрезки по chunk_days дней, отрезки обрабатываются параллельно.
+    Для каждого отрезка лиды IN_PROCESS без записи в Itigris проводятся
+    через process_lead, а по записям REALIZED с известным лидом
+    отправляются недостающие обновления лидов. Обработанные без ошибок
+    завершившиеся отрезки отмечаются в хранилище, поэтому прерванная
+    догрузка продолжается с необработанных (отрезок, который еще не
+    закончился, при следующем запуске обрабатывается снова). В режиме
+    dry_run ничего не изменяется, а отчет содержит найденные расхождения
+    """
+
+    def __init__(
+        self,
+        state: StateStore,
+        date_from: date,
+        date_to: date,
+        chunk_days: int = BACKFILL_CHUNK_DAYS,
+        workers: int = BACKFILL_WORKERS,
+        dry_run: bool = False,
+        reconcile: bool = False,
+        restart: bool = False,
+    ) -> None:
+        self.state = state
+        self.date_from = date_from
+        self.date_to = date_to
+        self.chunk_days = chunk_days
+        self.workers = workers
+        self.dry_run = dry_run
+        # Перепроверять и уже обработанные записи (неизменные лиды
+        # не отправляются благодаря хэшам полей)
+        self.reconcile = reconcile
+        # Не учитывать отметки прошлых запусков
+        self.restart = restart
+
+        self._mapped_lead_ids: set[int] = set()
+        self._lock = threading.Lock()
+
+    def chunks(self) -> list[BackfillChunk]:
+        """Отрезки периода [date_from, date_to]"""
+
+        chunks = []
+        start = self.date_from
+        while start <= self.date_to:
+            end = min(
+                start + timedelta(days=self.chunk_days),
+                self.date_to + timedelta(days=1),
+            )
+            chunks.append(BackfillChunk(start, end))
+            start = end
+
+        return chunks
+
+    def run(self) -> list[BackfillReport]:
+        """Обработка всех отрезков, отчеты в порядке отрезков"""
+
+        self._mapped_lead_ids = {
+            lead_id for _, lead_id in self.state.record_id_to_lead_id.items()
+        }
+
+        # Отрезки выполняются в контексте текущей компании
+        with ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="backfill",
+        ) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self.run_chunk, chunk)
+                for chunk in self.chunks()
+            ]
+            reports = [future.result() for future in futures]
+
+        self.state.flush()
+        return reports
+
+    def run_chunk(self, chunk: BackfillChunk) -> BackfillReport:
+        """Обработка одного отрезка: лиды и записи"""
+
+        report = BackfillReport(chunk=str(chunk))
+        if not self.restart and chunk.checkpoint_key in self.state.watermarks:
+            report.skipped = True
+            return report
+
+        print(f"Догрузка за {chunk}")
+        try:
+            token = current_tenant().tokens.get_token()
+            self._leads(chunk, token, report)
+            self._records(chunk, token, report)
+        except Exception as e:
+            print(f"Ошибка при догрузке за {chunk}: {e}")
+            report.errors[str(chunk)] = str(e)
+
+        if not self.dry_run:
+            # Незакончившийся отрезок еще пополнится лидами и записями
+            if not report.errors and chunk.end <= date.today():
+                self.state.watermarks[chunk.checkpoint_key] = datetime.now().isoformat(
+                    timespec="seconds"
+                )
+            self.state.flush()
+
+        return report
+
+    # MARK: Leads
+    def _leads(self, chunk: BackfillChunk, token: str, report: BackfillReport) -> None:
+        """Лиды, измененные за отрезок, для которых не создана запись"""
+
+        leads = BitrixService.iter_leads(
+            {
+                "=STATUS_ID": "IN_PROCESS",
+                ">=DATE_MODIFY": chunk.start.isoformat(),
+                "<DATE_MODIFY": chunk.end.isoformat(),
+            }
+        )
+        lead_versions = self.state.lead_versions
+
+        while batch := list(islice(leads, BITRIX_BATCH_SIZE)):
+            report.leads_found += len(batch)
+            missing = [
+                lead
+                for lead in batch
+                if lead.id not in self._mapped_lead_ids
+                and lead_versions.get(lead.id) != lead.date_modify
+            ]
+            report.leads_missing.extend(lead.id for lead in missing)
+            if self.dry_run or not missing:
+                continue
+
+            leads_full, errors = BitrixService.get_leads_batch(
+                [lead.id for lead in missing]
+            )
+            for lead in missing:
+                if lead.id in errors:
+                    report.errors[f"lead:{lead.id}"] = str(errors[lead.id])
+                    continue
+
+                try:
+                    BitrixService.process_lead(
+                        lead,
+                        token,
+                        self.state.record_id_to_lead_id,
+                        lead_full=leads_full.get(lead.id),
+                        lead_versions=lead_versions,
+                        raise_errors=True,
+                        lead_appointments=self.state.lead_appointments,
+                    )
+                except Exception as e:
+                    report.errors[f"lead:{lead.id}"] = str(e)
+                else:
+                    with self._lock:
+                        self._mapped_lead_ids.add(lead.id)
+
+    # MARK: Records
+    def _records(
+        self,
+        chunk: BackfillChunk,
+        token: str,
+        report: BackfillReport,
+    ) -> None:
+        """Записи REALIZED с приемом в отрезке, по которым не обновлен лид"""
+
+        record_id_to_lead_id = self.state.record_id_to_lead_id
+        explored_order_ids = self.state.explored_order_ids
+
+        # Записи отмечаются обработанными только после отправки обновлений
+        checked: set[int] = set()
+        updates: dict[int, dict] = {}
+        for record in ItigrisService.iter_records(
+            token,
+            status="REALIZED",
+            appointment_from=chunk.start.isoformat(),
+            appointment_to=(chunk.end - timedelta(days=1)).isoformat(),
+        ):
+            report.records_found += 1
+            if record.id not in record_id_to_lead_id:
+                report.records_unmatched.append(record.id)
+                continue
+
+            if not self.reconcile and record.id in explored_order_ids:
+                continue
+
+            try:
+                ItigrisService.process_record(
+                    record,
+                    token,
+                    record_id_to_lead_id,
+                    checked,
+                    updates=updates,
+                    raise_errors=True,
+                    lead_hashes=self.state.lead_hashes,
+                )
+            except Exception as e:
+                report.errors[f"record:{record.id}"] = str(e)
+
+        report.lead_updates = updates
+        if self.dry_run:
+            return
+
+        errors = ItigrisService.send_lead_updates(updates, self.state.lead_hashes)
+        for lead_id, error in errors.items():
+            report.errors[f"lead-update:{lead_id}"] = str(error)
+
+        ItigrisService.mark_explored(
+            checked,
+            errors,
+            record_id_to_lead_id,
+            explored_order_ids,
+        )
@@ -1,40 +1,94 @@
-import time
+import threading
+from collections.abc import Iterable, MutableMapping
 from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import TYPE_CHECKING, Iterator
+from urllib.parse import quote
 
-import requests
-
-from src.constants import FETCH_PERIOD_MINUTES
-from src.env import env_settings
+from src.constants import (
+    BITRIX_BATCH_SIZE,
+    BITRIX_LEAD_LIST_FIELDS,
+    FETCH_PERIOD_MINUTES,
+)
+from src.models import Lead
+from src.services.cache import bitrix_leads
+from src.services.http import HttpClient
+from src.services.metrics import instrumented
 from src.services.itigris import ItigrisService
+from src.services.state import Watermark
+from src.services.tenants import current_tenant
+
+if TYPE_CHECKING:
+    from src.services.work_queue import WorkQueue
 
 
+@instrumented
 class BitrixService:
+    _lead_versions_lock = threading.Lock()
+
     # MARK: Leads
     @classmethod
-    def get_leads(cls, filters: dict | None = None) -> list[dict]:
-        """Получение лидов с фильтрами"""
-
-        response = requests.post(
-            url=f"{env_settings.BITRIX_WEBHOOK_URL}/crm.lead.list",
-            json={
-                "filter": filters if filters else {},
-                "select": ["*"],
-            },
-        )
+    def iter_leads(
+        cls,
+        filters: dict | None = None,
+        select: list[str] | None = None,
+    ) -> Iterator[Lead]:
+        """
+        Постраничное получение лидов с фильтрами. Страницы запрашиваются
+        по мере чтения, пока Bitrix24 возвращает поле next
+        """
 
-        if response.status_code != 200:
-            raise Exception(
-                f"Ошибка при получении лидов: {response.text}, статус: {response.status_code}"
+        start = 0
+        while True:
+            response = HttpClient.post(
+                url=f"{current_tenant().bitrix_webhook_url}/crm.lead.list",
+                json={
+                    "filter": filters if filters else {},
+                    "select": select if select else BITRIX_LEAD_LIST_FIELDS,
+                    "order": {"ID": "ASC"},
+                    "start": start,
+                },
             )
 
-        return response.json().get("result", [])
+            if response.status_code != 200:
+                raise Exception(
+                    f"Ошибка при получении лидов: {response.text}, статус: {response.status_code}"
+                )
+
+            data = response.json()
+            for lead in data.get("result", []):
+                yield Lead.from_bitrix(lead)
+
+            if data.get("next") is None:
+                return
+            start = data["next"]
+
+    @classmethod
+    def get_leads(
+        cls,
+        filters: dict | None = None,
+        select: list[str] | None = None,
+    ) -> list[Lead]:
+        """Получение всех лидов с фильтрами"""
+
+        return list(cls.iter_leads(filters, select))
 
     @classmethod
-    def get_lead(cls, id: int) -> dict:
-        """Получение лида по ID"""
+    def get_lead(cls, id: int) -> Lead | None:
+        """
+        Получение лида по ID. Одновременные запросы одного лида (например,
+        повторные события вебхука) выполняются одним запросом
+        """
 
-        response = requests.post(
-            url=f"{env_settings.BITRIX_WEBHOOK_URL}/crm.lead.get",
+        tenant = current_tenant()
+        return bitrix_leads.do((tenant.name, id), lambda: cls._fetch_lead(id))
+
+    @classmethod
+    def _fetch_lead(cls, id: int) -> Lead | None:
+        """Запрос лида по ID"""
+
+        response = HttpClient.post(
+            url=f"{current_tenant().bitrix_webhook_url}/crm.lead.get",
             json={
                 "ID": id,
             },
@@ -45,7 +99,8 @@ class BitrixService:
                 f"Ошибка при получении лидов: {response.text}, статус: {response.status_code}"
             )
 
-        return response.json().get("result", [])
+        lead = response.json().get("result")
+        return Lead.from_bitrix(lead) if lead else None
 
     @classmethod
     def get_lead_by_names(
@@ -53,15 +108,23 @@ class BitrixService:
         first_name: str,
         second_name: str,
         last_name: str,
-    ) -> dict:
-        """Поиск лида по имени, фамилии и отчеству"""
+    ) -> Lead | None:
+        """Поиск лида по имени, фамилии и отчеству (фильтр на стороне Bitrix24)"""
+
+        filters = {}
+        for field, value in (
+            ("=NAME", first_name),
+            ("=SECOND_NAME", second_name),
+            ("=LAST_NAME", last_name),
+        ):
+            if value is not None:
+                filters[field] = value
 
-        leads = cls.get_leads()
-        for lead in leads:
+        for lead in cls.iter_leads(filters):
             if (
-                lead.get("NAME") == first_name
-                and lead.get("SECOND_NAME") == second_name
-                and lead.get("LAST_NAME") == last_name
+                lead.name == first_name
+                and lead.second_name == second_name
+                and lead.last_name == last_name
             ):
                 return lead
 
@@ -69,8 +132,9 @@ class BitrixService:
     def update_lead(cls, id: int, fields: list[dict]) -> None:
         """Обновление лида в Bitrix24"""
 
-        response = requests.post(
-            url=f"{env_settings.BITRIX_WEBHOOK_URL}/crm.lead.update",
+        cls._forget_leads([id])
+        response = HttpClient.post(
+            url=f"{current_tenant().bitrix_webhook_url}/crm.lead.update",
             json={
                 "id": id,
                 "fields": fields,
@@ -84,6 +148,120 @@ class BitrixService:
 
         return response.json()
 
+    # MARK: Batch
+    @classmethod
+    def batch(
+        cls,
+        commands: dict[str, tuple[str, dict]],
+    ) -> tuple[dict[str, object], dict[str, str]]:
+        """
+        Выполнение команд через метод batch, по BITRIX_BATCH_SIZE команд
+        в запросе. Возвращает результаты и ошибки по ключам команд
+        """
+
+        results: dict[str, object] = {}
+        errors: dict[str, str] = {}
+
+        keys = list(commands)
+        for i in range(0, len(keys), BITRIX_BATCH_SIZE):
+            chunk = keys[i : i + BITRIX_BATCH_SIZE]
+
+            response = HttpClient.post(
+                url=f"{current_tenant().bitrix_webhook_url}/batch",
+                json={
+                    "halt": 0,
+                    "cmd": {
+                        key: f"{commands[key][0]}?{cls._build_query(commands[key][1])}"
+                        for key in chunk
+                    },
+                },
+            )
+
+            if response.status_code != 200:
+                # Запрос не выполнен целиком - ошибка относится ко всем командам
+                for key in chunk:
+                    errors[key] = f"{response.text}, статус: {response.status_code}"
+                continue
+
+            data = response.json().get("result", {})
+            result = data.get("result") or {}
+            result_error = data.get("result_error") or {}
+
+            for key in chunk:
+                if key in result_error:
+                    error = result_error[key]
+                    errors[key] = (
+                        (error.get("error_description") or error.get("error"))
+                        if isinstance(error, dict)
+                        else str(error)
+                    )
+                else:
+                    results[key] = result.get(key)
+
+        return results, errors
+
+    @classmethod
+    def get_leads_batch(
+        cls,
+        ids: list[int],
+    ) -> tuple[dict[int, Lead], dict[int, str]]:
+        """Получение полных лидов по ID через batch"""
+
+        results, errors = cls.batch(
+            {str(id): ("crm.lead.get", {"ID": id}) for id in ids},
+        )
+
+        return (
+            {int(key): Lead.from_bitrix(lead) for key, lead in results.items() if lead},
+            {int(key): error for key, error in errors.items()},
+        )
+
+    @classmethod
+    def update_leads_batch(cls, updates: dict[int, dict]) -> dict[int, str]:
+        """Обновление лидов через batch, возвращает ошибки по ID лида"""
+
+        cls._forget_leads(updates)
+        _, errors = cls.batch(
+            {
+                str(id): ("crm.lead.update", {"id": id, "fields": fields})
+                for id, fields in updates.items()
+            },
+        )
+
+        return {int(key): error for key, error in errors.items()}
+
+    @classmethod
+    def _forget_leads(cls, ids: Iterable[int]) -> None:
+        """Выполняемые получения лидов не разделяются после их изменения"""
+
+        keys = {(current_tenant().name, id) for id in ids}
+        bitrix_leads.forget(keys.__contains__)
+
+    @classmethod
+    def _build_query(cls, params: object, prefix: str = "") -> str:
+        """Кодирование параметров команды batch (аналог http_build_query в PHP)"""
+
+        if isinstance(params, dict):
+            items = params.items()
+        elif isinstance(params, list):
+            items = enumerate(params)
+        else:
+            if params is None:
+                value = ""
+            elif isinstance(params, bool):
+                value = "1" if params else "0"
+            else:
+                value = str(params)
+            return f"{quote(prefix, safe='[]')}={quote(value, safe='')}"
+
+        parts = []
+        for key, value in items:
+            parts.append(
+                cls._build_query(value, f"{prefix}[{key}]" if prefix else str(key))
+            )
+
+        return "&".join(part for part in parts if part)
+
     @classmethod
     def _convert_date(cls, date: str) -> str:
         """Функция утиилита для конвертации даты в формат Itigris"""
@@ -93,10 +271,209 @@ class BitrixService:
         return dt_utc.strftime("%Y-%m-%dT%H:%M:%S")
 
     @classmethod
-    def handle_new_leads(cls, record_id_to_lead_id: dict[int, int]) -> None:
+    def leads_watermark(
+        cls,
+        watermarks: MutableMapping[str, str] | None,
+    ) -> Watermark:
+        """Курсор опроса лидов по DATE_MODIFY"""
+
+        return Watermark(watermarks, "bitrix_leads", key=datetime.fromisoformat)
+
+    @classmethod
+    def new_leads_filters(cls, since: str | None = None) -> dict:
+        """
+        Фильтр лидов IN_PROCESS, обновленных начиная с since
+        (по умолчанию за последние FETCH_PERIOD_MINUTES минут)
+        """
+
+        return {
+            "=STATUS_ID": "IN_PROCESS",
+            ">=DATE_MODIFY": since
+            or (datetime.now() - timedelta(minutes=FETCH_PERIOD_MINUTES)).isoformat(),
+        }
+
+    @classmethod
+    def process_lead(
+        cls,
+        lead: Lead,
+        itigris_token: str,
+        record_id_to_lead_id: MutableMapping[int, int],
+        lead_full: Lead | None = None,
+        lead_versions: MutableMapping[int, str] | None = None,
+        raise_errors: bool = False,
+        lead_appointments: MutableMapping[int, str] | None = None,
+    ) -> None:
+        """
+        Обработка одного лида: поиск/создание клиента и создание записи в Itigris.
+        Полный лид можно передать заранее полученным через batch. Если передан
+        lead_versions, каждая версия лида (DATE_MODIFY) обрабатывается один раз,
+        даже если пришла и из вебхука, и из опроса. Если передан
+        lead_appointments, запись создается, только если время приема лида
+        изменилось с прошлой записи: DATE_MODIFY меняется и от обновления лида
+        по завершенной записи. При ошибке отметки снимаются, а с raise_errors
+        ошибка пробрасывается (для повтора)
+        """
+
+        if not cls.claim_lead_version(lead, lead_versions):
+            print(f"Лид {lead.id} уже обработан")
+            return
+
+        print(f"Обработка обновленного лида {lead.id}")
+        claimed, previous = False, None
+        try:
+            # Получение полного лида с полями email и phone
+            if lead_full is None:
+                lead_full = cls.get_lead(lead.id)
+
+            claimed, previous = cls.claim_lead_appointment(lead_full, lead_appointments)
+            if not claimed:
+                print(f"Запись по лиду {lead.id} на это время уже создана")
+                return
+
+            # Поиск клиента в Itigris по номеру телефона, если не найден - создание
+            client_id = ItigrisService.find_or_create_client(itigris_token, lead_full)
+
+            # Создание записи в Itigris
+            record_time = cls._convert_date(lead_full.appointment)
+            ItigrisService.create_record(client_id=client_id, time=record_time)
+
+            # Поиск созданной записи среди записей клиента на дату приема
+            record_id = ItigrisService.find_new_record(
+                token=itigris_token,
+                client_id=client_id,
+                appointment_time=record_time,
+                known_record_ids=record_id_to_lead_id,
+            )
+            if not record_id:
+                print(f"Записи для лида {client_id} не найдены")
+                return
+
+            record_id_to_lead_id[record_id] = lead.id
+
+            print(f"Лид {lead.id} обработан успешно")
+        except Exception as e:
+            print(f"Ошибка при обработке лида {lead.id}: {e}")
+            cls.release_lead_version(lead, lead_versions)
+            if claimed:
+                cls.release_lead_appointment(lead_full, lead_appointments, previous)
+            if raise_errors:
+                raise
+
+    @classmethod
+    def enqueue_lead(
+        cls,
+        work_queue: "WorkQueue",
+        lead: Lead,
+        lead_full: Lead | None = None,
+    ) -> bool:
         """
-        Обработка обнавленных лидов за последние FETCH_PERIOD_MINUTES минут
-        и статусом IN_PROCESS
+        Постановка версии лида в очередь работ (False, если она уже там).
+        Ключ один для опроса и вебхука: версия лида выполняется одной работой
+        """
+
+        return work_queue.enqueue(
+            "lead",
+            f"lead:{lead.id}:{lead.date_modify}",
+            {
+                "lead": lead.to_payload(),
+                "lead_full": lead_full.to_payload() if lead_full else None,
+            },
+        )
+
+    @classmethod
+    def claim_lead_version(
+        cls,
+        lead: Lead,
+        lead_versions: MutableMapping[int, str] | None,
+    ) -> bool:
+        """Отметка версии лида как взятой в обработку (False, если уже взята)"""
+
+        if lead_versions is None or not lead.date_modify:
+            return True
+
+        with cls._lead_versions_lock:
+            if lead_versions.get(lead.id) == lead.date_modify:
+                return False
+
+            lead_versions[lead.id] = lead.date_modify
+            return True
+
+    @classmethod
+    def release_lead_version(
+        cls,
+        lead: Lead,
+        lead_versions: MutableMapping[int, str] | None,
+    ) -> None:
+        """Снятие отметки с версии лида, обработка которой не удалась"""
+
+        if lead_versions is None or not lead.date_modify:
+            return
+
+        with cls._lead_versions_lock:
+            if lead_versions.get(lead.id) == lead.date_modify:
+                del lead_versions[lead.id]
+
+    @classmethod
+    def claim_lead_appointment(
+        cls,
+        lead: Lead,
+        lead_appointments: MutableMapping[int, str] | None,
+    ) -> tuple[bool, str | None]:
+        """
+        Отметка времени приема полного лида как взятого в обработку и прошлое
+        время приема (False, если запись на это время уже создана или время
+        прошлой записи неизвестно)
+        """
+
+        if lead_appointments is None:
+            return True, None
+
+        with cls._lead_versions_lock:
+            previous = lead_appointments.get(lead.id)
+            if previous is not None and previous in ("", lead.appointment):
+                return False, previous
+
+            lead_appointments[lead.id] = lead.appointment or ""
+            return True, previous
+
+    @classmethod
+    def release_lead_appointment(
+        cls,
+        lead: Lead,
+        lead_appointments: MutableMapping[int, str] | None,
+        previous: str | None = None,
+    ) -> None:
+        """
+        Снятие отметки времени приема, запись на которое не создана:
+        восстанавливается время прошлой записи лида, если она была
+        """
+
+        if lead_appointments is None:
+            return
+
+        with cls._lead_versions_lock:
+            if lead_appointments.get(lead.id) != (lead.appointment or ""):
+                return
+
+            if previous is None:
+                del lead_appointments[lead.id]
+            else:
+                lead_appointments[lead.id] = previous
+
+    @classmethod
+    def handle_new_leads(
+        cls,
+        record_id_to_lead_id: MutableMapping[int, int],
+        watermarks: MutableMapping[str, str] | None = None,
+        lead_versions: MutableMapping[int, str] | None = None,
+        work_queue: "WorkQueue | None" = None,
+        lead_appointments: MutableMapping[int, str] | None = None,
+    ) -> None:
+        """
+        Обработка обнавленных лидов со статусом IN_PROCESS: с момента
+        последнего успешного цикла (если передано хранилище курсоров)
+        или за последние FETCH_PERIOD_MINUTES минут. Если передана
+        очередь работ, лиды только ставятся в нее
         """
 
         print(
@@ -104,71 +481,51 @@ class BitrixService:
         )
 
         try:
-            filters = {
-                "=STATUS_ID": "IN_PROCESS",
-                ">DATE_MODIFY": (
-                    datetime.now() - timedelta(minutes=FETCH_PERIOD_MINUTES)
-                ).isoformat(),
-            }
-
-            # Получение лидов с фильтрами
-            leads = cls.get_leads(filters)
-            if not leads:
-                return
-
-            # Получение токена для работы с Itigris
-            itigris_token = ItigrisService.login()
-
-            for lead in leads:
-                print(f"Обработка обновленного лида {lead['ID']}")
-                try:
-                    # Получение полного лида с полями email и phone
-                    lead_full = cls.get_lead(lead["ID"])
-                    # Получение ID клиента в Itigris по номеру телефона
-                    client_id = ItigrisService.get_client_id_for_lead(
-                        token=itigris_token,
-                        phone=lead_full.get("PHONE", [{}])[0].get("VALUE"),
-                    )
-                    # Если клиент не найден, создаем нового
-                    if not client_id:
-                        client_id = ItigrisService.create_client(
-                            token=itigris_token,
-                            first_name=lead_full.get("NAME"),
-                            second_name=lead_full.get("SECOND_NAME"),
-                            last_name=lead_full.get("LAST_NAME"),
-                            phone=lead_full.get("PHONE", [{}])[0].get("VALUE"),
-                            email=lead_full.get("EMAIL", [{}])[0].get("VALUE"),
-                            gender=True
-                            if lead_full.get("UF_CRM_1762957506003") == "223"
-                            else False,
-                        )
-                        ItigrisService.prepare_client(itigris_token, client_id)
+            itigris_token = None
+            watermark = cls.leads_watermark(watermarks)
 
-                    # Создание записи в Itigris
-                    ItigrisService.create_record(
-                        client_id=client_id,
-                        time=cls._convert_date(lead_full.get("UF_CRM_1760092417949")),
-                    )
+            # Постраничное получение лидов с фильтрами
+            leads = (
+                lead
+                for lead in cls.iter_leads(cls.new_leads_filters(watermark.value))
+                if not watermark.is_seen(lead.id, lead.date_modify)
+            )
+            while chunk := list(islice(leads, BITRIX_BATCH_SIZE)):
+                # Токен Itigris (из кэша, вход только при истечении)
+                if itigris_token is None:
+                    itigris_token = current_tenant().tokens.get_token()
 
-                    time.sleep(3)
+                # Получение полных лидов одним запросом batch
+                leads_full, errors = cls.get_leads_batch([lead.id for lead in chunk])
 
-                    records = ItigrisService.get_records(itigris_token)
-                    if not records:
-                        print(f"Записи для лида {client_id} не найдены")
+                for lead in chunk:
+                    if lead.id in errors:
+                        print(f"Ошибка при обработке лида {lead.id}: {errors[lead.id]}")
+                        watermark.hold(lead.date_modify)
                         continue
 
-                    max_id = None
-                    for record in records:
-                        if not max_id:
-                            max_id = int(record.get("id", 0))
-                        else:
-                            if int(record.get("id", 0)) > max_id:
-                                max_id = int(record.get("id", 0))
+                    lead_full = leads_full.get(lead.id)
+                    if work_queue is not None:
+                        cls.enqueue_lead(work_queue, lead, lead_full)
+                        watermark.advance(lead.id, lead.date_modify)
+                        continue
 
-                    record_id_to_lead_id[max_id] = int(lead["ID"])
+                    # Лид с ошибкой будет получен снова в следующем цикле
+                    try:
+                        cls.process_lead(
+                            lead,
+                            itigris_token,
+                            record_id_to_lead_id,
+                            lead_full=lead_full,
+                            lead_versions=lead_versions,
+                            raise_errors=True,
+                            lead_appointments=lead_appointments,
+                        )
+                    except Exception:
+                        watermark.hold(lead.date_modify)
+                    else:
+                        watermark.advance(lead.id, lead.date_modify)
 
-                    print(f"Лид {lead['ID']} обработан успешно")
-                except Exception as e:
-                    print(f"Ошибка при обработке лида {lead['ID']}: {e}")
+            watermark.commit()
         except Exception as e:
             print(f"Ошибка при обработке лидов: {e}")
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+from src.constants import (
+    CACHE_MAX_SIZE,
+    CACHE_ORDERS_TTL_SECONDS,
+    CACHE_PRESCRIPTIONS_TTL_SECONDS,
+)
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов: пока выполняется вызов
+    с ключом, остальные потоки с тем же ключом не выполняют свой, а ждут
+    и получают его результат (или его исключение). Параллельная обработка
+    записей и лидов одного клиента делает один запрос к API, а не несколько
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._shared = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Результат func, общий для всех одновременных вызовов с ключом key"""
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+            else:
+                self._shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+        return call.value
+
+    def forget(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Выполняемые вызовы с подходящими ключами больше не разделяются:
+        следующие вызовы выполнятся заново (например, после изменения данных)
+        """
+
+        with self._lock:
+            for key in [key for key in self._calls if predicate(key)]:
+                del self._calls[key]
+
+    # MARK: Stats
+    def stats(self) -> dict[str, int]:
+        """Количество выполненных вызовов и вызовов, получивших чужой результат"""
+
+        with self._lock:
+            return {
+                "executed": self._executed,
+                "shared": self._shared,
+                "in_flight": len(self._calls),
+            }
+
+
+class _Call:
+    """Выполняемый вызов SingleFlight"""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кэш с временем жизни записей и счетчиками
+    попаданий и промахов. Пустые результаты (None) не кэшируются.
+    Одновременные промахи по одному ключу загружают значение один раз
+    """
+
+    _registry: list["TTLCache"] = []
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        max_size: int = CACHE_MAX_SIZE,
+    ) -> None:
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # Загрузки, начатые до сброса значений, не сохраняют результат в кэш
+        self._generation = 0
+        self._flight = SingleFlight(name)
+
+        TTLCache._registry.append(self)
+
+    # MARK: Values
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Значение из кэша или результат loader (сохраняется, если не None)"""
+
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] > now:
+                self._items.move_to_end(key)
+                self._hits += 1
+                return item[1]
+
+            self._misses += 1
+
+        return self._flight.do(key, lambda: self._load(key, loader))
+
+    def _load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Загрузка значения и сохранение, если кэш не сбрасывался за это время"""
+
+        generation = self._generation
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._store(key, value)
+
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохранение значения, самые старые записи вытесняются"""
+
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        """Сохранение значения (вызывается под блокировкой)"""
+
+        self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Удаление значения по ключу"""
+
+        self.invalidate_where(lambda item: item == key)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Удаление значений, ключи которых подходят под условие. Загрузки
+        этих ключей, начатые раньше, не разделяются с новыми вызовами
+        """
+
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                del self._items[key]
+            self._generation += 1
+        self._flight.forget(predicate)
+
+    def clear(self) -> None:
+        """Очистка кэша"""
+
+        self.invalidate_where(lambda key: True)
+
+    # MARK: Stats
+    def stats(self) -> dict[str, int]:
+        """Счетчики попаданий и промахов"""
+
+        with self._lock:
+            stats = {
+                "hits": self._hits,
+                "misses": self._misses,
+                "size": len(self._items),
+            }
+
+        stats["coalesced"] = self._flight.stats()["shared"]
+        return stats
+
+    @classmethod
+    def all_stats(cls) -> dict[str, dict[str, int]]:
+        """Счетчики всех созданных кэшей"""
+
+        return {cache.name: cache.stats() for cache in cls._registry}
+
+
+# Кэши Itigris: заказы и рецепты по ID клиента
+orders_by_client = TTLCache("orders_by_client", CACHE_ORDERS_TTL_SECONDS)
+prescriptions_by_client = TTLCache(
+    "prescriptions_by_client",
+    CACHE_PRESCRIPTIONS_TTL_SECONDS,
+)
+
+# Объединение одновременных запросов без кэширования результата:
+# поиск клиента Itigris по телефону и получение лида Bitrix24 по ID
+client_searches = SingleFlight("client_searches")
+bitrix_leads = SingleFlight("bitrix_leads")
@@ -0,0 +1,373 @@
+import base64
+import functools
+import gzip
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from src.services.tenants import registered_tenants
+
+if TYPE_CHECKING:
+    import requests
+    from requests.adapters import BaseAdapter
+
+CASSETTE_VERSION = 1
+
+# Поля запросов и ответов, значения которых не попадают в кассету
+SCRUBBED_FIELDS = frozenset(
+    {
+        "company",
+        "login",
+        "password",
+        "key",
+        "accessToken",
+        "refreshToken",
+        "application_token",
+        "auth",
+    }
+)
+SCRUBBED_VALUE = "***"
+
+# Заголовки ответа, сохраняемые в кассете
+RESPONSE_HEADERS = ("Content-Type", "Retry-After")
+
+
+class Cassette:
+    """
+    Запись и воспроизведение HTTP-обмена на уровне транспорта HttpClient.
+    В режиме record запросы выполняются и сохраняются вместе с ответами
+    и длительностью; в режиме replay ответы берутся из кассеты без сети,
+    с исходными задержками, деленными на speed (0 - без задержек).
+    Учетные данные вычищаются: адреса компаний заменяются на метки
+    ({bitrix:<name>} и т. п., поэтому секрет вебхука не сохраняется),
+    значения полей SCRUBBED_FIELDS - на ***, заголовки запросов
+    (Authorization) не сохраняются. Кассета - gzip-файл JSON-строк:
+    первая строка - заголовок с meta, далее по строке на запрос
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        speed: float = 1.0,
+        meta: dict | None = None,
+    ) -> None:
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Неизвестный режим кассеты: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.meta: dict[str, Any] = meta or {}
+        self.entries: list[dict] = []
+
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        # Ключ запроса -> номера записей, по порядку
+        self._exact: dict[tuple, list[int]] = defaultdict(list)
+        self._loose: dict[tuple, list[int]] = defaultdict(list)
+        self._used: set[int] = set()
+        self._stats = {
+            "requests": 0,
+            "bytes": 0,
+            "exact": 0,
+            "loose": 0,
+            "repeated": 0,
+            "unmatched": 0,
+        }
+
+        if mode == "replay":
+            self._load()
+
+    # MARK: File
+    def _load(self) -> None:
+        """Чтение кассеты и построение индексов запросов"""
+
+        with gzip.open(self.path, "rt", encoding="utf-8") as file:
+            header = json.loads(file.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(
+                    f"Неподдерживаемая версия кассеты: {header.get('version')}"
+                )
+            self.meta = header.get("meta", {})
+            self.entries = [json.loads(line) for line in file if line.strip()]
+
+        for i, entry in enumerate(self.entries):
+            self._exact[self._exact_key(entry)].append(i)
+            self._loose[self._loose_key(entry)].append(i)
+
+    def save(self) -> None:
+        """Запись кассеты (режим record) в порядке начала запросов"""
+
+        with self._lock:
+            entries = sorted(self.entries, key=lambda entry: entry["offset"])
+            header = {"version": CASSETTE_VERSION, "meta": self.meta}
+
+        with gzip.open(self.path, "wt", encoding="utf-8") as file:
+            for item in (header, *entries):
+                file.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    # MARK: Record
+    def record(
+        self,
+        request: "requests.PreparedRequest",
+        response: "requests.Response",
+        started: float,
+        seconds: float,
+    ) -> None:
+        """Сохранение выполненного запроса и прочитанного ответа"""
+
+        # Вычищается копия: вызывающий код получает ответ без изменений
+        body = _scrub_body(response.content)[0]
+
+        entry = {
+            "method": request.method,
+            "url": self.scrub_url(request.url),
+            "body": _digest(_scrub_body(_as_bytes(request.body))[0]),
+            "offset": round(started - self._started, 4),
+            "seconds": round(seconds, 4),
+            "status": response.status_code,
+            "headers": {
+                name: response.headers[name]
+                for name in RESPONSE_HEADERS
+                if name in response.headers
+            },
+            **_encode(body),
+        }
+
+        with self._lock:
+            self.entries.append(entry)
+            self._stats["requests"] += 1
+            self._stats["bytes"] += len(body)
+
+    # MARK: Replay
+    def play(self, request: "requests.PreparedRequest") -> dict | None:
+        """
+        Запись для запроса: первая неиспользованная с тем же методом, адресом
+        и телом, иначе с тем же методом и путем (параметры могли измениться,
+        например даты). Если все подходящие записи использованы, повторяется
+        последняя из них
+        """
+
+        method = request.method
+        url = self.scrub_url(request.url)
+        body = _digest(_scrub_body(_as_bytes(request.body))[0])
+        exact = self._exact.get((method, url, body), [])
+        loose = self._loose.get((method, urlsplit(url).path), [])
+
+        with self._lock:
+            self._stats["requests"] += 1
+            for kind, candidates in (("exact", exact), ("loose", loose)):
+                for i in candidates:
+                    if i not in self._used:
+                        self._used.add(i)
+                        self._stats[kind] += 1
+                        return self._served(self.entries[i])
+
+            candidates = exact or loose
+            if not candidates:
+                self._stats["unmatched"] += 1
+                return None
+
+            self._stats["repeated"] += 1
+            return self._served(self.entries[candidates[-1]])
+
+    def _served(self, entry: dict) -> dict:
+        """Учет отданного ответа (вызывается под блокировкой)"""
+
+        self._stats["bytes"] += len(_decode(entry))
+        return entry
+
+    def response(
+        self,
+        request: "requests.PreparedRequest",
+        entry: dict,
+    ) -> "requests.Response":
+        """Ответ requests из записи кассеты с исходной задержкой"""
+
+        import requests
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+
+        if self.speed > 0:
+            time.sleep(entry["seconds"] / self.speed)
+
+        body = _decode(entry)
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+    # MARK: Transport
+    def adapter(self, inner: "BaseAdapter") -> "BaseAdapter":
+        """Адаптер requests: запись через inner или воспроизведение из кассеты"""
+
+        return _adapter_class()(self, inner)
+
+    def scrub_url(self, url: str) -> str:
+        """Адрес без учетных данных: адреса компаний заменяются на метки"""
+
+        prefixes = []
+        for tenant in registered_tenants():
+            prefixes += [
+                (tenant.bitrix_webhook_url, f"{{bitrix:{tenant.name}}}"),
+                (tenant.itigris_url, f"{{itigris:{tenant.name}}}"),
+                (tenant.itigris_url_new, f"{{itigris_v2:{tenant.name}}}"),
+            ]
+
+        # Более длинные адреса первыми: адрес старого API продолжает адрес нового
+        for prefix, label in sorted(prefixes, key=lambda item: -len(item[0])):
+            if prefix and url.startswith(prefix):
+                url = label + url[len(prefix) :]
+                break
+
+        parts = urlsplit(url)
+        query = urlencode(
+            [
+                (name, SCRUBBED_VALUE if name in SCRUBBED_FIELDS else value)
+                for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            ]
+        )
+        return urlunsplit(parts._replace(query=query))
+
+    # MARK: Stats
+    def stats(self) -> dict[str, Any]:
+        """Количество запросов и байтов ответов, способы сопоставления запросов"""
+
+        with self._lock:
+            return {
+                **self._stats,
+                "seconds": round(time.perf_counter() - self._started, 3),
+            }
+
+    @classmethod
+    def _exact_key(cls, entry: dict) -> tuple:
+        return (entry["method"], entry["url"], entry["body"])
+
+    @classmethod
+    def _loose_key(cls, entry: dict) -> tuple:
+        return (entry["method"], urlsplit(entry["url"]).path)
+
+
+@functools.cache
+def _adapter_class() -> type:
+    """Класс адаптера (requests импортируется при первом запросе)"""
+
+    import requests
+    from requests.adapters import BaseAdapter
+
+    class CassetteAdapter(BaseAdapter):
+        def __init__(self, cassette: Cassette, inner: BaseAdapter) -> None:
+            super().__init__()
+            self.cassette = cassette
+            self.inner = inner
+
+        def send(self, request, stream=False, **kwargs):
+            if self.cassette.mode == "replay":
+                entry = self.cassette.play(request)
+                if entry is None:
+                    raise requests.ConnectionError(
+                        f"Нет записанного ответа: {request.method} "
+                        f"{self.cassette.scrub_url(request.url)}",
+                        request=request,
+                    )
+                return self.cassette.response(request, entry)
+
+            # Потоковый ответ читается целиком: iter_content отдаст его по частям
+            started = time.perf_counter()
+            response = self.inner.send(request, stream=stream, **kwargs)
+            response.content  # noqa: B018
+            self.cassette.record(
+                request,
+                response,
+                started,
+                time.perf_counter() - started,
+            )
+            return response
+
+        @property
+        def poolmanager(self) -> Any:
+            # Пулы соединений для HttpClient.stats (при воспроизведении пусты)
+            return self.inner.poolmanager
+
+        def close(self) -> None:
+            self.inner.close()
+
+    return CassetteAdapter
+
+
+def _as_bytes(body: bytes | str | None) -> bytes:
+    if body is None:
+        return b""
+    return body.encode() if isinstance(body, str) else body
+
+
+def _digest(body: bytes) -> str | None:
+    """Хэш тела запроса (само тело в кассете не хранится)"""
+
+    return hashlib.sha1(body).hexdigest() if body else None
+
+
+def _scrub_body(body: bytes) -> tuple[bytes, bool]:
+    """Тело JSON или формы без значений SCRUBBED_FIELDS и признак изменения"""
+
+    if not body:
+        return body, False
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        pairs = parse_qsl(body.decode("latin-1"), keep_blank_values=True)
+        if not any(name in SCRUBBED_FIELDS for name, _ in pairs):
+            return body, False
+        return (
+            urlencode(
+                [
+                    (name, SCRUBBED_VALUE if name in SCRUBBED_FIELDS else value)
+                    for name, value in pairs
+                ]
+            ).encode(),
+            True,
+        )
+
+    scrubbed = _scrub(data)
+    if scrubbed == data:
+        return body, False
+    return json.dumps(scrubbed, ensure_ascii=False).encode(), True
+
+
+def _scrub(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            name: SCRUBBED_VALUE if name in SCRUBBED_FIELDS else _scrub(item)
+            for name, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_scrub(item) for item in value]
+    return value
+
+
+def _encode(body: bytes) -> dict[str, str]:
+    """Тело ответа для кассеты: текст или base64 для двоичных данных"""
+
+    try:
+        return {"text": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def _decode(entry: dict) -> bytes:
+    if "base64" in entry:
+        return base64.b64decode(entry["base64"])
+    return entry["text"].encode("utf-8")
@@ -0,0 +1,222 @@
+import re
+import threading
+import time
+from collections.abc import Iterable
+
+from src.constants import (
+    CLIENT_INDEX_LOCK_STRIPES,
+    CLIENT_INDEX_RETRY_SECONDS,
+    CLIENT_INDEX_TTL_SECONDS,
+    DEFAULT_PHONE_COUNTRY_CODE,
+)
+
+# Поля клиента Itigris с номерами телефонов
+CLIENT_PHONE_FIELDS = ("tel1", "tel2")
+
+_NON_DIGITS = re.compile(r"\D")
+_SPACES = re.compile(r"\s+")
+
+
+class ClientIndex:
+    """
+    Локальный индекс клиентов Itigris по нормализованному телефону (E.164)
+    и ФИО. Строится целиком постраничной выгрузкой клиентов, дополняется
+    созданными и найденными клиентами и перестраивается раз в ttl_seconds
+    (неудачное построение повторяется не раньше чем через retry_seconds).
+    Создание клиента с одним телефоном выполняется под одной блокировкой,
+    поэтому параллельные лиды не создают дубликаты
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = CLIENT_INDEX_TTL_SECONDS,
+        lock_stripes: int = CLIENT_INDEX_LOCK_STRIPES,
+        retry_seconds: float = CLIENT_INDEX_RETRY_SECONDS,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+
+        self._by_phone: dict[str, int] = {}
+        self._by_name: dict[str, int] = {}
+        self._loaded_at: float | None = None
+        self._failed_at: float | None = None
+        # Клиенты, добавленные во время выгрузки (None - выгрузки нет)
+        self._added: list[tuple[int, str | None, str | None]] | None = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    # MARK: Normalization
+    @classmethod
+    def normalize_phone(cls, phone: str | None) -> str | None:
+        """
+        Телефон в формате E.164: +7 900 123-45-67, 89001234567
+        и 9001234567 дают +79001234567
+        """
+
+        digits = _NON_DIGITS.sub("", phone or "")
+        if not digits:
+            return None
+
+        if len(digits) == 10:
+            digits = DEFAULT_PHONE_COUNTRY_CODE + digits
+        elif len(digits) == 11 and digits[0] == "8":
+            digits = DEFAULT_PHONE_COUNTRY_CODE + digits[1:]
+
+        return f"+{digits}"
+
+    @classmethod
+    def normalize_name(cls, *parts: str | None) -> str | None:
+        """ФИО без учета регистра, лишних пробелов и различия е/ё"""
+
+        name = _SPACES.sub(" ", " ".join(part or "" for part in parts)).strip()
+        if not name:
+            return None
+
+        return name.casefold().replace("ё", "е")
+
+    # MARK: Index
+    def is_stale(self) -> bool:
+        """
+        Индекс еще не строился или устарел (и с неудачной попытки
+        построения прошло retry_seconds)
+        """
+
+        now = time.monotonic()
+        if self._failed_at is not None and now - self._failed_at < self.retry_seconds:
+            return False
+
+        return self._loaded_at is None or now - self._loaded_at > self.ttl_seconds
+
+    def load(self, clients: Iterable[dict]) -> None:
+        """
+        Построение индекса по выгрузке клиентов Itigris. Одновременно строит
+        один поток, остальные ждут его, а не запрашивают клиентов повторно
+        """
+
+        with self._load_lock:
+            if not self.is_stale():
+                return
+
+            with self._lock:
+                self._added = []
+            try:
+                by_phone, by_name = self._build(clients)
+            except Exception:
+                with self._lock:
+                    self._added = None
+                    self._failed_at = time.monotonic()
+                raise
+
+            with self._lock:
+                # Индекс заменяется выгрузкой (удаленные и объединенные
+                # клиенты исчезают), добавленные во время нее сохраняются
+                for client_id, phone, name in self._added:
+                    if phone:
+                        by_phone[phone] = client_id
+                    if name:
+                        by_name.setdefault(name, client_id)
+
+                self._by_phone = by_phone
+                self._by_name = by_name
+                self._added = None
+                self._loaded_at = time.monotonic()
+                self._failed_at = None
+
+    def _build(self, clients: Iterable[dict]) -> tuple[dict[str, int], dict[str, int]]:
+        """Индексы по телефону и ФИО из выгрузки клиентов"""
+
+        by_phone: dict[str, int] = {}
+        by_name: dict[str, int] = {}
+        for client in clients:
+            client_id = client.get("id")
+            if client_id is None:
+                continue
+
+            for field in CLIENT_PHONE_FIELDS:
+                phone = self.normalize_phone(client.get(field))
+                if phone:
+                    by_phone.setdefault(phone, client_id)
+
+            name = self.normalize_name(
+                client.get("firstName"),
+                client.get("familyName"),
+                client.get("patronymicName"),
+            )
+            if name:
+                by_name.setdefault(name, client_id)
+
+        return by_phone, by_name
+
+    def add(
+        self,
+        client_id: int,
+        phone: str | None = None,
+        first_name: str | None = None,
+        second_name: str | None = None,
+        last_name: str | None = None,
+    ) -> None:
+        """Добавление созданного или найденного клиента"""
+
+        phone = self.normalize_phone(phone)
+        name = self.normalize_name(first_name, second_name, last_name)
+
+        with self._lock:
+            if phone:
+                self._by_phone[phone] = client_id
+            if name:
+                self._by_name.setdefault(name, client_id)
+            if self._added is not None:
+                self._added.append((client_id, phone, name))
+
+    def find(
+        self,
+        phone: str | None = None,
+        first_name: str | None = None,
+        second_name: str | None = None,
+        last_name: str | None = None,
+    ) -> int | None:
+        """
+        ID клиента по телефону. По ФИО клиент ищется, только если телефона нет:
+        однофамильцы с разными телефонами - разные клиенты
+        """
+
+        phone = self.normalize_phone(phone)
+        if phone:
+            return self._by_phone.get(phone)
+
+        name = self.normalize_name(first_name, second_name, last_name)
+        return self._by_name.get(name) if name else None
+
+    def lock_for(
+        self,
+        phone: str | None = None,
+        first_name: str | None = None,
+        second_name: str | None = None,
+        last_name: str | None = None,
+    ) -> threading.Lock:
+        """Блокировка поиска и создания клиента с этим телефоном (или ФИО)"""
+
+        key = self.normalize_phone(phone) or self.normalize_name(
+            first_name,
+            second_name,
+            last_name,
+        )
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def clear(self) -> None:
+        """Сброс индекса (будет построен заново при следующем поиске)"""
+
+        with self._lock:
+            self._by_phone = {}
+            self._by_name = {}
+            self._loaded_at = None
+            self._failed_at = None
+
+    def stats(self) -> dict[str, int]:
+        """Размер индекса"""
+
+        return {"phones": len(self._by_phone), "names": len(self._by_name)}
+
+
+client_index = ClientIndex()
@@ -0,0 +1,393 @@
+import threading
+import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from src.constants import (
+    BITRIX_RATE_BURST,
+    BITRIX_RATE_LIMIT,
+    HTTP_BACKOFF_FACTOR,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_CONCURRENCY_PER_HOST,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_READ_TIMEOUT,
+    HTTP_RATE_LIMIT_MIN,
+    HTTP_RETRIES,
+    HTTP_THROTTLE_RETRIES,
+)
+from src.services.limits import CircuitBreaker, TokenBucket
+from src.services.metrics import metrics
+from src.services.tenants import registered_tenants
+
+if TYPE_CHECKING:
+    import requests
+
+    from src.services.cassette import Cassette
+
+
+class HttpClient:
+    """
+    Общий HTTP-транспорт для Bitrix24 и Itigris: одна сессия
+    с пулом keep-alive соединений на каждый хост
+    """
+
+    _session: "requests.Session | None" = None
+    _lock = threading.Lock()
+
+    _pool_connections: int = HTTP_POOL_CONNECTIONS
+    _pool_maxsize: int = HTTP_POOL_MAXSIZE
+    _timeout: tuple[float, float] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    _retries: int = HTTP_RETRIES
+    _backoff_factor: float = HTTP_BACKOFF_FACTOR
+    _max_concurrency_per_host: int = HTTP_MAX_CONCURRENCY_PER_HOST
+    _host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+    _host_limiters: dict[str, TokenBucket] = {}
+    _host_breakers: dict[str, CircuitBreaker] = {}
+    _bitrix_rate_share: float = 1
+    _cassette: "Cassette | None" = None
+
+    # MARK: Session
+    @classmethod
+    def configure(
+        cls,
+        pool_connections: int | None = None,
+        pool_maxsize: int | None = None,
+        connect_timeout: float | None = None,
+        read_timeout: float | None = None,
+        retries: int | None = None,
+        backoff_factor: float | None = None,
+        max_concurrency_per_host: int | None = None,
+        bitrix_rate_share: float | None = None,
+    ) -> None:
+        """
+        Изменение настроек транспорта, сессия будет пересоздана.
+        bitrix_rate_share - доля лимита Bitrix24, доступная этому процессу
+        (лимит вебхука общий для всех процессов)
+        """
+
+        with cls._lock:
+            if pool_connections is not None:
+                cls._pool_connections = pool_connections
+            if pool_maxsize is not None:
+                cls._pool_maxsize = pool_maxsize
+            if connect_timeout is not None:
+                cls._timeout = (connect_timeout, cls._timeout[1])
+            if read_timeout is not None:
+                cls._timeout = (cls._timeout[0], read_timeout)
+            if retries is not None:
+                cls._retries = retries
+            if backoff_factor is not None:
+                cls._backoff_factor = backoff_factor
+            if max_concurrency_per_host is not None:
+                cls._max_concurrency_per_host = max_concurrency_per_host
+                cls._host_semaphores = {}
+            if bitrix_rate_share is not None:
+                cls._bitrix_rate_share = bitrix_rate_share
+                cls._host_limiters = {}
+
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+    @classmethod
+    def use_cassette(cls, cassette: "Cassette | None") -> None:
+        """
+        Запись или воспроизведение запросов через кассету (None - обычная
+        работа с сетью), сессия будет пересоздана
+        """
+
+        with cls._lock:
+            cls._cassette = cassette
+
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+    @classmethod
+    def session(cls) -> "requests.Session":
+        """Получение общей сессии (создается при первом обращении)"""
+
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    cls._session = cls._create_session()
+
+        return cls._session
+
+    @classmethod
+    def close(cls) -> None:
+        """Закрытие всех соединений пула"""
+
+        with cls._lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+    @classmethod
+    def _create_session(cls) -> "requests.Session":
+        """Создание сессии с пулом соединений и повторами при ошибках соединения"""
+
+        # requests импортируется при первом запросе, а не при импорте сервисов
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # Повторяем только ошибки установки соединения: запрос до сервера
+        # не дошел, поэтому повтор безопасен и для POST
+        retry = Retry(
+            total=cls._retries,
+            connect=cls._retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=cls._backoff_factor,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=cls._pool_connections,
+            pool_maxsize=cls._pool_maxsize,
+            max_retries=retry,
+        )
+        if cls._cassette is not None:
+            adapter = cls._cassette.adapter(adapter)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def _request_error(cls) -> type[Exception]:
+        """Базовое исключение requests (модуль уже загружен сессией)"""
+
+        import requests
+
+        return requests.RequestException
+
+    # MARK: Requests
+    @classmethod
+    def request(cls, method: str, url: str, **kwargs) -> "requests.Response":
+        """Выполнение запроса через общий пул соединений"""
+
+        kwargs.setdefault("timeout", cls._timeout)
+        host = urlsplit(url).netloc
+        limiter = cls._host_limiter(host)
+        breaker = cls._host_breaker(host)
+
+        # При воспроизведении кассеты сети нет: лимиты частоты и выключатель
+        # не применяются, задержки задает сама кассета
+        replay = cls._cassette is not None and cls._cassette.mode == "replay"
+
+        # Если хост недоступен, запрос завершается сразу с CircuitOpenError
+        trial = not replay and breaker.before_request(host)
+        try:
+            return cls._send(method, url, host, limiter, breaker, replay, **kwargs)
+        finally:
+            # Пробный запрос, прерванный исключением до ответа, не должен
+            # оставить выключатель разомкнутым навсегда
+            if trial:
+                breaker.end_trial()
+
+    @classmethod
+    def _send(
+        cls,
+        method: str,
+        url: str,
+        host: str,
+        limiter: TokenBucket,
+        breaker: CircuitBreaker,
+        replay: bool,
+        **kwargs,
+    ) -> "requests.Response":
+        """Отправка запроса с учетом лимита частоты и повторами после 429/503"""
+
+        endpoint = cls._endpoint(url)
+        for attempt in range(HTTP_THROTTLE_RETRIES + 1):
+            if not replay:
+                limiter.acquire()
+            started = time.perf_counter()
+            try:
+                with cls._host_semaphore(host):
+                    response = cls.session().request(method, url, **kwargs)
+            except cls._request_error():
+                if not replay:
+                    breaker.on_failure()
+                metrics.observe_request(
+                    host,
+                    endpoint,
+                    method,
+                    "error",
+                    time.perf_counter() - started,
+                    retries=attempt,
+                )
+                raise
+
+            metrics.observe_request(
+                host,
+                endpoint,
+                method,
+                response.status_code,
+                time.perf_counter() - started,
+                size=cls._response_size(response, kwargs.get("stream", False)),
+                retries=attempt + cls._connection_retries(response),
+            )
+
+            # Превышение лимита (у Bitrix24 - 503 QUERY_LIMIT_EXCEEDED):
+            # частота снижается, запрос повторяется после паузы
+            if response.status_code in (429, 503):
+                if not replay:
+                    limiter.on_throttle(cls._retry_after(response))
+                if attempt < HTTP_THROTTLE_RETRIES:
+                    response.close()
+                    continue
+
+            if not replay:
+                if response.status_code >= 500:
+                    breaker.on_failure()
+                else:
+                    breaker.on_success()
+                    limiter.on_success()
+
+            return response
+
+    @classmethod
+    def _endpoint(cls, url: str) -> str:
+        """Метка эндпоинта для метрик (без секрета вебхука Bitrix24 и ID)"""
+
+        for tenant in registered_tenants():
+            if url.startswith(tenant.bitrix_webhook_url):
+                return url[len(tenant.bitrix_webhook_url) :].split("?")[0]
+
+        return metrics.endpoint(urlsplit(url).path)
+
+    @classmethod
+    def _response_size(cls, response: "requests.Response", stream: bool) -> int:
+        """Размер ответа (потоковый ответ не читается, берется Content-Length)"""
+
+        if stream:
+            return int(response.headers.get("Content-Length") or 0)
+
+        return len(response.content)
+
+    @classmethod
+    def _connection_retries(cls, response: "requests.Response") -> int:
+        """Количество повторов соединения, выполненных urllib3"""
+
+        retries = getattr(response.raw, "retries", None)
+        return len(retries.history) if retries is not None else 0
+
+    @classmethod
+    def _retry_after(cls, response: "requests.Response") -> float | None:
+        """Пауза из заголовка Retry-After в секундах"""
+
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return None
+
+    @classmethod
+    def _host_limiter(cls, host: str) -> TokenBucket:
+        """Ограничитель частоты запросов к хосту"""
+
+        limiter = cls._host_limiters.get(host)
+        if limiter is None:
+            with cls._lock:
+                limiter = cls._host_limiters.get(host)
+                if limiter is None:
+                    tenants = registered_tenants()
+                    if any(host == tenant.bitrix_host for tenant in tenants):
+                        rate = BITRIX_RATE_LIMIT * cls._bitrix_rate_share
+                        limiter = TokenBucket(
+                            rate=rate,
+                            burst=max(1, BITRIX_RATE_BURST * cls._bitrix_rate_share),
+                            min_rate=min(HTTP_RATE_LIMIT_MIN, rate),
+                            max_rate=rate,
+                        )
+                    else:
+                        limiter = TokenBucket()
+                    cls._host_limiters[host] = limiter
+
+        return limiter
+
+    @classmethod
+    def _host_breaker(cls, host: str) -> CircuitBreaker:
+        """Автоматический выключатель хоста"""
+
+        breaker = cls._host_breakers.get(host)
+        if breaker is None:
+            with cls._lock:
+                breaker = cls._host_breakers.setdefault(host, CircuitBreaker())
+
+        return breaker
+
+    @classmethod
+    def _host_semaphore(cls, host: str) -> threading.BoundedSemaphore:
+        """Ограничение количества одновременных запросов к одному хосту"""
+
+        semaphore = cls._host_semaphores.get(host)
+        if semaphore is None:
+            with cls._lock:
+                semaphore = cls._host_semaphores.setdefault(
+                    host,
+                    threading.BoundedSemaphore(cls._max_concurrency_per_host),
+                )
+
+        return semaphore
+
+    @classmethod
+    def get(cls, url: str, **kwargs) -> "requests.Response":
+        """GET-запрос через общий пул соединений"""
+
+        return cls.request("GET", url, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs) -> "requests.Response":
+        """POST-запрос через общий пул соединений"""
+
+        return cls.request("POST", url, **kwargs)
+
+    # MARK: Stats
+    @classmethod
+    def stats(cls) -> dict[str, dict[str, int]]:
+        """Счетчики открытых и переиспользованных соединений по хостам"""
+
+        stats: dict[str, dict[str, int]] = {}
+        if cls._session is None:
+            return stats
+
+        adapters = {id(adapter): adapter for adapter in cls._session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                try:
+                    pool = pools[key]
+                except KeyError:
+                    # Пул мог быть вытеснен из кэша между чтениями
+                    continue
+
+                host = f"{pool.scheme}://{pool.host}:{pool.port}"
+                host_stats = stats.setdefault(
+                    host,
+                    {"requests": 0, "opened": 0, "reused": 0},
+                )
+                host_stats["requests"] += pool.num_requests
+                host_stats["opened"] += pool.num_connections
+                host_stats["reused"] += max(
+                    pool.num_requests - pool.num_connections,
+                    0,
+                )
+
+        return stats
+
+    @classmethod
+    def limits_stats(cls) -> dict[str, dict[str, float | str]]:
+        """Текущая частота запросов и состояние выключателя по хостам"""
+
+        return {
+            host: {
+                "rate": "inf" if limiter.rate is None else round(limiter.rate, 2),
+                "circuit": cls._host_breaker(host).state,
+            }
+            for host, limiter in list(cls._host_limiters.items())
+        }
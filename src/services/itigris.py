@@ -1,33 +1,98 @@
+import hashlib
+import json
+from collections.abc import Container, MutableMapping, MutableSet
 from datetime import datetime
-
-import requests
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Iterator
 
 from src.constants import (
-    ITIGRIS_URL,
-    ITIGRIS_URL_NEW,
+    ITIGRIS_CLIENTS_PAGE_SIZE,
+    ITIGRIS_RECORDS_PAGE_SIZE,
+    ITIGRIS_STREAM_CHUNK_SIZE,
+    RECORD_RESOLVE_INITIAL_DELAY_SECONDS,
+    RECORD_RESOLVE_MAX_DELAY_SECONDS,
+    RECORD_RESOLVE_TIMEOUT_SECONDS,
+)
+from src.models import (
+    LENS_EYE_API_FIELDS,
+    PRESCRIPTION_API_FIELDS,
+    ContactLensPrescription,
+    Lead,
+    Order,
+    Prescription,
+    RegistryRecord,
+)
+from src.services.cache import (
+    client_searches,
+    orders_by_client,
+    prescriptions_by_client,
+)
+from src.services.http import HttpClient
+from src.services.metrics import instrumented
+from src.services.state import Watermark
+from src.services.streaming import JsonStream
+from src.services.tenants import current_tenant
+
+if TYPE_CHECKING:
+    from src.services.work_queue import WorkQueue
+
+
+# Массивы ответа с рецептами клиента
+PRESCRIPTION_KEYS = ("prescriptions", "contactLensPrescriptions")
+
+# Значение для незаполненного поля рецепта
+RECEIPT_EMPTY_VALUE = "не указано"
+
+# Шаблоны рецептов для Bitrix24, собираются один раз по спискам полей
+_RECEIPT_TEMPLATE = "".join(f"{field}: {{}}\n" for field in PRESCRIPTION_API_FIELDS)
+_LENS_EYE_TEMPLATE = "".join(f"{field}: {{}}\n" for field in LENS_EYE_API_FIELDS)
+_CONTACT_LENS_RECEIPT_TEMPLATE = (
+    "model: {}\ncolor: {}\n"
+    f"leftEye:{_LENS_EYE_TEMPLATE}"
+    f"rightEye:{_LENS_EYE_TEMPLATE}"
+)
+
+# Варианты поля "Тип очков" лида (отправляются при каждом обновлении)
+GLASSES_TYPE_VALUES = (
+    {
+        "NAME": "не выбрано",
+        "VALUE": "",
+        "IS_SELECTED": True,
+    },
+    {
+        "NAME": "Ночные",
+        "VALUE": 45,
+        "IS_SELECTED": False,
+    },
+    {
+        "NAME": "Дневные",
+        "VALUE": 47,
+        "IS_SELECTED": False,
+    },
 )
-from src.env import env_settings
 
 
+@instrumented
 class ItigrisService:
     # MARK: Auth
     @classmethod
     def login(
         cls,
-        company: str = env_settings.ITIGRIS_COMPANY,
-        login: str = env_settings.ITIGRIS_LOGIN,
-        password: str = env_settings.ITIGRIS_PASSWORD,
-        department_id: int = env_settings.ITIGRIS_DEPARTAMENT_ID,
+        company: str | None = None,
+        login: str | None = None,
+        password: str | None = None,
+        department_id: int | None = None,
     ) -> str:
-        """Вход в систему"""
+        """Вход в систему (по умолчанию - с учетными данными текущей компании)"""
 
-        response = requests.post(
-            url=f"{ITIGRIS_URL_NEW}/api/v2/sign/in",
+        tenant = current_tenant()
+        response = HttpClient.post(
+            url=f"{tenant.itigris_url_new}/api/v2/sign/in",
             json={
-                "company": company,
-                "login": login,
-                "password": password,
-                "departmentId": department_id,
+                "company": company or tenant.itigris_company,
+                "login": login or tenant.itigris_login,
+                "password": password or tenant.itigris_password,
+                "departmentId": department_id or tenant.itigris_department_id,
             },
         )
 
@@ -36,21 +101,114 @@ class ItigrisService:
 
         return response.json()["accessToken"]
 
+    @classmethod
+    def _authorized_request(
+        cls,
+        method: str,
+        url: str,
+        token: str,
+        headers: dict | None = None,
+        **kwargs,
+    ):
+        """
+        Запрос к API Itigris с токеном. При ответе 401 выполняется
+        один повторный вход и запрос повторяется с новым токеном
+        """
+
+        response = HttpClient.request(
+            method,
+            url,
+            headers={**(headers or {}), "Authorization": f"Bearer {token}"},
+            **kwargs,
+        )
+
+        if response.status_code == 401:
+            response.close()
+            token = current_tenant().tokens.refresh(stale_token=token)
+            response = HttpClient.request(
+                method,
+                url,
+                headers={**(headers or {}), "Authorization": f"Bearer {token}"},
+                **kwargs,
+            )
+
+        return response
+
     # MARK: Clients
     @classmethod
-    def get_client_id_for_lead(cls, token: str, phone: str) -> str | None:
-        """Получение ID клиента по номеру телефона"""
+    def get_client_id_for_lead(
+        cls,
+        token: str,
+        phone: str | None,
+        first_name: str | None = None,
+        second_name: str | None = None,
+        last_name: str | None = None,
+    ) -> int | None:
+        """
+        Получение ID клиента по номеру телефона (или ФИО, если телефона нет)
+        из индекса клиентов. Если клиента в индексе нет, он ищется в Itigris
+        по телефону (клиент мог быть создан после построения индекса);
+        одновременные поиски одного телефона выполняются одним запросом
+        """
 
-        response = requests.get(
-            url=f"{ITIGRIS_URL_NEW}/api/v2/clients",
+        try:
+            cls.load_client_index(token)
+        except Exception as e:
+            print(f"Ошибка при построении индекса клиентов: {e}")
+
+        tenant = current_tenant()
+        index = tenant.client_index
+        client_id = index.find(phone, first_name, second_name, last_name)
+        if client_id or not phone:
+            return client_id
+
+        client_id = client_searches.do(
+            (tenant.name, phone),
+            lambda: cls._fetch_client_id_for_lead(token, phone),
+        )
+        if client_id:
+            index.add(client_id, phone, first_name, second_name, last_name)
+        return client_id
+
+    @classmethod
+    def find_or_create_client(cls, token: str, lead: Lead) -> int:
+        """
+        ID клиента для лида: поиск по индексу и в Itigris, иначе создание.
+        Выполняется под блокировкой телефона, чтобы лиды одного клиента,
+        обрабатываемые параллельно, не создали дубликаты
+        """
+
+        names = (lead.name, lead.second_name, lead.last_name)
+        with current_tenant().client_index.lock_for(lead.phone, *names):
+            client_id = cls.get_client_id_for_lead(token, lead.phone, *names)
+            if client_id:
+                return client_id
+
+            client_id = cls.create_client(
+                token=token,
+                first_name=lead.name,
+                second_name=lead.second_name,
+                last_name=lead.last_name,
+                phone=lead.phone,
+                email=lead.email,
+                gender=lead.gender,
+            )
+            cls.prepare_client(token, client_id)
+            return client_id
+
+    @classmethod
+    def _fetch_client_id_for_lead(cls, token: str, phone: str) -> int | None:
+        """Запрос ID клиента по номеру телефона"""
+
+        response = cls._authorized_request(
+            method="GET",
+            url=f"{current_tenant().itigris_url_new}/api/v2/clients",
             params={
                 "clientSearchType": "PHONE_NUMBER",
                 "searchString": phone,
                 "deleted": False,
             },
-            headers={
-                "Authorization": f"Bearer {token}",
-            },
+            token=token,
         )
 
         if response.status_code != 200:
@@ -64,32 +222,55 @@ class ItigrisService:
             print(f"Ошибка при получении клиента, создаем новый: {e}")
 
     @classmethod
-    def get_client_ids(cls, token: str) -> str | None:
-        """Получение ID клиента по номеру телефона"""
-
-        response = requests.get(
-            url=f"{ITIGRIS_URL_NEW}/api/v2/clients",
-            params={
-                "deleted": False,
-            },
-            headers={
-                "Authorization": f"Bearer {token}",
-            },
-        )
+    def iter_clients(cls, token: str) -> Iterator[dict]:
+        """
+        Постраничная выгрузка клиентов (ответ разбирается потоково).
+        Страницы запрашиваются по мере чтения
+        """
 
-        if response.status_code != 200:
-            raise Exception(
-                f"Ошибка при получении клиента: {response.text}, статус: {response.status_code}"
+        page = 0
+        while True:
+            response = cls._authorized_request(
+                method="GET",
+                url=f"{current_tenant().itigris_url_new}/api/v2/clients",
+                params={
+                    "deleted": False,
+                    "page": page,
+                    "size": ITIGRIS_CLIENTS_PAGE_SIZE,
+                },
+                token=token,
+                stream=True,
             )
 
+            if response.status_code != 200:
+                raise Exception(
+                    f"Ошибка при получении клиентов: {response.text}, статус: {response.status_code}"
+                )
+
+            data = cls._stream_json(response)
+            yield from data
+
+            if data.fields.get("last", True):
+                return
+            page += 1
+
+    @classmethod
+    def get_client_ids(cls, token: str) -> list[int] | None:
+        """Получение ID всех клиентов"""
+
         try:
-            ids = []
-            for client in response.json().get("content", [{}]):
-                ids.append(client.get("id"))
-            return ids
+            return [client.get("id") for client in cls.iter_clients(token)]
         except Exception as e:
             print(f"Ошибка при получении клиентов: {e}")
 
+    @classmethod
+    def load_client_index(cls, token: str) -> None:
+        """Построение индекса клиентов, если он еще не строился или устарел"""
+
+        index = current_tenant().client_index
+        if index.is_stale():
+            index.load(cls.iter_clients(token))
+
     @classmethod
     def create_client(
         cls,
@@ -103,8 +284,9 @@ class ItigrisService:
     ):
         """Создание клиента"""
 
-        response = requests.post(
-            url=f"{ITIGRIS_URL_NEW}/api/v2/clients",
+        response = cls._authorized_request(
+            method="POST",
+            url=f"{current_tenant().itigris_url_new}/api/v2/clients",
             json={
                 "firstName": first_name,
                 "familyName": second_name,
@@ -113,9 +295,7 @@ class ItigrisService:
                 "gender": gender,
                 "email": email,
             },
-            headers={
-                "Authorization": f"Bearer {token}",
-            },
+            token=token,
         )
 
         if response.status_code != 201:
@@ -123,20 +303,33 @@ class ItigrisService:
                 f"Ошибка при создании клиента: {response.text}, статус: {response.status_code}"
             )
 
-        return response.json()["id"]
+        # Поиск, начатый до создания, мог не найти клиента
+        tenant = current_tenant()
+        client_searches.forget(lambda key: key == (tenant.name, phone))
+
+        client_id = response.json()["id"]
+        tenant.client_index.add(
+            client_id,
+            phone,
+            first_name,
+            second_name,
+            last_name,
+        )
+        return client_id
 
     @classmethod
     def prepare_client(cls, token: str, id: int) -> None:
         """Подготовка клиента на первом и втором этапе"""
 
-        response = requests.post(
-            url=f"{ITIGRIS_URL_NEW}/api/v2/clients/{id}/agreements/prepare-text",
+        response = cls._authorized_request(
+            method="POST",
+            url=f"{current_tenant().itigris_url_new}/api/v2/clients/{id}/agreements/prepare-text",
             json={
                 "agreementType": "PERSONAL_DATA_PROCESSING",
                 "collectionMethod": "QUESTIONNAIRE",
             },
+            token=token,
             headers={
-                "Authorization": f"Bearer {token}",
                 "Content-Type": "application/json",
                 "Accept": "application/json",
                 "Host": "optima-2-backend-yc-prod-2.itigris.ru",
@@ -148,14 +341,15 @@ class ItigrisService:
                 f"Ошибка при подготовке клиента на первом этапе: {response.text}, статус: {response.status_code}"
             )
 
-        response = requests.post(
-            url=f"{ITIGRIS_URL_NEW}/api/v2/clients/{id}/agreements",
+        response = cls._authorized_request(
+            method="POST",
+            url=f"{current_tenant().itigris_url_new}/api/v2/clients/{id}/agreements",
             json={
                 "agreementType": "PERSONAL_DATA_PROCESSING",
                 "collectionMethod": "QUESTIONNAIRE",
             },
+            token=token,
             headers={
-                "Authorization": f"Bearer {token}",
                 "Content-Type": "application/json",
                 "Accept": "application/json",
                 "Host": "optima-2-backend-yc-prod-2.itigris.ru",
@@ -173,19 +367,20 @@ class ItigrisService:
         cls,
         client_id: int,
         time: str,
-        key: str = env_settings.ITIGRIS_KEY,
-        user_id: int = env_settings.ITIGRIS_USER_ID,
-        service_type_id: int = env_settings.ITIGRIS_SERVICE_TYPE_ID,
+        key: str | None = None,
+        user_id: int | None = None,
+        service_type_id: int | None = None,
     ) -> None:
-        """Создание записи"""
+        """Создание записи (по умолчанию - от пользователя текущей компании)"""
 
-        response = requests.post(
-            url=f"{ITIGRIS_URL}/remoteRegistry/register",
+        tenant = current_tenant()
+        response = HttpClient.post(
+            url=f"{tenant.itigris_url}/remoteRegistry/register",
             params={
-                "key": key,
+                "key": key or tenant.itigris_key,
                 "clientId": client_id,
-                "userId": user_id,
-                "serviceTypeId": service_type_id,
+                "userId": user_id or tenant.itigris_user_id,
+                "serviceTypeId": service_type_id or tenant.itigris_service_type_id,
                 "time": time,
             },
             headers={"Host": "optima.itigris.ru"},
@@ -196,225 +391,417 @@ class ItigrisService:
                 f"Ошибка при создании записи: {response.text}, статус: {response.status_code}"
             )
 
+        orders_by_client.invalidate_where(
+            lambda key: key[:2] == (tenant.name, client_id)
+        )
+        prescriptions_by_client.invalidate((tenant.name, client_id))
+
     @classmethod
-    def get_records(
+    def iter_records(
         cls,
         token: str,
         status: str | None = None,
-    ) -> list[dict]:
-        """Получение записей по статусу"""
+        client_id: int | None = None,
+        appointment_from: str | None = None,
+        appointment_to: str | None = None,
+    ) -> Iterator[RegistryRecord]:
+        """
+        Постраничное получение записей по статусу, клиенту и дате приема
+        (фильтры передаются в API). Страницы запрашиваются по мере чтения
+        """
 
-        params = {}
+        params = {"size": ITIGRIS_RECORDS_PAGE_SIZE}
         if status:
             params["status"] = status
+        if client_id:
+            params["clientId"] = client_id
 
-        params["appointmentFrom"] = datetime.now().strftime("%Y-%m-%d")
+        params["appointmentFrom"] = appointment_from or datetime.now().strftime(
+            "%Y-%m-%d"
+        )
+        if appointment_to:
+            params["appointmentTo"] = appointment_to
+
+        page = 0
+        while True:
+            response = cls._authorized_request(
+                method="GET",
+                url=f"{current_tenant().itigris_url_new}/api/v2/registry-records",
+                params={**params, "page": page},
+                token=token,
+                headers={
+                    "Content-Type": "application/json",
+                    "Accept": "application/json",
+                    "Host": "optima-2-backend-yc-prod-2.itigris.ru",
+                },
+                stream=True,
+            )
 
-        response = requests.get(
-            url=f"{ITIGRIS_URL_NEW}/api/v2/registry-records",
-            params=params,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Host": "optima-2-backend-yc-prod-2.itigris.ru",
-            },
+            if not response.status_code == 200:
+                raise Exception(
+                    f"Ошибка при получении записей с подтвержденным статусом: {response.text}, статус: {response.status_code}"
+                )
+
+            # Ответ без страниц - весь список сразу, тогда поля last нет
+            data = cls._stream_json(response)
+            for record in data:
+                yield RegistryRecord.from_itigris(record)
+
+            if data.fields.get("last", True):
+                return
+            page += 1
+
+    @classmethod
+    def get_records(
+        cls,
+        token: str,
+        status: str | None = None,
+        client_id: int | None = None,
+        appointment_from: str | None = None,
+        appointment_to: str | None = None,
+    ) -> list[RegistryRecord]:
+        """Получение всех записей по статусу, клиенту и дате приема"""
+
+        return list(
+            cls.iter_records(
+                token,
+                status=status,
+                client_id=client_id,
+                appointment_from=appointment_from,
+                appointment_to=appointment_to,
+            )
         )
 
-        if not response.status_code == 200:
-            raise Exception(
-                f"Ошибка при получении записей с подтвержденным статусом: {response.text}, статус: {response.status_code}"
+    @classmethod
+    def find_new_record(
+        cls,
+        token: str,
+        client_id: int,
+        appointment_time: str,
+        known_record_ids: Container[int] = (),
+    ) -> int | None:
+        """
+        Поиск ID созданной записи по ID клиента и дате приема. Запись появляется
+        в реестре не сразу, поэтому реестр опрашивается с растущей паузой
+        """
+
+        appointment_date = appointment_time[:10]
+
+        delay = RECORD_RESOLVE_INITIAL_DELAY_SECONDS
+        deadline = monotonic() + RECORD_RESOLVE_TIMEOUT_SECONDS
+
+        while True:
+            records = cls.iter_records(
+                token,
+                client_id=client_id,
+                appointment_from=appointment_date,
+                appointment_to=appointment_date,
             )
 
-        return response.json()
+            # Новая запись - еще не сопоставленная запись клиента с максимальным ID
+            max_id = None
+            for record in records:
+                if record.client_id != client_id or record.id in known_record_ids:
+                    continue
+                if not max_id or record.id > max_id:
+                    max_id = record.id
+
+            if max_id:
+                return max_id
+
+            if monotonic() + delay > deadline:
+                return None
+
+            sleep(delay)
+            delay = min(delay * 2, RECORD_RESOLVE_MAX_DELAY_SECONDS)
 
     @classmethod
-    def _format_receipt(cls, receipt: dict | None) -> str | None:
+    def _format_receipt(cls, receipt: Prescription | None) -> str | None:
         """Форматирование рецепта для Bitrix24"""
 
         if not receipt:
             return
 
-        receipt_str = ""
-
-        for field in [
-            "sphOd",
-            "sphOs",
-            "cylOd",
-            "cylOs",
-            "axOd",
-            "axOs",
-            "prism1DioptreOd",
-            "prism1DioptreOs",
-            "prism2DioptreOd",
-            "prism2DioptreOs",
-            "prism1BaseOd",
-            "prism1BaseOs",
-            "prism2BaseOd",
-            "prism2BaseOs",
-            "addidationOd",
-            "addidationOs",
-            "dpp",
-            "dppOd",
-            "dppOs",
-            "visusOd",
-            "visusOs",
-            "comments",
-        ]:
-            receipt_str += f"{field}: {receipt.get(field) or 'не указано'}\n"
-
-        return receipt_str
+        return _RECEIPT_TEMPLATE.format(
+            *(value or RECEIPT_EMPTY_VALUE for _, value in receipt.api_items())
+        )
 
     @classmethod
-    def _format_contact_lens_receipt(cls, receipt: dict | None) -> str | None:
+    def _format_contact_lens_receipt(
+        cls,
+        receipt: ContactLensPrescription | None,
+    ) -> str | None:
         """Форматирование рецепта контактных линз для Bitrix24"""
 
         if not receipt:
             return
 
-        receipt_str = ""
-        for field in ["model", "color"]:
-            receipt_str += f"{field}: {receipt.get(field) or 'не указано'}\n"
-
-        for eye in ["leftEye", "rightEye"]:
-            receipt_str += f"{eye}:"
-            for field in [
-                "dioptre",
-                "cylinder",
-                "axis",
-                "add",
-                "curvatureRadius",
-                "diameter",
-            ]:
-                receipt_str += (
-                    f"{field}: {receipt.get(eye, {}).get(field) or 'не указано'}\n"
-                )
+        values = [receipt.model, receipt.color]
+        for lens in (receipt.left_eye, receipt.right_eye):
+            values.extend(value for _, value in lens.api_items())
 
-        return receipt_str
+        return _CONTACT_LENS_RECEIPT_TEMPLATE.format(
+            *(value or RECEIPT_EMPTY_VALUE for value in values)
+        )
+
+    @classmethod
+    def lead_fields_hash(cls, fields: dict) -> str:
+        """Хэш полей обновления лида (для пропуска обновлений без изменений)"""
+
+        content = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @classmethod
+    def process_record(
+        cls,
+        record: RegistryRecord,
+        token: str,
+        record_id_to_lead_id: MutableMapping[int, int],
+        explored_order_ids: MutableSet[int],
+        updates: dict[int, dict] | None = None,
+        raise_errors: bool = False,
+        lead_hashes: MutableMapping[int, str] | None = None,
+    ) -> None:
+        """
+        Обработка одной записи: сбор заказа и рецептов и обновление лида в Bitrix24.
+        Если передан словарь updates, поля лида складываются в него
+        для последующего обновления через batch: тогда в explored_order_ids
+        передается набор проверенных записей, которые переносятся
+        в обработанные после отправки (mark_explored). При ошибке запись
+        не отмечается обработанной, а с raise_errors ошибка пробрасывается
+        (для повтора). Если передан lead_hashes, лид, поля которого
+        не изменились с последнего обновления, в Bitrix24 не отправляется
+        """
+
+        from src.services.bitrix import BitrixService
+
+        try:
+            if record.id in explored_order_ids:
+                print(f"Запись {record.id} уже обработана")
+                return
+
+            print(f"Обработка записи {record.id}")
+
+            # Поиск лида по имени, фамилии и отчеству
+            lead_id = record_id_to_lead_id.get(record.id)
+            if not lead_id:
+                print(f"Лид не найден для записи {record.id}")
+                return
+
+            # Сопоставление записи с заказом, по максимальному ID заказа
+            # среди заказов с даты приема (без всей истории клиента)
+            order = cls.get_latest_order(
+                record.client_id,
+                start_date=cls.order_start_date(record),
+            )
+            if not order:
+                print(f"Заказы для клиента {record.client_id} не найдены")
+                return
+
+            # Получение первого рецепта (очки) и первого рецепта для контактных линз
+            perscription, contact_lens_perscription = cls.get_prescriptions(
+                token,
+                record.client_id,
+            )
+
+            # Форматирование рецептов
+            receipt_str = cls._format_receipt(perscription)
+            contact_lens_receipt_str = cls._format_contact_lens_receipt(
+                contact_lens_perscription
+            )
+
+            # Обновление лида в Bitrix24
+            fields = {
+                "UF_CRM_1760104053415": receipt_str,
+                "UF_CRM_1760104354563": contact_lens_receipt_str,
+                "UF_CRM_1760104146355": order.total,  # Сумма заказа
+                "UF_CRM_1760104154471": order.sum,  # Сумма к оплате
+                "UF_CRM_1760104282834": order.discount_percent,  # Скидка
+                "UF_CRM_1760104313977": list(GLASSES_TYPE_VALUES),  # Тип очков
+            }
+
+            fields_hash = cls.lead_fields_hash(fields)
+            if lead_hashes is not None and lead_hashes.get(lead_id) == fields_hash:
+                print(f"Лид {lead_id} не изменился, обновление не требуется")
+            elif updates is None:
+                BitrixService.update_lead(lead_id, fields)
+                if lead_hashes is not None:
+                    lead_hashes[lead_id] = fields_hash
+            else:
+                updates[lead_id] = fields
+
+            explored_order_ids.add(record.id)
+        except Exception as e:
+            print(f"Ошибка при обработке записи {record.id}: {e}")
+            if raise_errors:
+                raise
 
     @classmethod
     def handle_finished_records(
         cls,
-        record_id_to_lead_id: dict[int, int],
-        explored_order_ids: set[int],
+        record_id_to_lead_id: MutableMapping[int, int],
+        explored_order_ids: MutableSet[int],
+        watermarks: MutableMapping[str, str] | None = None,
+        work_queue: "WorkQueue | None" = None,
+        lead_hashes: MutableMapping[int, str] | None = None,
     ) -> None:
         """
         Обработка записей с подтвержденным статусом
-        и обновление лидов в Bitrix24
+        и обновление лидов в Bitrix24. Если передана очередь работ,
+        записи только ставятся в нее
         """
 
         print(
             f"Обработка записей с подтвержденным статусом {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         )
 
-        from src.services.bitrix import BitrixService
+        # Записи запрашиваются с даты последнего успешного цикла,
+        # уже обработанные отбрасываются по explored_order_ids
+        watermark = cls.records_watermark(watermarks)
+        watermark.advance(None, datetime.now().strftime("%Y-%m-%d"))
 
-        # Получение токена для работы с Itigris
-        token = cls.login()
+        try:
+            # Токен для работы с Itigris (из кэша, вход только при истечении)
+            token = current_tenant().tokens.get_token()
 
-        records = cls.get_records(token, status="REALIZED")
-        if not records:
-            return
+            records = cls.iter_records(
+                token,
+                status="REALIZED",
+                appointment_from=watermark.value,
+            )
 
-        for record in records:
-            try:
-                if record.get("id") in explored_order_ids:
-                    print(f"Запись {record.get('id')} уже обработана")
-                    continue
+            if work_queue is not None:
+                for record in records:
+                    # Записи без лида не ставятся: работа была бы отложена
+                    if (
+                        record.id in explored_order_ids
+                        or record.id not in record_id_to_lead_id
+                    ):
+                        continue
+
+                    work_queue.enqueue(
+                        "record",
+                        f"record:{record.id}",
+                        record.to_payload(),
+                    )
 
-                print(f"Обработка записи {record.get('id')}")
+                watermark.commit()
+                return
+
+            # Записи отмечаются обработанными только после обновления их лидов,
+            # а курсор не сдвигается дальше даты приема записи с ошибкой
+            checked: set[int] = set()
+            dates: dict[int, str | None] = {}
+            updates: dict[int, dict] = {}
+            for record in records:
+                if record.id in explored_order_ids:
+                    print(f"Запись {record.id} уже обработана")
+                    continue
 
-                orders = cls.get_orders(record.get("client").get("id"))
-                if not orders:
-                    print(
-                        f"Заказы для клиента {record.get('client').get('id')} не найдены"
+                dates[record.id] = cls.record_date(record)
+                try:
+                    cls.process_record(
+                        record,
+                        token,
+                        record_id_to_lead_id,
+                        checked,
+                        updates=updates,
+                        raise_errors=True,
+                        lead_hashes=lead_hashes,
                     )
-                    continue
+                except Exception:
+                    watermark.hold(dates[record.id])
+
+            errors = cls.send_lead_updates(updates, lead_hashes)
+            for record_id in cls.mark_explored(
+                checked,
+                errors,
+                record_id_to_lead_id,
+                explored_order_ids,
+            ):
+                watermark.hold(dates[record_id])
+            watermark.commit()
+        except Exception as e:
+            print(f"Ошибка при обработке записей: {e}")
 
-                # Сопоставление записи с заказом, по максимальному ID заказа
-                order, max_id = None, None
-                for order in orders:
-                    if not max_id:
-                        max_id = int(order.get("id", 0))
-                        order = order
-                    else:
-                        if int(order.get("id", 0)) > max_id:
-                            max_id = int(order.get("id", 0))
-                            order = order
-
-                # Получение рецептов к записи (очки и контактные линзы)
-                prescriptions = cls.get_prescriptions(
-                    token,
-                    record.get("client").get("id"),
-                )
+    @classmethod
+    def records_watermark(
+        cls,
+        watermarks: MutableMapping[str, str] | None,
+    ) -> Watermark:
+        """Курсор опроса реестра записей по дате приема"""
 
-                perscriptions = prescriptions.get("prescriptions")
-                contact_lens_perscriptions = prescriptions.get(
-                    "contactLensPrescriptions",
-                )
-                # Получение первого рецепта (очки) и первого рецепта для контактных линз
-                perscription = perscriptions[0] if perscriptions else None
-                contact_lens_perscription = (
-                    contact_lens_perscriptions[0]
-                    if contact_lens_perscriptions
-                    else None
-                )
+        return Watermark(watermarks, "itigris_records")
 
-                # Форматирование рецептов
-                receipt_str = cls._format_receipt(perscription)
-                contact_lens_receipt_str = cls._format_contact_lens_receipt(
-                    contact_lens_perscription
-                )
+    @classmethod
+    def record_date(cls, record: RegistryRecord) -> str | None:
+        """Дата приема записи (значение курсора реестра записей)"""
 
-                # Поиск лида по имени, фамилии и отчеству
-                lead_id = record_id_to_lead_id.get(int(record.get("id", 0)))
-                if not lead_id:
-                    print(f"Лид не найден для записи {record.get('id')}")
-                    continue
+        return record.appointment[:10] if record.appointment else None
 
-                # Обновление лида в Bitrix24
-                fields = {
-                    "UF_CRM_1760104053415": receipt_str,
-                    "UF_CRM_1760104354563": contact_lens_receipt_str,
-                    "UF_CRM_1760104146355": float(order.get("sum", 0))
-                    + float(order.get("discount", 0)),  # Сумма заказа
-                    "UF_CRM_1760104154471": float(
-                        order.get("sum", 0)
-                    ),  # Сумма к оплате
-                    "UF_CRM_1760104282834": int(
-                        (
-                            float(order.get("discount", 0))
-                            / (
-                                float(order.get("sum", 0))
-                                + float(order.get("discount", 0))
-                            )
-                        )
-                        * 100
-                    ),  # Скидка
-                    "UF_CRM_1760104313977": [
-                        {
-                            "NAME": "не выбрано",
-                            "VALUE": "",
-                            "IS_SELECTED": True,
-                        },
-                        {
-                            "NAME": "Ночные",
-                            "VALUE": 45,
-                            "IS_SELECTED": False,
-                        },
-                        {
-                            "NAME": "Дневные",
-                            "VALUE": 47,
-                            "IS_SELECTED": False,
-                        },
-                    ],  # Тип очков
-                }
-                BitrixService.update_lead(lead_id, fields)
+    @classmethod
+    def order_start_date(cls, record: RegistryRecord) -> str | None:
+        """Дата приема записи в формате фильтра заказов (ДД.ММ.ГГГГ)"""
+
+        date = cls.record_date(record)
+        if not date:
+            return None
+
+        return datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y")
+
+    @classmethod
+    def mark_explored(
+        cls,
+        checked: set[int],
+        errors: dict[int, str],
+        record_id_to_lead_id: MutableMapping[int, int],
+        explored_order_ids: MutableSet[int],
+    ) -> list[int]:
+        """
+        Перенос проверенных записей в обработанные после отправки обновлений
+        лидов, возвращает записи, лиды которых не обновились (для повтора)
+        """
+
+        failed = []
+        for record_id in checked:
+            if record_id_to_lead_id.get(record_id) in errors:
+                failed.append(record_id)
+            else:
+                explored_order_ids.add(record_id)
+
+        return failed
+
+    @classmethod
+    def send_lead_updates(
+        cls,
+        updates: dict[int, dict],
+        lead_hashes: MutableMapping[int, str] | None = None,
+    ) -> dict[int, str]:
+        """
+        Обновление собранных лидов в Bitrix24 через batch, возвращает ошибки
+        по ID лида. Хэши полей успешно обновленных лидов сохраняются в lead_hashes
+        """
+
+        if not updates:
+            return {}
+
+        from src.services.bitrix import BitrixService
+
+        try:
+            errors = BitrixService.update_leads_batch(updates)
+        except Exception as e:
+            print(f"Ошибка при обновлении лидов: {e}")
+            return {lead_id: str(e) for lead_id in updates}
+
+        for lead_id, error in errors.items():
+            print(f"Ошибка при обновлении лида {lead_id}: {error}")
 
-            except Exception as e:
-                print(f"Ошибка при обработке записи {record.get('id')}: {e}")
-            finally:
-                explored_order_ids.add(record.get("id"))
+        if lead_hashes is not None:
+            for lead_id, fields in updates.items():
+                if lead_id not in errors:
+                    lead_hashes[lead_id] = cls.lead_fields_hash(fields)
+
+        return errors
 
     # MARK: Orders
     @classmethod
@@ -422,21 +809,82 @@ class ItigrisService:
         cls,
         client_id: int,
         status: str | None = None,
-        key: str = env_settings.ITIGRIS_KEY,
-    ) -> list[dict]:
-        """Получение записей по статусу"""
+        start_date: str | None = None,
+        end_date: str | None = None,
+        key: str | None = None,
+    ) -> list[Order]:
+        """Получение заказов клиента по статусу и датам (с кэшированием)"""
+
+        tenant = current_tenant()
+        key = key or tenant.itigris_key
+        return orders_by_client.get_or_load(
+            (tenant.name, client_id, status, start_date, end_date, key),
+            lambda: list(
+                cls.iter_orders(client_id, status, start_date, end_date, key)
+            ),
+        )
 
-        # Фильтрация по дате (пока убрано, можно добавить по необходимости)
-        # params["startDate"] = datetime.now().strftime("%d.%m.%Y")
-        # params["endDate"] = (datetime.now() + timedelta(days=1)).strftime("%d.%m.%Y")
+    @classmethod
+    def get_latest_order(
+        cls,
+        client_id: int,
+        status: str | None = None,
+        start_date: str | None = None,
+        end_date: str | None = None,
+        key: str | None = None,
+    ) -> Order | None:
+        """
+        Последний заказ клиента (с максимальным ID). В кэше хранится
+        только он, а не вся история заказов
+        """
 
-        response = requests.get(
-            url=f"{ITIGRIS_URL}/remoteOrderHistory/list",
-            params={
-                "key": key,
-                "clientId": client_id,
-            },
+        tenant = current_tenant()
+        key = key or tenant.itigris_key
+
+        def load() -> Order | None:
+            return max(
+                cls.iter_orders(client_id, status, start_date, end_date, key),
+                key=lambda order: order.id,
+                default=None,
+            )
+
+        return orders_by_client.get_or_load(
+            (tenant.name, client_id, "latest", status, start_date, end_date, key),
+            load,
+        )
+
+    @classmethod
+    def iter_orders(
+        cls,
+        client_id: int,
+        status: str | None = None,
+        start_date: str | None = None,
+        end_date: str | None = None,
+        key: str | None = None,
+    ) -> Iterator[Order]:
+        """
+        Запрос заказов клиента. Статус и даты (в формате ДД.ММ.ГГГГ)
+        передаются в API, статус дополнительно проверяется на случай,
+        если API его не учитывает
+        """
+
+        tenant = current_tenant()
+        params = {
+            "key": key or tenant.itigris_key,
+            "clientId": client_id,
+        }
+        if status:
+            params["status"] = status
+        if start_date:
+            params["startDate"] = start_date
+        if end_date:
+            params["endDate"] = end_date
+
+        response = HttpClient.get(
+            url=f"{tenant.itigris_url}/remoteOrderHistory/list",
+            params=params,
             headers={"Host": "optima.itigris.ru"},
+            stream=True,
         )
 
         if not response.status_code == 200:
@@ -444,19 +892,9 @@ class ItigrisService:
                 f"Ошибка при получении записей с подтвержденным статусом: {response.text}, статус: {response.status_code}"
             )
 
-        if not status:
-            return response.json()
-
-        try:
-            records = []
-            for record in response.json():
-                if record.get("status") == status:
-                    records.append(record)
-
-            return records
-        except Exception as e:
-            print(f"Ошибка при получении записей: {e}")
-            return []
+        for order in cls._stream_json(response):
+            if not status or order.get("status") == status:
+                yield Order.from_itigris(order)
 
     # MARK: Prescriptions
     @classmethod
@@ -464,17 +902,35 @@ class ItigrisService:
         cls,
         token: str,
         client_id: int,
-    ) -> list[dict]:
-        """Получение рецептов по ID клиента"""
+    ) -> tuple[Prescription | None, ContactLensPrescription | None]:
+        """Первые рецепты очков и контактных линз клиента (с кэшированием)"""
 
-        response = requests.get(
-            f"{ITIGRIS_URL_NEW}/api/v2/clients/{client_id}/prescription",
+        return prescriptions_by_client.get_or_load(
+            (current_tenant().name, client_id),
+            lambda: cls._fetch_prescriptions(token, client_id),
+        )
+
+    @classmethod
+    def _fetch_prescriptions(
+        cls,
+        token: str,
+        client_id: int,
+    ) -> tuple[Prescription | None, ContactLensPrescription | None]:
+        """
+        Запрос рецептов по ID клиента. Используются только первые рецепты
+        очков и контактных линз, остальные отбрасываются при разборе
+        """
+
+        response = cls._authorized_request(
+            method="GET",
+            url=f"{current_tenant().itigris_url_new}/api/v2/clients/{client_id}/prescription",
+            token=token,
             headers={
-                "Authorization": f"Bearer {token}",
                 "Content-Type": "application/json",
                 "Accept": "application/json",
                 "Host": "optima-2-backend-yc-prod-2.itigris.ru",
             },
+            stream=True,
         )
 
         if not response.status_code == 200:
@@ -482,4 +938,22 @@ class ItigrisService:
                 f"Ошибка при получении рецепта очков: {response.text}, статус: {response.status_code}"
             )
 
-        return response.json()
+        prescription, contact_lens = None, None
+        for key, data in cls._stream_json(response, PRESCRIPTION_KEYS).items():
+            if key == "prescriptions" and prescription is None:
+                prescription = Prescription.from_itigris(data)
+            elif key == "contactLensPrescriptions" and contact_lens is None:
+                contact_lens = ContactLensPrescription.from_itigris(data)
+
+        return prescription, contact_lens
+
+    # MARK: Streaming
+    @classmethod
+    def _stream_json(
+        cls,
+        response,
+        arrays: tuple[str, ...] = ("content",),
+    ) -> JsonStream:
+        """Потоковый разбор тела ответа, запрошенного с stream=True"""
+
+        return JsonStream(response.iter_content(ITIGRIS_STREAM_CHUNK_SIZE), arrays)
@@ -0,0 +1,170 @@
+import threading
+import time
+
+from src.constants import (
+    CIRCUIT_COOLDOWN_SECONDS,
+    CIRCUIT_FAILURE_THRESHOLD,
+    HTTP_RATE_BURST,
+    HTTP_RATE_LIMIT,
+    HTTP_RATE_LIMIT_INCREASE,
+    HTTP_RATE_LIMIT_MAX,
+    HTTP_RATE_LIMIT_MIN,
+    HTTP_RATE_LIMIT_THROTTLED,
+)
+
+
+class CircuitOpenError(Exception):
+    """Хост недоступен: выключатель разомкнут, запрос не отправлялся"""
+
+
+class TokenBucket:
+    """
+    Адаптивный ограничитель частоты запросов к хосту: после каждого успешного
+    ответа частота понемногу растет, после 429/503 уменьшается вдвое,
+    а Retry-After приостанавливает все запросы к хосту. Без начальной
+    частоты (rate=None) запросы не ограничиваются до первого 429/503,
+    а когда частота снова дорастает до max_rate, ограничение снимается
+    """
+
+    def __init__(
+        self,
+        rate: float | None = HTTP_RATE_LIMIT,
+        burst: float = HTTP_RATE_BURST,
+        min_rate: float = HTTP_RATE_LIMIT_MIN,
+        max_rate: float = HTTP_RATE_LIMIT_MAX,
+        increase: float = HTTP_RATE_LIMIT_INCREASE,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate if rate is None else max(max_rate, rate)
+        self.increase = increase
+
+        self._unlimited = rate is None
+
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Ожидание разрешения на запрос"""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.rate is None:
+                    self._tokens = self.burst
+                else:
+                    self._tokens = min(
+                        self.burst,
+                        self._tokens + (now - self._updated_at) * self.rate,
+                    )
+                self._updated_at = now
+
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self.rate is None:
+                    return
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        """Успешный ответ: частота плавно растет"""
+
+        with self._lock:
+            if self.rate is None:
+                return
+
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            if self._unlimited and self.rate >= self.max_rate:
+                self.rate = None
+
+    def on_throttle(self, retry_after: float | None = None) -> float:
+        """Ответ 429/503: частота уменьшается вдвое, возвращается пауза"""
+
+        with self._lock:
+            if self.rate is None:
+                self.rate = HTTP_RATE_LIMIT_THROTTLED
+            else:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+
+            wait = retry_after if retry_after is not None else 1 / self.rate
+            self._blocked_until = max(self._blocked_until, time.monotonic() + wait)
+            return wait
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель хоста: после threshold ошибок подряд
+    запросы сразу завершаются CircuitOpenError, через cooldown_seconds
+    пропускается один пробный запрос
+    """
+
+    def __init__(
+        self,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        cooldown_seconds: float = CIRCUIT_COOLDOWN_SECONDS,
+    ) -> None:
+        self.threshold = threshold
+        self.cooldown_seconds = cooldown_seconds
+
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """closed, open или half-open"""
+
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.cooldown_seconds:
+            return "open"
+        return "half-open"
+
+    def before_request(self, host: str) -> bool:
+        """
+        Проверка, можно ли отправлять запрос. True - запрос пробный:
+        после него вызывается end_trial, даже если ответа не было
+        """
+
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half-open" and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+
+        raise CircuitOpenError(f"Хост {host} недоступен, запрос не отправлен")
+
+    def end_trial(self) -> None:
+        """Завершение пробного запроса без ответа: пропускается следующий"""
+
+        with self._lock:
+            self._trial_in_progress = False
+
+    def on_success(self) -> None:
+        """Успешный ответ: выключатель замыкается"""
+
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def on_failure(self) -> None:
+        """Ошибка соединения или 5xx: после threshold ошибок выключатель размыкается"""
+
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_progress = False
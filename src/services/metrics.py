@@ -0,0 +1,359 @@
+import functools
+import inspect
+import json
+import logging
+import re
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from src.constants import METRICS_HISTOGRAM_BUCKETS, METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger("dnk_crm.trace")
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными границами корзин"""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(METRICS_HISTOGRAM_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(METRICS_HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Метрики HTTP-запросов и этапов синхронизации: гистограммы длительностей,
+    счетчики статусов, байтов и повторов. Отдаются в формате Prometheus,
+    завершенные этапы пишутся в лог dnk_crm.trace одной JSON-строкой
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._http_durations: dict[tuple, Histogram] = {}
+        self._http_requests: dict[tuple, int] = {}
+        self._http_bytes: dict[tuple, int] = {}
+        self._http_retries: dict[tuple, int] = {}
+        self._span_durations: dict[str, Histogram] = {}
+        self._span_errors: dict[str, int] = {}
+
+    # MARK: HTTP
+    def observe_request(
+        self,
+        host: str,
+        endpoint: str,
+        method: str,
+        status: int | str,
+        seconds: float,
+        size: int = 0,
+        retries: int = 0,
+    ) -> None:
+        """Учет одного HTTP-запроса"""
+
+        key = (host, endpoint, method)
+        with self._lock:
+            histogram = self._http_durations.get(key)
+            if histogram is None:
+                histogram = self._http_durations[key] = Histogram()
+            histogram.observe(seconds)
+
+            status_key = (*key, str(status))
+            self._http_requests[status_key] = (
+                self._http_requests.get(status_key, 0) + 1
+            )
+            self._http_bytes[key] = self._http_bytes.get(key, 0) + size
+            if retries:
+                self._http_retries[key] = self._http_retries.get(key, 0) + retries
+
+    @classmethod
+    def endpoint(cls, path: str) -> str:
+        """Путь запроса без ID, чтобы метки не размножались"""
+
+        return _ID_SEGMENT.sub("/{id}", path) or "/"
+
+    # MARK: Spans
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[None]:
+        """Замер этапа: длительность, ошибка и JSON-строка в лог"""
+
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish_span(name, time.perf_counter() - started, error, attrs)
+
+    def _finish_span(
+        self,
+        name: str,
+        seconds: float,
+        error: BaseException | None,
+        attrs: dict,
+    ) -> None:
+        with self._lock:
+            histogram = self._span_durations.get(name)
+            if histogram is None:
+                histogram = self._span_durations[name] = Histogram()
+            histogram.observe(seconds)
+            if error is not None:
+                self._span_errors[name] = self._span_errors.get(name, 0) + 1
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                json.dumps(
+                    {
+                        "span": name,
+                        "duration_ms": round(seconds * 1000, 2),
+                        "error": repr(error) if error is not None else None,
+                        **attrs,
+                    },
+                    ensure_ascii=False,
+                    default=str,
+                )
+            )
+
+    # MARK: Export
+    def render_prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+
+        http_labels = ("host", "endpoint", "method")
+        lines: list[str] = []
+        with self._lock:
+            self._render_histograms(
+                lines,
+                "dnk_http_request_duration_seconds",
+                "Длительность HTTP-запросов",
+                self._labeled(http_labels, self._http_durations),
+            )
+            self._render_counters(
+                lines,
+                "dnk_http_requests_total",
+                "Количество HTTP-запросов по статусам",
+                self._labeled((*http_labels, "status"), self._http_requests),
+            )
+            self._render_counters(
+                lines,
+                "dnk_http_response_bytes_total",
+                "Объем полученных ответов",
+                self._labeled(http_labels, self._http_bytes),
+            )
+            self._render_counters(
+                lines,
+                "dnk_http_retries_total",
+                "Количество повторов HTTP-запросов",
+                self._labeled(http_labels, self._http_retries),
+            )
+            self._render_histograms(
+                lines,
+                "dnk_span_duration_seconds",
+                "Длительность этапов синхронизации",
+                self._labeled(("span",), self._span_durations),
+            )
+            self._render_counters(
+                lines,
+                "dnk_span_errors_total",
+                "Количество этапов, завершившихся ошибкой",
+                self._labeled(("span",), self._span_errors),
+            )
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def _labeled(cls, names: tuple[str, ...], values: dict) -> dict[str, Any]:
+        """Замена ключей-кортежей на строки меток Prometheus"""
+
+        labeled = {}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            labels = ",".join(
+                f'{name}="{cls._escape(part)}"' for name, part in zip(names, key)
+            )
+            labeled[labels] = value
+
+        return labeled
+
+    @classmethod
+    def _escape(cls, value: Any) -> str:
+        """Экранирование значения метки"""
+
+        value = str(value).replace("\\", "\\\\")
+        return value.replace('"', '\\"').replace("\n", "\\n")
+
+    @classmethod
+    def _render_counters(
+        cls,
+        lines: list[str],
+        name: str,
+        help: str,
+        values: dict[str, int],
+    ) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in values.items():
+            lines.append(f"{name}{{{labels}}} {value}")
+
+    @classmethod
+    def _render_histograms(
+        cls,
+        lines: list[str],
+        name: str,
+        help: str,
+        values: dict[str, Histogram],
+    ) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in values.items():
+            cumulative = 0
+            for bound, count in zip(METRICS_HISTOGRAM_BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+metrics = Metrics()
+
+
+def instrumented(cls: type) -> type:
+    """
+    Декоратор класса сервиса: каждый публичный classmethod замеряется
+    как этап <Класс>.<метод>. Для генераторов замеряется весь обход
+    """
+
+    for name, attr in list(vars(cls).items()):
+        if name.startswith("_") or not isinstance(attr, classmethod):
+            continue
+
+        span_name = f"{cls.__name__}.{name}"
+        setattr(cls, name, classmethod(_traced(span_name, attr.__func__)))
+
+    return cls
+
+
+def _traced(span_name: str, func: Callable) -> Callable:
+    """Обертка метода, замеряющая его как этап"""
+
+    if inspect.isgeneratorfunction(func):
+
+        @functools.wraps(func)
+        def generator_wrapper(cls, *args, **kwargs):
+            # Замеряется только работа генератора (запросы и разбор ответов),
+            # а не обработка элементов вызывающим кодом между yield.
+            # Досрочное закрытие потребителем (GeneratorExit) - не ошибка
+            attrs = _span_attrs(args)
+            generator = func(cls, *args, **kwargs)
+            seconds = 0.0
+            error = None
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration as e:
+                        return e.value
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        seconds += time.perf_counter() - started
+                    yield item
+            finally:
+                generator.close()
+                metrics._finish_span(span_name, seconds, error, attrs)
+
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(cls, *args, **kwargs):
+        with metrics.span(span_name, **_span_attrs(args)):
+            return func(cls, *args, **kwargs)
+
+    return wrapper
+
+
+def _span_attrs(args: tuple) -> dict:
+    """
+    ID лида или записи, если первым аргументом передана сущность:
+    модель (Lead, RegistryRecord) или словарь из ответа API
+    """
+
+    if not args:
+        return {}
+
+    entity = args[0]
+    if isinstance(entity, dict):
+        entity_id = entity.get("ID") or entity.get("id")
+    else:
+        entity_id = getattr(entity, "id", None)
+
+    return {"entity_id": entity_id} if entity_id is not None else {}
+
+
+class MetricsServer:
+    """HTTP-сервер, отдающий метрики по адресу /metrics"""
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        # http.server нужен только процессу с метриками, а не каждому импорту
+        from http.server import ThreadingHTTPServer
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+
+    def start(self) -> None:
+        """Запуск сервера в фоне"""
+
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        host, port = self._server.server_address[:2]
+        print(f"Метрики доступны на http://{host}:{port}/metrics")
+
+    def stop(self) -> None:
+        """Остановка сервера"""
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    @classmethod
+    def _handler_class(cls) -> type:
+        """Класс обработчика запросов к /metrics"""
+
+        from http.server import BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type",
+                    "text/plain; version=0.0.4; charset=utf-8",
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
@@ -0,0 +1,328 @@
+import multiprocessing
+import queue
+import time
+import zlib
+from collections import ChainMap
+from dataclasses import dataclass, field
+from typing import Any
+
+from src.constants import (
+    SHARD_JOB_TIMEOUT_SECONDS,
+    SHARD_POLL_INTERVAL_SECONDS,
+    SHARD_PROCESSES,
+)
+from src.models import Lead, RegistryRecord
+from src.services.bitrix import BitrixService
+from src.services.clients import ClientIndex
+from src.services.http import HttpClient
+from src.services.itigris import ItigrisService
+from src.services.tenants import Tenant, register_tenant, use_tenant
+from src.services.work_queue import Job, JobDeferred, WorkQueue
+
+
+@dataclass
+class ShardResult:
+    """
+    Результат работы, выполненной процессом-обработчиком: изменения
+    состояния возвращаются координатору, который один пишет в хранилище
+    и отправляет обновления лидов в Bitrix24
+    """
+
+    job_id: int
+    error: str | None = None
+    deferred: bool = False
+    record_leads: dict[int, int] = field(default_factory=dict)
+    lead_versions: dict[int, str] = field(default_factory=dict)
+    lead_appointments: dict[int, str] = field(default_factory=dict)
+    explored_order_ids: list[int] = field(default_factory=list)
+    lead_updates: dict[int, dict] = field(default_factory=dict)
+
+
+class ShardPool:
+    """
+    Обработка очереди работ несколькими процессами. Каждый процесс владеет
+    разделом клиентов: лиды распределяются по хэшу нормализованного телефона
+    (иначе ID лида), записи - по хэшу ID клиента Itigris. Работы одного
+    клиента попадают в один процесс и выполняются в нем по порядку,
+    поэтому не создаются дубликаты клиентов, а порядок обработки сохраняется.
+    Координатор (основной процесс) берет работы из очередей, применяет
+    результаты к хранилищу и обновляет лиды в Bitrix24 запросами batch.
+    Лимит Bitrix24 общий для вебхука, поэтому делится поровну между
+    координатором и процессами. Если процесс завершился аварийно или
+    не вернул результат работы за SHARD_JOB_TIMEOUT_SECONDS, его
+    невыполненные работы отмечаются неудачными (повторятся по правилам
+    очереди), а процесс перезапускается
+    """
+
+    def __init__(
+        self,
+        tenants: list[Tenant],
+        processes: int = SHARD_PROCESSES,
+    ) -> None:
+        self.tenants = tenants
+        self.processes = processes
+
+        # spawn, а не fork: у родителя уже есть потоки и HTTP-сессия
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes: list[Any] = []
+        self._results: Any = None
+        self._workers: list[Any] = []
+
+    # MARK: Lifecycle
+    def start(self) -> None:
+        """Запуск процессов-обработчиков"""
+
+        HttpClient.configure(bitrix_rate_share=self._bitrix_rate_share())
+        self._results = self._context.Queue()
+        self._inboxes = [None] * self.processes
+        self._workers = [None] * self.processes
+
+        for i in range(self.processes):
+            self._start_worker(i)
+
+    def _start_worker(self, i: int) -> None:
+        """Запуск (или перезапуск) процесса раздела i со своей очередью работ"""
+
+        configs = [tenant.config() for tenant in self.tenants]
+        inbox = self._context.Queue()
+        worker = self._context.Process(
+            target=_work,
+            args=(configs, inbox, self._results, self._bitrix_rate_share()),
+            name=f"shard-{i}",
+            daemon=True,
+        )
+        worker.start()
+        self._inboxes[i] = inbox
+        self._workers[i] = worker
+
+    def stop(self) -> None:
+        """Остановка процессов после выполнения отправленных им работ"""
+
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+
+        self._inboxes, self._workers = [], []
+        HttpClient.configure(bitrix_rate_share=1)
+
+    def _bitrix_rate_share(self) -> float:
+        """Доля лимита Bitrix24 на координатор и каждый процесс"""
+
+        return 1 / (self.processes + 1)
+
+    # MARK: Jobs
+    def shard_for(self, job: Job) -> int:
+        """Номер процесса, владеющего клиентом работы"""
+
+        key = shard_key(job)
+        return zlib.crc32(key.encode()) % self.processes
+
+    def process(self, tenant: Tenant, work_queue: WorkQueue) -> int:
+        """
+        Выполнение всех готовых работ очереди компании, возвращает их количество.
+        Обновления лидов по записям отправляются одним batch после выполнения
+        """
+
+        # Процессы читают хранилище, поэтому накопленные изменения записываются
+        state = tenant.state
+        state.flush()
+
+        jobs: dict[int, Job] = {}
+        shards: dict[int, int] = {}
+        while job := work_queue.claim():
+            try:
+                shard = self.shard_for(job)
+            except Exception as e:
+                print(f"Ошибка при выполнении работы {job.key}: {e}")
+                work_queue.fail(job, str(e))
+                continue
+
+            jobs[job.id] = job
+            shards[job.id] = shard
+            self._inboxes[shards[job.id]].put(
+                (tenant.name, job.id, job.kind, job.payload)
+            )
+
+        results = self._collect(jobs, shards, work_queue)
+
+        updates: dict[int, dict] = {}
+        for result in results:
+            state.record_id_to_lead_id.update(result.record_leads)
+            state.lead_versions.update(result.lead_versions)
+            state.lead_appointments.update(result.lead_appointments)
+            updates.update(result.lead_updates)
+
+        with use_tenant(tenant):
+            errors = ItigrisService.send_lead_updates(updates, state.lead_hashes)
+
+        for result in results:
+            job = jobs[result.job_id]
+            if result.deferred:
+                print(f"Работа {job.key} отложена: {result.error}")
+                work_queue.discard(job)
+                continue
+
+            error = result.error or next(
+                (errors[id] for id in result.lead_updates if id in errors),
+                None,
+            )
+            if error:
+                print(f"Ошибка при выполнении работы {job.key}: {error}")
+                work_queue.fail(job, str(error))
+                continue
+
+            for record_id in result.explored_order_ids:
+                state.explored_order_ids.add(record_id)
+            work_queue.complete(job)
+
+        state.flush()
+        return len(jobs)
+
+    def _collect(
+        self,
+        jobs: dict[int, Job],
+        shards: dict[int, int],
+        work_queue: WorkQueue,
+    ) -> list[ShardResult]:
+        """
+        Ожидание результатов работ. Работы аварийно завершившегося процесса
+        или процесса, который дольше SHARD_JOB_TIMEOUT_SECONDS не вернул
+        ни одного результата, отмечаются неудачными, а процесс перезапускается
+        """
+
+        results: list[ShardResult] = []
+        outstanding = dict(shards)
+        progress_at = [time.monotonic()] * self.processes
+        checked_at = time.monotonic()
+        while outstanding:
+            try:
+                result = self._results.get(timeout=SHARD_POLL_INTERVAL_SECONDS)
+            except queue.Empty:
+                pass
+            else:
+                # Результат работы, уже отмеченной неудачной, не применяется
+                shard = outstanding.pop(result.job_id, None)
+                if shard is not None:
+                    results.append(result)
+                    progress_at[shard] = time.monotonic()
+
+            now = time.monotonic()
+            if now - checked_at < SHARD_POLL_INTERVAL_SECONDS:
+                continue
+            checked_at = now
+
+            busy = set(outstanding.values())
+            for i, worker in enumerate(self._workers):
+                if not worker.is_alive():
+                    error = f"Процесс {worker.name} завершился с кодом {worker.exitcode}"
+                elif i in busy and now - progress_at[i] > SHARD_JOB_TIMEOUT_SECONDS:
+                    worker.terminate()
+                    worker.join()
+                    error = (
+                        f"Процесс {worker.name} не вернул результат "
+                        f"за {SHARD_JOB_TIMEOUT_SECONDS} с"
+                    )
+                else:
+                    continue
+
+                print(error)
+                for job_id, shard in list(outstanding.items()):
+                    if shard == i:
+                        del outstanding[job_id]
+                        work_queue.fail(jobs[job_id], error)
+                self._start_worker(i)
+                progress_at[i] = time.monotonic()
+
+        return results
+
+
+def shard_key(job: Job) -> str:
+    """Ключ раздела: телефон клиента лида или ID клиента записи"""
+
+    if job.kind == "lead":
+        lead = Lead.from_payload(job.payload.get("lead_full") or job.payload["lead"])
+        phone = ClientIndex.normalize_phone(lead.phone)
+        return phone or f"lead:{lead.id}"
+
+    record = RegistryRecord.from_payload(job.payload)
+    return f"client:{record.client_id}"
+
+
+# MARK: Worker
+def _work(
+    configs: list[dict],
+    inbox: Any,
+    results: Any,
+    bitrix_rate_share: float,
+) -> None:
+    """
+    Цикл процесса-обработчика. Хранилище компании читается (известные
+    записи, версии лидов, хэши полей), а изменения возвращаются координатору
+    """
+
+    HttpClient.configure(bitrix_rate_share=bitrix_rate_share)
+
+    tenants = {}
+    for config in configs:
+        tenant = Tenant(**config)
+        register_tenant(tenant)
+        tenants[tenant.name] = tenant
+
+    while (task := inbox.get()) is not None:
+        tenant_name, job_id, kind, payload = task
+        tenant = tenants[tenant_name]
+
+        result = ShardResult(job_id=job_id)
+        try:
+            with use_tenant(tenant):
+                if kind == "lead":
+                    _process_lead(tenant, payload, result)
+                else:
+                    _process_record(tenant, payload, result)
+        except JobDeferred as e:
+            result.error = str(e)
+            result.deferred = True
+        except Exception as e:
+            result.error = str(e)
+
+        results.put(result)
+
+
+def _process_lead(tenant: Tenant, payload: dict, result: ShardResult) -> None:
+    state = tenant.state
+    record_leads = ChainMap(result.record_leads, state.record_id_to_lead_id)
+    lead_versions = ChainMap(result.lead_versions, state.lead_versions)
+    lead_appointments = ChainMap(result.lead_appointments, state.lead_appointments)
+
+    BitrixService.process_lead(
+        Lead.from_payload(payload["lead"]),
+        tenant.tokens.get_token(),
+        record_leads,
+        lead_full=Lead.from_payload(payload["lead_full"])
+        if payload.get("lead_full")
+        else None,
+        lead_versions=lead_versions,
+        raise_errors=True,
+        lead_appointments=lead_appointments,
+    )
+
+
+def _process_record(tenant: Tenant, payload: dict, result: ShardResult) -> None:
+    state = tenant.state
+    record = RegistryRecord.from_payload(payload)
+    explored: set[int] = set()
+
+    ItigrisService.process_record(
+        record,
+        tenant.tokens.get_token(),
+        state.record_id_to_lead_id,
+        explored,
+        updates=result.lead_updates,
+        raise_errors=True,
+        lead_hashes=state.lead_hashes,
+    )
+    if record.id not in explored:
+        raise JobDeferred(f"запись {record.id} пока не сопоставлена с заказом")
+
+    result.explored_order_ids = list(explored)
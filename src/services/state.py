@@ -0,0 +1,383 @@
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator, MutableMapping, MutableSet
+from typing import Any
+
+from src.constants import STATE_DB_PATH, STATE_TTL_DAYS
+
+# Версия схемы хранилища (PRAGMA user_version): миграции выполняются один раз
+SCHEMA_VERSION = 1
+
+
+class StateStore:
+    """
+    Постоянное хранилище состояния синхронизации (по умолчанию SQLite-файл).
+    Изменения копятся в памяти и записываются одной транзакцией в flush,
+    старые записи удаляются в compact
+    """
+
+    def __init__(
+        self,
+        path: str = STATE_DB_PATH,
+        ttl_days: float = STATE_TTL_DAYS,
+    ) -> None:
+        self.path = path
+        self.ttl_days = ttl_days
+
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._create_tables()
+        self._migrate()
+
+        self.record_id_to_lead_id = StoredMapping(self, "record_leads")
+        self.explored_order_ids = StoredSet(self, "explored_orders")
+        self.watermarks = StoredMapping(self, "watermarks")
+        self.lead_versions = StoredMapping(self, "lead_versions")
+        self.lead_hashes = StoredMapping(self, "lead_hashes")
+        self.lead_appointments = StoredMapping(self, "lead_appointments")
+
+    # MARK: Schema
+    def _create_tables(self) -> None:
+        """Создание таблиц и индексов, если их еще нет"""
+
+        with self._lock, self._connection:
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS record_leads (
+                    key INTEGER PRIMARY KEY,
+                    value INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS record_leads_updated_at
+                    ON record_leads (updated_at);
+
+                CREATE TABLE IF NOT EXISTS explored_orders (
+                    key INTEGER PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS explored_orders_updated_at
+                    ON explored_orders (updated_at);
+
+                CREATE TABLE IF NOT EXISTS lead_versions (
+                    key INTEGER PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS lead_versions_updated_at
+                    ON lead_versions (updated_at);
+
+                CREATE TABLE IF NOT EXISTS lead_hashes (
+                    key INTEGER PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS lead_hashes_updated_at
+                    ON lead_hashes (updated_at);
+
+                CREATE TABLE IF NOT EXISTS lead_appointments (
+                    key INTEGER PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS lead_appointments_updated_at
+                    ON lead_appointments (updated_at);
+
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                """
+            )
+
+    def _migrate(self) -> None:
+        """Миграции данных базы с версией схемы меньше SCHEMA_VERSION"""
+
+        with self._lock, self._connection:
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+
+            if version < 1:
+                # Лиды, записи которых созданы до появления lead_appointments:
+                # время приема неизвестно (пустая строка), запись не создается
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO lead_appointments (key, value, updated_at) "
+                    "SELECT value, '', MAX(updated_at) FROM record_leads GROUP BY value"
+                )
+
+            self._connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # MARK: Maintenance
+    def flush(self) -> None:
+        """Запись накопленных изменений одной транзакцией"""
+
+        with self._lock, self._connection:
+            self.record_id_to_lead_id._flush(self._connection)
+            self.explored_order_ids._flush(self._connection)
+            self.watermarks._flush(self._connection)
+            self.lead_versions._flush(self._connection)
+            self.lead_hashes._flush(self._connection)
+            self.lead_appointments._flush(self._connection)
+
+    def compact(self) -> int:
+        """
+        Удаление записей старше ttl_days, возвращает количество удаленных.
+        Курсоры опроса не удаляются, а время приема лида удаляется вместе
+        с последней его записью (иначе по лиду создалась бы запись заново)
+        """
+
+        self.flush()
+
+        threshold = time.time() - self.ttl_days * 24 * 60 * 60
+        deleted = 0
+        with self._lock, self._connection:
+            for table in (
+                "record_leads",
+                "explored_orders",
+                "lead_versions",
+                "lead_hashes",
+            ):
+                cursor = self._connection.execute(
+                    f"DELETE FROM {table} WHERE updated_at < ?",
+                    (threshold,),
+                )
+                deleted += cursor.rowcount
+
+            cursor = self._connection.execute(
+                "DELETE FROM lead_appointments WHERE updated_at < ? "
+                "AND key NOT IN (SELECT value FROM record_leads)",
+                (threshold,),
+            )
+            deleted += cursor.rowcount
+
+        return deleted
+
+    def close(self) -> None:
+        """Запись изменений и закрытие базы"""
+
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Выполнение запроса на чтение"""
+
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+
+class StoredMapping(MutableMapping):
+    """Словарь поверх таблицы StateStore с отложенной записью"""
+
+    _DELETED = object()
+
+    def __init__(self, store: StateStore, table: str) -> None:
+        self._store = store
+        self._table = table
+        self._pending: dict[Any, Any] = {}
+
+    def __getitem__(self, key: Any) -> Any:
+        with self._store._lock:
+            if key in self._pending:
+                value = self._pending[key]
+                if value is self._DELETED:
+                    raise KeyError(key)
+                return value
+
+            rows = self._store._execute(
+                f"SELECT value FROM {self._table} WHERE key = ?",
+                (key,),
+            )
+
+        if not rows:
+            raise KeyError(key)
+        return rows[0][0]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        with self._store._lock:
+            self._pending[key] = value
+
+    def __delitem__(self, key: Any) -> None:
+        self[key]  # KeyError, если ключа нет
+        with self._store._lock:
+            self._pending[key] = self._DELETED
+
+    def __iter__(self) -> Iterator[Any]:
+        self._store.flush()
+        for (key,) in self._store._execute(f"SELECT key FROM {self._table}"):
+            yield key
+
+    def __len__(self) -> int:
+        self._store.flush()
+        return self._store._execute(f"SELECT COUNT(*) FROM {self._table}")[0][0]
+
+    def items(self) -> list[tuple[Any, Any]]:
+        """Все пары ключ-значение одним запросом (а не запросом на каждый ключ)"""
+
+        self._store.flush()
+        return self._store._execute(f"SELECT key, value FROM {self._table}")
+
+    def _flush(self, connection: sqlite3.Connection) -> None:
+        """Запись накопленных изменений (вызывается под блокировкой хранилища)"""
+
+        if not self._pending:
+            return
+
+        now = time.time()
+        connection.executemany(
+            f"INSERT OR REPLACE INTO {self._table} (key, value, updated_at) "
+            "VALUES (?, ?, ?)",
+            [
+                (key, value, now)
+                for key, value in self._pending.items()
+                if value is not self._DELETED
+            ],
+        )
+        connection.executemany(
+            f"DELETE FROM {self._table} WHERE key = ?",
+            [
+                (key,)
+                for key, value in self._pending.items()
+                if value is self._DELETED
+            ],
+        )
+        self._pending.clear()
+
+
+class StoredSet(MutableSet):
+    """Множество int поверх таблицы StateStore с отложенной записью"""
+
+    def __init__(self, store: StateStore, table: str) -> None:
+        self._store = store
+        self._table = table
+        self._pending: dict[int, bool] = {}  # ключ -> добавлен (True) / удален
+
+    def __contains__(self, key: object) -> bool:
+        with self._store._lock:
+            if key in self._pending:
+                return self._pending[key]
+
+            return bool(
+                self._store._execute(
+                    f"SELECT 1 FROM {self._table} WHERE key = ?",
+                    (key,),
+                )
+            )
+
+    def add(self, key: int) -> None:
+        with self._store._lock:
+            self._pending[key] = True
+
+    def discard(self, key: int) -> None:
+        with self._store._lock:
+            self._pending[key] = False
+
+    def __iter__(self) -> Iterator[int]:
+        self._store.flush()
+        for (key,) in self._store._execute(f"SELECT key FROM {self._table}"):
+            yield key
+
+    def __len__(self) -> int:
+        self._store.flush()
+        return self._store._execute(f"SELECT COUNT(*) FROM {self._table}")[0][0]
+
+    def _flush(self, connection: sqlite3.Connection) -> None:
+        """Запись накопленных изменений (вызывается под блокировкой хранилища)"""
+
+        if not self._pending:
+            return
+
+        now = time.time()
+        connection.executemany(
+            f"INSERT OR REPLACE INTO {self._table} (key, updated_at) VALUES (?, ?)",
+            [(key, now) for key, added in self._pending.items() if added],
+        )
+        connection.executemany(
+            f"DELETE FROM {self._table} WHERE key = ?",
+            [(key,) for key, added in self._pending.items() if not added],
+        )
+        self._pending.clear()
+
+
+class Watermark:
+    """
+    Курсор инкрементального опроса: максимальное обработанное значение
+    (например, DATE_MODIFY) и ID сущностей с этим значением. Следующий опрос
+    начинается с сохраненного значения включительно, а уже обработанные
+    сущности на границе отбрасываются. Курсор не сдвигается дальше значения
+    сущности, обработка которой не удалась (hold), поэтому она будет получена
+    снова. Без хранилища курсор ничего не делает
+    """
+
+    def __init__(
+        self,
+        watermarks: MutableMapping[str, str] | None,
+        name: str,
+        key: Callable[[str], Any] = str,
+    ) -> None:
+        self._watermarks = watermarks
+        self._name = name
+        self._key = key
+
+        self.value: str | None = None
+        self._boundary_ids: set[str] = set()
+        if watermarks is not None:
+            self.value = watermarks.get(name)
+            self._boundary_ids = set(
+                filter(None, watermarks.get(f"{name}:ids", "").split(","))
+            )
+
+        self._next_value = self.value
+        self._next_ids = set(self._boundary_ids)
+        self._held: str | None = None
+
+    def is_seen(self, id: Any, value: str | None) -> bool:
+        """Сущность уже обработана в прошлом цикле (находится на границе курсора)"""
+
+        return (
+            value is not None
+            and value == self.value
+            and str(id) in self._boundary_ids
+        )
+
+    def advance(self, id: Any, value: str | None) -> None:
+        """Учет обработанной сущности"""
+
+        if value is None:
+            return
+
+        if self._next_value is None or self._key(value) > self._key(self._next_value):
+            self._next_value = value
+            self._next_ids = set()
+
+        if value == self._next_value and id is not None:
+            self._next_ids.add(str(id))
+
+    def hold(self, value: str | None) -> None:
+        """Учет сущности, обработка которой не удалась"""
+
+        if value is None:
+            return
+
+        if self._held is None or self._key(value) < self._key(self._held):
+            self._held = value
+
+    def commit(self) -> None:
+        """Сохранение курсора после цикла (не дальше неудавшихся сущностей)"""
+
+        value, ids = self._next_value, self._next_ids
+        if self._held is not None and (
+            value is None or self._key(self._held) < self._key(value)
+        ):
+            # Сущности с этим значением будут получены снова все, кроме
+            # обработанных в прошлых циклах
+            value = self._held
+            ids = self._boundary_ids if value == self.value else set()
+
+        if self._watermarks is None or value is None:
+            return
+
+        self._watermarks[self._name] = value
+        self._watermarks[f"{self._name}:ids"] = ",".join(sorted(ids))
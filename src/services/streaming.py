@@ -0,0 +1,156 @@
+import codecs
+import json
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789+-.eE"
+_decoder = json.JSONDecoder()
+
+
+class JsonStream:
+    """
+    Потоковый разбор JSON-ответа по частям тела. Элементы массива верхнего
+    уровня (или массивов под ключами arrays у объекта верхнего уровня)
+    отдаются по одному, не дожидаясь конца ответа, поэтому в памяти
+    одновременно находится только текущий элемент и небольшой буфер.
+    Остальные значения объекта (например, last у страницы) доступны
+    в fields после обхода
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[bytes],
+        arrays: Iterable[str] = ("content",),
+    ) -> None:
+        self.arrays = set(arrays)
+        self.fields: dict[str, Any] = {}
+
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self) -> Iterator[Any]:
+        """Элементы массивов без указания ключа"""
+
+        for _, item in self.items():
+            yield item
+
+    def items(self) -> Iterator[tuple[str | None, Any]]:
+        """Пары (ключ массива, элемент); для массива верхнего уровня ключ None"""
+
+        char = self._peek()
+        if char == "[":
+            yield from ((None, item) for item in self._array())
+        elif char == "{":
+            yield from self._object()
+        else:
+            self.fields[""] = self._value()
+
+    # MARK: Structure
+    def _object(self) -> Iterator[tuple[str, Any]]:
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self._value()
+            self._expect(":")
+
+            if key in self.arrays and self._peek() == "[":
+                for item in self._array():
+                    yield key, item
+            else:
+                self.fields[key] = self._value()
+
+            if self._separator("}"):
+                return
+
+    def _array(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            yield self._value()
+            if self._separator("]"):
+                return
+
+    def _separator(self, closing: str) -> bool:
+        """Разбор запятой или закрывающей скобки (True, если скобка)"""
+
+        char = self._peek()
+        self._pos += 1
+        if char == closing:
+            return True
+        if char != ",":
+            raise self._error(f"Ожидалось ',' или '{closing}'")
+        return False
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise self._error(f"Ожидалось '{char}'")
+        self._pos += 1
+
+    # MARK: Buffer
+    def _value(self) -> Any:
+        """Разбор одного значения целиком (с дочитыванием тела при нехватке)"""
+
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+
+            # Число на границе буфера может продолжаться в следующей части
+            # (в том числе неполная экспонента: "1.5e" разбирается как 1.5)
+            if not self._eof and (
+                end == len(self._buffer) or self._buffer[end] in _NUMBER_CHARS
+            ):
+                self._read()
+                continue
+
+            self._pos = end
+            return value
+
+    def _peek(self) -> str:
+        """Первый непробельный символ (без сдвига позиции)"""
+
+        while True:
+            while self._pos < len(self._buffer):
+                if self._buffer[self._pos] not in _WHITESPACE:
+                    return self._buffer[self._pos]
+                self._pos += 1
+
+            if not self._read():
+                raise self._error("Неожиданный конец ответа")
+
+    def _read(self) -> bool:
+        """Дочитывание следующей части тела (False, если тело закончилось)"""
+
+        if self._eof:
+            return False
+
+        # Разобранная часть буфера отбрасывается
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+
+        for chunk in self._chunks:
+            text = self._text.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+
+        self._buffer += self._text.decode(b"", final=True)
+        self._eof = True
+        return True
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self._buffer, self._pos)
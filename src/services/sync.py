@@ -0,0 +1,264 @@
+import asyncio
+import contextvars
+from collections.abc import MutableMapping, MutableSet
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable
+
+from src.constants import SYNC_MAX_CONCURRENCY
+from src.services.bitrix import BitrixService
+from src.services.itigris import ItigrisService
+from src.services.metrics import metrics
+from src.services.tenants import Tenant, current_tenant, use_tenant
+
+# Ограничение одновременных вызовов компании (ее доля пула потоков движка)
+_tenant_slots: contextvars.ContextVar[asyncio.Semaphore | None] = (
+    contextvars.ContextVar("tenant_slots", default=None)
+)
+
+
+class SyncEngine:
+    """
+    Асинхронный движок синхронизации: обработчики лидов и записей
+    выполняются параллельно, а каждый лид и каждая запись обрабатываются
+    в своем конвейере. Блокирующие вызовы сервисов выполняются в пуле потоков,
+    количество одновременных запросов к каждому хосту ограничивает HttpClient
+    """
+
+    def __init__(self, max_concurrency: int = SYNC_MAX_CONCURRENCY) -> None:
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="sync",
+        )
+
+    # MARK: Cycle
+    async def run_cycle(
+        self,
+        record_id_to_lead_id: MutableMapping[int, int],
+        explored_order_ids: MutableSet[int],
+        watermarks: MutableMapping[str, str] | None = None,
+        lead_versions: MutableMapping[int, str] | None = None,
+        lead_hashes: MutableMapping[int, str] | None = None,
+        lead_appointments: MutableMapping[int, str] | None = None,
+    ) -> None:
+        """Один цикл синхронизации: лиды и записи обрабатываются параллельно"""
+
+        await asyncio.gather(
+            self.handle_new_leads(
+                record_id_to_lead_id,
+                watermarks,
+                lead_versions,
+                lead_appointments,
+            ),
+            self.handle_finished_records(
+                record_id_to_lead_id,
+                explored_order_ids,
+                watermarks,
+                lead_hashes,
+            ),
+        )
+
+    async def run_tenants(self, tenants: list[Tenant]) -> None:
+        """
+        Один цикл синхронизации всех компаний. Циклы выполняются параллельно,
+        каждой компании достается равная доля пула потоков, поэтому большая
+        компания не задерживает обработку остальных
+        """
+
+        share = max(1, self.max_concurrency // max(len(tenants), 1))
+        await asyncio.gather(*(self._run_tenant(tenant, share) for tenant in tenants))
+
+    async def _run_tenant(self, tenant: Tenant, share: int) -> None:
+        """Цикл одной компании (выполняется в своей задаче со своим контекстом)"""
+
+        with use_tenant(tenant):
+            _tenant_slots.set(asyncio.Semaphore(share))
+            state = tenant.state
+
+            with metrics.span("cycle", mode="async", tenant=tenant.name):
+                await self.run_cycle(
+                    state.record_id_to_lead_id,
+                    state.explored_order_ids,
+                    state.watermarks,
+                    state.lead_versions,
+                    state.lead_hashes,
+                    state.lead_appointments,
+                )
+
+    def close(self) -> None:
+        """Остановка пула потоков"""
+
+        self._executor.shutdown(wait=True)
+
+    # MARK: Leads
+    async def handle_new_leads(
+        self,
+        record_id_to_lead_id: MutableMapping[int, int],
+        watermarks: MutableMapping[str, str] | None = None,
+        lead_versions: MutableMapping[int, str] | None = None,
+        lead_appointments: MutableMapping[int, str] | None = None,
+    ) -> None:
+        """Параллельная версия BitrixService.handle_new_leads"""
+
+        print(
+            f"Обработка обнавленных лидов {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+
+        try:
+            watermark = BitrixService.leads_watermark(watermarks)
+
+            leads = await self._run(
+                BitrixService.get_leads,
+                BitrixService.new_leads_filters(watermark.value),
+            )
+            leads = [
+                lead
+                for lead in leads
+                if not watermark.is_seen(lead.id, lead.date_modify)
+            ]
+            if not leads:
+                return
+
+            itigris_token = await self._run(current_tenant().tokens.get_token)
+
+            # Получение полных лидов запросами batch
+            leads_full, errors = await self._run(
+                BitrixService.get_leads_batch,
+                [lead.id for lead in leads],
+            )
+            for lead_id, error in errors.items():
+                print(f"Ошибка при обработке лида {lead_id}: {error}")
+
+            processed = [lead for lead in leads if lead.id not in errors]
+            results = await asyncio.gather(
+                *(
+                    self._run(
+                        partial(
+                            BitrixService.process_lead,
+                            lead,
+                            itigris_token,
+                            record_id_to_lead_id,
+                            leads_full.get(lead.id),
+                            lead_versions,
+                            raise_errors=True,
+                            lead_appointments=lead_appointments,
+                        )
+                    )
+                    for lead in processed
+                ),
+                return_exceptions=True,
+            )
+
+            # Курсор не сдвигается дальше лидов с ошибкой: они будут получены снова
+            failed = {
+                lead.id
+                for lead, result in zip(processed, results)
+                if isinstance(result, Exception)
+            }
+            for lead in leads:
+                if lead.id in errors or lead.id in failed:
+                    watermark.hold(lead.date_modify)
+                else:
+                    watermark.advance(lead.id, lead.date_modify)
+            watermark.commit()
+        except Exception as e:
+            print(f"Ошибка при обработке лидов: {e}")
+
+    # MARK: Records
+    async def handle_finished_records(
+        self,
+        record_id_to_lead_id: MutableMapping[int, int],
+        explored_order_ids: MutableSet[int],
+        watermarks: MutableMapping[str, str] | None = None,
+        lead_hashes: MutableMapping[int, str] | None = None,
+    ) -> None:
+        """Параллельная версия ItigrisService.handle_finished_records"""
+
+        print(
+            f"Обработка записей с подтвержденным статусом {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+
+        try:
+            watermark = ItigrisService.records_watermark(watermarks)
+            watermark.advance(None, datetime.now().strftime("%Y-%m-%d"))
+
+            token = await self._run(current_tenant().tokens.get_token)
+
+            records = await self._run(
+                partial(
+                    ItigrisService.get_records,
+                    token,
+                    status="REALIZED",
+                    appointment_from=watermark.value,
+                )
+            )
+            if not records:
+                watermark.commit()
+                return
+
+            # Записи отмечаются обработанными только после обновления их лидов,
+            # а курсор не сдвигается дальше даты приема записи с ошибкой
+            records = [
+                record for record in records if record.id not in explored_order_ids
+            ]
+            dates = {
+                record.id: ItigrisService.record_date(record) for record in records
+            }
+            checked: set[int] = set()
+            updates: dict[int, dict] = {}
+            results = await asyncio.gather(
+                *(
+                    self._run(
+                        partial(
+                            ItigrisService.process_record,
+                            record,
+                            token,
+                            record_id_to_lead_id,
+                            checked,
+                            updates,
+                            raise_errors=True,
+                            lead_hashes=lead_hashes,
+                        )
+                    )
+                    for record in records
+                ),
+                return_exceptions=True,
+            )
+            for record, result in zip(records, results):
+                if isinstance(result, Exception):
+                    watermark.hold(dates[record.id])
+
+            # Обновление лидов запросами batch
+            errors = await self._run(
+                ItigrisService.send_lead_updates,
+                updates,
+                lead_hashes,
+            )
+            for record_id in ItigrisService.mark_explored(
+                checked,
+                errors,
+                record_id_to_lead_id,
+                explored_order_ids,
+            ):
+                watermark.hold(dates[record_id])
+            watermark.commit()
+        except Exception as e:
+            print(f"Ошибка при обработке записей: {e}")
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Выполнение блокирующего вызова в пуле потоков движка с контекстом
+        текущей компании и в пределах ее доли пула
+        """
+
+        loop = asyncio.get_running_loop()
+        call = partial(contextvars.copy_context().run, func, *args)
+
+        slots = _tenant_slots.get()
+        if slots is None:
+            return await loop.run_in_executor(self._executor, call)
+
+        async with slots:
+            return await loop.run_in_executor(self._executor, call)
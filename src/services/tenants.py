@@ -0,0 +1,213 @@
+import json
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields
+from typing import Any
+from urllib.parse import urlsplit
+
+from src.constants import ITIGRIS_URL, ITIGRIS_URL_NEW, STATE_DB_PATH
+from src.env import env_settings
+from src.services.auth import ItigrisTokenManager, itigris_tokens
+from src.services.clients import ClientIndex, client_index
+from src.services.state import StateStore
+
+# Поле компании -> переменная окружения
+ENV_FIELDS = {
+    "itigris_company": "ITIGRIS_COMPANY",
+    "itigris_login": "ITIGRIS_LOGIN",
+    "itigris_password": "ITIGRIS_PASSWORD",
+    "itigris_department_id": "ITIGRIS_DEPARTAMENT_ID",
+    "itigris_key": "ITIGRIS_KEY",
+    "itigris_user_id": "ITIGRIS_USER_ID",
+    "itigris_service_type_id": "ITIGRIS_SERVICE_TYPE_ID",
+    "bitrix_webhook_url": "BITRIX_WEBHOOK_URL",
+    "bitrix_application_token": "BITRIX_APPLICATION_TOKEN",
+}
+
+
+@dataclass
+class Tenant:
+    """
+    Компания Itigris и портал Bitrix24, синхронизируемые одним процессом:
+    учетные данные, свой кэш токена, индекс клиентов и хранилище состояния
+    (соответствия, курсоры, очередь работ). HTTP-пулы общие для всех
+    """
+
+    name: str
+    itigris_company: str
+    itigris_login: str
+    itigris_password: str
+    itigris_department_id: int
+    itigris_key: str
+    itigris_user_id: int
+    itigris_service_type_id: int
+    bitrix_webhook_url: str
+    bitrix_application_token: str | None = None
+    # Адрес старого API содержит код компании: у каждой компании свой
+    itigris_url: str | None = None
+    itigris_url_new: str = ITIGRIS_URL_NEW
+    state_path: str | None = None
+
+    tokens: ItigrisTokenManager | None = field(default=None, repr=False)
+    client_index: ClientIndex | None = field(default=None, repr=False)
+    _state: StateStore | None = field(default=None, init=False, repr=False)
+    _state_lock: threading.Lock = field(
+        default_factory=threading.Lock,
+        init=False,
+        repr=False,
+    )
+
+    def __post_init__(self) -> None:
+        if not self.itigris_url:
+            raise ValueError(f"У компании {self.name} не задан itigris_url")
+        if self.tokens is None:
+            self.tokens = ItigrisTokenManager(login=self._login)
+        if self.client_index is None:
+            self.client_index = ClientIndex()
+        if self.state_path is None:
+            self.state_path = f"state-{self.name}.sqlite3"
+
+    @classmethod
+    def from_env(cls, **overrides: Any) -> "Tenant":
+        """
+        Единственная компания из переменных окружения (режим без реестра).
+        Поля из overrides заменяют значения окружения
+        """
+
+        values = {
+            "name": "default",
+            "itigris_url": ITIGRIS_URL,
+            "state_path": STATE_DB_PATH,
+            "tokens": itigris_tokens,
+            "client_index": client_index,
+            **overrides,
+        }
+        # Переменные окружения читаются только для незаданных полей
+        for attr, variable in ENV_FIELDS.items():
+            if attr not in values:
+                values[attr] = getattr(env_settings, variable)
+
+        return cls(**values)
+
+    def config(self) -> dict[str, Any]:
+        """
+        Настройки компании без кэшей и хранилища: по ним компания
+        создается заново в другом процессе
+        """
+
+        return {
+            item.name: getattr(self, item.name)
+            for item in fields(self)
+            if item.init and item.name not in ("tokens", "client_index")
+        }
+
+    @property
+    def state(self) -> StateStore:
+        """Хранилище состояния компании (открывается при первом обращении)"""
+
+        if self._state is None:
+            with self._state_lock:
+                if self._state is None:
+                    self._state = StateStore(self.state_path)
+
+        return self._state
+
+    @property
+    def bitrix_host(self) -> str:
+        return urlsplit(self.bitrix_webhook_url).netloc
+
+    def _login(self) -> str:
+        """Вход в Itigris с учетными данными компании"""
+
+        from src.services.itigris import ItigrisService
+
+        with use_tenant(self):
+            return ItigrisService.login()
+
+
+# MARK: Registry
+_tenants: dict[str, Tenant] = {}
+_default: Tenant | None = None
+_registry_loaded = False
+_registry_lock = threading.Lock()
+_current: ContextVar[Tenant | None] = ContextVar("tenant", default=None)
+
+
+def load_tenants(path: str) -> list[Tenant]:
+    """
+    Загрузка реестра компаний из JSON-файла: список объектов с полями Tenant
+    (или объект с ключом tenants). Компании регистрируются для общего транспорта
+    """
+
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+
+    if isinstance(config, dict):
+        config = config["tenants"]
+
+    tenants = [Tenant(**item) for item in config]
+    names = [tenant.name for tenant in tenants]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Названия компаний в {path} должны быть уникальны")
+
+    global _registry_loaded
+    for tenant in tenants:
+        register_tenant(tenant)
+    _registry_loaded = True
+    return tenants
+
+
+def register_tenant(tenant: Tenant) -> None:
+    """Регистрация компании (известные порталы Bitrix24 нужны транспорту)"""
+
+    with _registry_lock:
+        _tenants[tenant.name] = tenant
+
+
+def registered_tenants() -> list[Tenant]:
+    """Все зарегистрированные компании"""
+
+    return list(_tenants.values())
+
+
+def default_tenant() -> Tenant:
+    """Компания из переменных окружения (создается при первом обращении)"""
+
+    global _default
+    if _default is None:
+        with _registry_lock:
+            if _default is None:
+                _default = Tenant.from_env()
+                _tenants.setdefault(_default.name, _default)
+
+    return _default
+
+
+def current_tenant() -> Tenant:
+    """
+    Компания, для которой выполняется текущий вызов. Вне use_tenant -
+    компания из переменных окружения, но только без реестра компаний:
+    иначе вызов ушел бы с учетными данными другой компании
+    """
+
+    tenant = _current.get()
+    if tenant is not None:
+        return tenant
+
+    if _registry_loaded:
+        raise RuntimeError("Компания не выбрана: вызов выполняется вне use_tenant")
+
+    return default_tenant()
+
+
+@contextmanager
+def use_tenant(tenant: Tenant) -> Iterator[Tenant]:
+    """Выполнение блока от имени компании"""
+
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
@@ -0,0 +1,197 @@
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from src.constants import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_WORKERS
+from src.services.bitrix import BitrixService
+from src.services.tenants import Tenant, use_tenant
+from src.services.work_queue import WorkQueue
+
+LEAD_EVENTS = {"ONCRMLEADADD", "ONCRMLEADUPDATE"}
+
+
+class BitrixWebhookServer:
+    """
+    Прием исходящих вебхуков Bitrix24 о создании и изменении лидов.
+    ID лидов складываются в очередь в памяти, потоки которой получают лиды
+    и ставят их в постоянную очередь работ компании с тем же ключом, что
+    и опрос (BitrixService.enqueue_lead): версия лида выполняется одной
+    работой с повторами, а в режиме sharded - в процессе своего раздела.
+    Один сервер принимает события порталов всех компаний; у каждой компании
+    должен быть задан токен исходящего вебхука (bitrix_application_token)
+    """
+
+    def __init__(
+        self,
+        tenants: list[Tenant],
+        work_queues: dict[str, WorkQueue],
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+        workers: int = WEBHOOK_WORKERS,
+    ) -> None:
+        # Без токена событие не отличить от запроса любого, кто знает адрес
+        missing = [
+            tenant.name for tenant in tenants if not tenant.bitrix_application_token
+        ]
+        if missing:
+            raise ValueError(
+                "Для приема вебхуков не задан bitrix_application_token у компаний: "
+                + ", ".join(missing)
+            )
+
+        self.tenants = tenants
+        self.work_queues = work_queues
+        self.workers = workers
+
+        self.queue: queue.Queue[tuple[Tenant, int]] = queue.Queue()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._threads: list[threading.Thread] = []
+
+    # MARK: Lifecycle
+    def start(self) -> None:
+        """Запуск HTTP-сервера и потоков обработки в фоне"""
+
+        self._threads.append(
+            threading.Thread(target=self._server.serve_forever, daemon=True)
+        )
+        for _ in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, daemon=True))
+
+        for thread in self._threads:
+            thread.start()
+
+        host, port = self._server.server_address[:2]
+        print(f"Прием вебхуков Bitrix24 на {host}:{port}")
+
+    def stop(self) -> None:
+        """Остановка HTTP-сервера"""
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    # MARK: Events
+    def resolve_tenant(self, payload: dict) -> Tenant | None:
+        """
+        Компания, портал которой отправил событие, по токену исходящего
+        вебхука (None - событие отклоняется). Домен портала не учитывается:
+        он передается в теле события и не подтверждает отправителя
+        """
+
+        auth = payload.get("auth") or {}
+        token = auth.get("application_token")
+        if not token or not isinstance(token, str):
+            return None
+
+        for tenant in self.tenants:
+            expected = tenant.bitrix_application_token or ""
+            if hmac.compare_digest(token.encode(), expected.encode()):
+                return tenant
+
+        return None
+
+    def enqueue(self, tenant: Tenant, payload: dict) -> bool:
+        """
+        Постановка лида из события в очередь (False, если событие не о лиде).
+        ValueError - ID лида в событии некорректен
+        """
+
+        if str(payload.get("event", "")).upper() not in LEAD_EVENTS:
+            return False
+
+        lead_id = ((payload.get("data") or {}).get("FIELDS") or {}).get("ID")
+        if not lead_id:
+            return False
+
+        try:
+            lead_id = int(lead_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"Некорректный ID лида: {lead_id!r}") from None
+
+        self.queue.put((tenant, lead_id))
+        return True
+
+    def _work(self) -> None:
+        """Постановка лидов из событий в очереди работ компаний"""
+
+        while True:
+            tenant, lead_id = self.queue.get()
+            try:
+                with use_tenant(tenant):
+                    lead = BitrixService.get_lead(lead_id)
+                    if not lead or lead.status_id != "IN_PROCESS":
+                        continue
+
+                    BitrixService.enqueue_lead(
+                        self.work_queues[tenant.name],
+                        lead,
+                        lead_full=lead,
+                    )
+            except Exception as e:
+                # Лид, который не удалось получить, найдет опрос
+                print(f"Ошибка при получении лида {lead_id} из вебхука: {e}")
+            finally:
+                self.queue.task_done()
+
+    @classmethod
+    def parse_payload(cls, body: bytes, content_type: str) -> dict:
+        """
+        Разбор тела события: Bitrix24 отправляет form-urlencoded
+        с ключами вида data[FIELDS][ID], поддерживается и JSON
+        """
+
+        if "json" in content_type:
+            return json.loads(body or b"{}")
+
+        payload: dict = {}
+        for key, values in parse_qs(body.decode()).items():
+            parts = key.replace("]", "").split("[")
+            node = payload
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = values[-1]
+
+        return payload
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        """Класс обработчика запросов, связанный с этим сервером"""
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                try:
+                    body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                    payload = server.parse_payload(
+                        body,
+                        self.headers.get("Content-Type", ""),
+                    )
+                except Exception as e:
+                    print(f"Ошибка при разборе вебхука Bitrix24: {e}")
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                tenant = server.resolve_tenant(payload)
+                if tenant is None:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+
+                try:
+                    server.enqueue(tenant, payload)
+                except ValueError as e:
+                    print(f"Ошибка в вебхуке Bitrix24: {e}")
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
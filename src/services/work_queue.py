@@ -0,0 +1,365 @@
+import itertools
+import json
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from src.constants import (
+    BITRIX_BATCH_SIZE,
+    QUEUE_BACKOFF_BASE_SECONDS,
+    QUEUE_BACKOFF_MAX_SECONDS,
+    QUEUE_MAX_ATTEMPTS,
+    QUEUE_POLL_INTERVAL_SECONDS,
+    QUEUE_WORKERS,
+)
+from src.services.state import StateStore
+
+
+class JobDeferred(Exception):
+    """
+    Работу пока нельзя выполнить (например, заказ по записи еще не создан):
+    она удаляется из очереди, и следующий опрос может поставить ее заново
+    """
+
+
+@dataclass
+class Job:
+    """Элемент очереди работ"""
+
+    id: int
+    kind: str
+    key: str
+    payload: dict
+    attempts: int
+
+
+class WorkQueue:
+    """
+    Постоянная очередь работ в базе StateStore. Ключ идемпотентности
+    не дает поставить одну и ту же работу дважды, неудачные попытки
+    повторяются с экспоненциальной паузой, после QUEUE_MAX_ATTEMPTS
+    работа переносится в таблицу dead_jobs
+    """
+
+    def __init__(
+        self,
+        state: StateStore,
+        max_attempts: int = QUEUE_MAX_ATTEMPTS,
+        backoff_base_seconds: float = QUEUE_BACKOFF_BASE_SECONDS,
+        backoff_max_seconds: float = QUEUE_BACKOFF_MAX_SECONDS,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+
+        self._lock = state._lock
+        self._connection = state._connection
+        self._create_tables()
+        self._recover()
+
+    # MARK: Schema
+    def _create_tables(self) -> None:
+        """Создание таблиц очереди, если их еще нет"""
+
+        with self._lock, self._connection:
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_run_at REAL NOT NULL,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status_next_run_at
+                    ON jobs (status, next_run_at);
+
+                CREATE TABLE IF NOT EXISTS dead_jobs (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL
+                );
+                """
+            )
+
+    def _recover(self) -> None:
+        """Возврат в очередь работ, прерванных остановкой процесса"""
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'pending' WHERE status = 'running'"
+            )
+
+    # MARK: Jobs
+    def enqueue(self, kind: str, key: str, payload: dict) -> bool:
+        """Постановка работы в очередь (False, если работа с таким ключом уже есть)"""
+
+        now = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO jobs "
+                "(kind, key, payload, next_run_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            return cursor.rowcount > 0
+
+    def claim(self) -> Job | None:
+        """Взятие в работу следующей готовой к выполнению работы"""
+
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT id, kind, key, payload, attempts FROM jobs "
+                "WHERE status = 'pending' AND next_run_at <= ? "
+                "ORDER BY next_run_at LIMIT 1",
+                (time.time(),),
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._connection.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), row[0]),
+            )
+
+        return Job(
+            id=row[0],
+            kind=row[1],
+            key=row[2],
+            payload=json.loads(row[3]),
+            attempts=row[4],
+        )
+
+    def complete(self, job: Job) -> None:
+        """Отметка работы как выполненной (ключ остается для идемпотентности)"""
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'done', updated_at = ? WHERE id = ?",
+                (time.time(), job.id),
+            )
+
+    def discard(self, job: Job) -> None:
+        """Удаление отложенной работы: ключ снова можно поставить в очередь"""
+
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def fail(self, job: Job, error: str) -> None:
+        """Повтор работы с экспоненциальной паузой или перенос в dead_jobs"""
+
+        attempts = job.attempts + 1
+        now = time.time()
+
+        with self._lock, self._connection:
+            if attempts >= self.max_attempts:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO dead_jobs "
+                    "(id, kind, key, payload, attempts, last_error, updated_at) "
+                    "SELECT id, kind, key, payload, ?, ?, ? FROM jobs WHERE id = ?",
+                    (attempts, error, now, job.id),
+                )
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'dead', attempts = ?, last_error = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (attempts, error, now, job.id),
+                )
+                return
+
+            delay = min(
+                self.backoff_base_seconds * 2 ** (attempts - 1),
+                self.backoff_max_seconds,
+            )
+            self._connection.execute(
+                "UPDATE jobs SET status = 'pending', attempts = ?, last_error = ?, "
+                "next_run_at = ?, updated_at = ? WHERE id = ?",
+                (attempts, error, now + delay, now, job.id),
+            )
+
+    def compact(self, ttl_days: float) -> int:
+        """Удаление выполненных работ старше ttl_days"""
+
+        threshold = time.time() - ttl_days * 24 * 60 * 60
+        with self._lock, self._connection:
+            return self._connection.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'dead') AND updated_at < ?",
+                (threshold,),
+            ).rowcount
+
+    # MARK: Stats
+    def stats(self) -> dict[str, int]:
+        """Количество работ по статусам"""
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+
+        return dict(rows)
+
+
+@dataclass
+class _Queue:
+    """Очередь пула с обработчиками и отложенными результатами работ"""
+
+    work_queue: WorkQueue
+    handlers: dict[str, Callable[[dict], Any]]
+    batches: dict[str, Callable[[list[tuple[Job, Any]]], dict[int, str]]]
+    pending: list[tuple[Job, Any]] = field(default_factory=list)
+    running: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class WorkerPool:
+    """
+    Пул потоков, разбирающих WorkQueue обработчиками по типу работы.
+    Очередей может быть несколько (по одной на компанию): потоки берут
+    работы из них по кругу, поэтому длинная очередь одной компании
+    не задерживает остальные.
+
+    Для типов работ из batches результаты обработчиков откладываются
+    и отправляются пачкой: когда очередь разобрана (готовых работ нет
+    и ни одна не выполняется) или набралось batch_size результатов.
+    Функция пачки возвращает ошибки по ID работ, и работы завершаются
+    только после ее выполнения
+    """
+
+    def __init__(
+        self,
+        work_queue: WorkQueue | None = None,
+        handlers: dict[str, Callable[[dict], Any]] | None = None,
+        workers: int = QUEUE_WORKERS,
+        poll_interval_seconds: float = QUEUE_POLL_INTERVAL_SECONDS,
+        batch_size: int = BITRIX_BATCH_SIZE,
+        batches: dict[str, Callable[[list[tuple[Job, Any]]], dict[int, str]]]
+        | None = None,
+    ) -> None:
+        self.workers = workers
+        self.poll_interval_seconds = poll_interval_seconds
+        self.batch_size = batch_size
+
+        self._queues: list[_Queue] = []
+        self._next = itertools.count()
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+        if work_queue is not None:
+            self.add_queue(work_queue, handlers or {}, batches)
+
+    def add_queue(
+        self,
+        work_queue: WorkQueue,
+        handlers: dict[str, Callable[[dict], Any]],
+        batches: dict[str, Callable[[list[tuple[Job, Any]]], dict[int, str]]]
+        | None = None,
+    ) -> None:
+        """Добавление очереди со своими обработчиками (до запуска потоков)"""
+
+        self._queues.append(_Queue(work_queue, handlers, batches or {}))
+
+    def start(self) -> None:
+        """Запуск потоков обработки в фоне"""
+
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work,
+                name=f"worker-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Остановка потоков после завершения текущих работ"""
+
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+        for queue in self._queues:
+            self._flush(queue)
+
+    def _work(self) -> None:
+        """Цикл обработки работ одним потоком"""
+
+        while not self._stopped.is_set():
+            claimed = self._claim()
+            if claimed is None:
+                # Разобранные очереди отправляют отложенные результаты
+                for queue in self._queues:
+                    if not queue.running:
+                        self._flush(queue)
+                self._stopped.wait(self.poll_interval_seconds)
+                continue
+
+            queue, job = claimed
+            deferred = False
+            try:
+                result = queue.handlers[job.kind](job.payload)
+            except JobDeferred as e:
+                print(f"Работа {job.key} отложена: {e}")
+                queue.work_queue.discard(job)
+            except Exception as e:
+                print(f"Ошибка при выполнении работы {job.key}: {e}")
+                queue.work_queue.fail(job, str(e))
+            else:
+                deferred = job.kind in queue.batches
+                if not deferred:
+                    queue.work_queue.complete(job)
+
+            with queue.lock:
+                queue.running -= 1
+                if deferred:
+                    queue.pending.append((job, result))
+                full = len(queue.pending) >= self.batch_size
+            if full:
+                self._flush(queue)
+
+    def _flush(self, queue: _Queue) -> None:
+        """Отправка отложенных результатов очереди и завершение их работ"""
+
+        with queue.lock:
+            pending, queue.pending = queue.pending, []
+        if not pending:
+            return
+
+        by_kind: dict[str, list[tuple[Job, Any]]] = {}
+        for job, result in pending:
+            by_kind.setdefault(job.kind, []).append((job, result))
+
+        for kind, items in by_kind.items():
+            try:
+                errors = queue.batches[kind](items)
+            except Exception as e:
+                errors = {job.id: str(e) for job, _ in items}
+
+            for job, _ in items:
+                if job.id in errors:
+                    print(f"Ошибка при выполнении работы {job.key}: {errors[job.id]}")
+                    queue.work_queue.fail(job, errors[job.id])
+                else:
+                    queue.work_queue.complete(job)
+
+    def _claim(self) -> tuple[_Queue, Job] | None:
+        """Следующая работа: очереди опрашиваются по кругу, начиная со следующей"""
+
+        start = next(self._next)
+        for i in range(len(self._queues)):
+            queue = self._queues[(start + i) % len(self._queues)]
+            with queue.lock:
+                job = queue.work_queue.claim()
+                if job is not None:
+                    queue.running += 1
+                    return queue, job
+
+        return None
+
@@ -0,0 +1,19 @@
+import pytest
+
+from src.services.state import StateStore
+
+
+@pytest.fixture
+def state_path(tmp_path) -> str:
+    """Путь к временному файлу хранилища"""
+
+    return str(tmp_path / "state.db")
+
+
+@pytest.fixture
+def store(state_path):
+    """Хранилище во временном SQLite-файле"""
+
+    store = StateStore(state_path)
+    yield store
+    store.close()
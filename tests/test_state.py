@@ -0,0 +1,155 @@
+import sqlite3
+import time
+
+from src.services.state import SCHEMA_VERSION, StateStore, Watermark
+
+
+# MARK: StoredMapping / StoredSet
+def test_mapping_is_written_on_flush(store, state_path):
+    store.record_id_to_lead_id[1] = 10
+    assert store.record_id_to_lead_id[1] == 10
+
+    other = StateStore(state_path)
+    assert 1 not in other.record_id_to_lead_id
+
+    store.flush()
+    assert other.record_id_to_lead_id[1] == 10
+    other.close()
+
+
+def test_mapping_delete(store):
+    store.lead_versions[1] = "2026-10-01T10:00:00"
+    store.flush()
+
+    del store.lead_versions[1]
+    assert 1 not in store.lead_versions
+    assert len(store.lead_versions) == 0
+
+
+def test_set_survives_reopen(state_path):
+    store = StateStore(state_path)
+    store.explored_order_ids.add(5)
+    store.explored_order_ids.add(6)
+    store.explored_order_ids.discard(6)
+    store.close()
+
+    reopened = StateStore(state_path)
+    assert 5 in reopened.explored_order_ids
+    assert 6 not in reopened.explored_order_ids
+    assert sorted(reopened.explored_order_ids) == [5]
+    reopened.close()
+
+
+def test_compact_keeps_appointments_of_known_records(store):
+    store.record_id_to_lead_id[1] = 10
+    store.lead_appointments[10] = "2026-10-01T10:00:00"
+    store.lead_appointments[20] = "2026-10-02T10:00:00"
+    store.watermarks["leads"] = "2026-10-01T10:00:00"
+    store.flush()
+
+    # Отметка записи свежая, остальное устарело
+    store._connection.execute("UPDATE lead_appointments SET updated_at = 0")
+    store._connection.execute("UPDATE watermarks SET updated_at = 0")
+
+    assert store.compact() == 1
+    assert 10 in store.lead_appointments
+    assert 20 not in store.lead_appointments
+    assert store.watermarks["leads"] == "2026-10-01T10:00:00"
+
+    store._connection.execute("UPDATE record_leads SET updated_at = 0")
+    store._connection.execute("UPDATE lead_appointments SET updated_at = 0")
+    assert store.compact() == 2
+    assert len(store.lead_appointments) == 0
+
+
+# MARK: Migrations
+def test_migration_seeds_appointments_once(state_path):
+    connection = sqlite3.connect(state_path)
+    connection.executescript(
+        """
+        CREATE TABLE record_leads (
+            key INTEGER PRIMARY KEY,
+            value INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        """
+    )
+    connection.execute("INSERT INTO record_leads VALUES (1, 10, ?)", (time.time(),))
+    connection.commit()
+    connection.close()
+
+    store = StateStore(state_path)
+    assert store.lead_appointments[10] == ""
+    assert store._execute("PRAGMA user_version")[0][0] == SCHEMA_VERSION
+
+    # Удаленное время приема не восстанавливается при следующем открытии
+    del store.lead_appointments[10]
+    store.close()
+
+    store = StateStore(state_path)
+    assert 10 not in store.lead_appointments
+    store.close()
+
+
+# MARK: Watermark
+def test_watermark_skips_boundary_ids(store):
+    watermark = Watermark(store.watermarks, "leads")
+    watermark.advance(1, "2026-10-01T10:00:00")
+    watermark.advance(2, "2026-10-01T11:00:00")
+    watermark.advance(3, "2026-10-01T11:00:00")
+    watermark.commit()
+
+    watermark = Watermark(store.watermarks, "leads")
+    assert watermark.value == "2026-10-01T11:00:00"
+    assert watermark.is_seen(2, "2026-10-01T11:00:00")
+    assert watermark.is_seen(3, "2026-10-01T11:00:00")
+    assert not watermark.is_seen(4, "2026-10-01T11:00:00")
+    assert not watermark.is_seen(2, "2026-10-01T12:00:00")
+
+
+def test_watermark_does_not_pass_held_value(store):
+    watermark = Watermark(store.watermarks, "leads")
+    watermark.advance(1, "2026-10-01T10:00:00")
+    watermark.commit()
+
+    watermark = Watermark(store.watermarks, "leads")
+    watermark.hold("2026-10-01T10:00:00")
+    watermark.advance(2, "2026-10-01T12:00:00")
+    watermark.commit()
+
+    # Курсор остался на неудавшемся значении, ранее обработанные сущности
+    # на границе по-прежнему отбрасываются
+    watermark = Watermark(store.watermarks, "leads")
+    assert watermark.value == "2026-10-01T10:00:00"
+    assert watermark.is_seen(1, "2026-10-01T10:00:00")
+    assert not watermark.is_seen(2, "2026-10-01T12:00:00")
+
+
+def test_watermark_hold_between_values(store):
+    watermark = Watermark(store.watermarks, "leads")
+    watermark.advance(1, "2026-10-01T10:00:00")
+    watermark.hold("2026-10-01T11:00:00")
+    watermark.advance(3, "2026-10-01T12:00:00")
+    watermark.commit()
+
+    watermark = Watermark(store.watermarks, "leads")
+    assert watermark.value == "2026-10-01T11:00:00"
+    assert not watermark.is_seen(2, "2026-10-01T11:00:00")
+
+
+def test_watermark_uses_key(store):
+    watermark = Watermark(store.watermarks, "records", key=int)
+    watermark.advance(1, "9")
+    watermark.advance(2, "10")
+    watermark.commit()
+
+    assert store.watermarks["records"] == "10"
+
+
+def test_watermark_without_store():
+    watermark = Watermark(None, "leads")
+    watermark.advance(1, "2026-10-01T10:00:00")
+    watermark.commit()
+
+    assert watermark.value is None
+    assert not watermark.is_seen(1, "2026-10-01T10:00:00")
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from src.services.state import StateStore
+from src.services.work_queue import WorkQueue
+
+
+@pytest.fixture
+def work_queue(store):
+    return WorkQueue(store, max_attempts=3, backoff_base_seconds=60)
+
+
+def test_enqueue_is_idempotent(work_queue):
+    assert work_queue.enqueue("lead", "lead:1:v1", {"id": 1})
+    assert not work_queue.enqueue("lead", "lead:1:v1", {"id": 1})
+    assert work_queue.enqueue("lead", "lead:1:v2", {"id": 1})
+    assert work_queue.stats() == {"pending": 2}
+
+
+def test_claim_and_complete(work_queue):
+    work_queue.enqueue("record", "record:1", {"id": 1})
+
+    job = work_queue.claim()
+    assert job.kind == "record"
+    assert job.payload == {"id": 1}
+    assert job.attempts == 0
+    assert work_queue.claim() is None
+
+    work_queue.complete(job)
+    assert work_queue.stats() == {"done": 1}
+    # Выполненная работа не ставится повторно
+    assert not work_queue.enqueue("record", "record:1", {"id": 1})
+
+
+def test_fail_backs_off(work_queue):
+    work_queue.enqueue("lead", "lead:1:v1", {"id": 1})
+
+    job = work_queue.claim()
+    work_queue.fail(job, "ошибка")
+    assert work_queue.claim() is None
+
+    next_run_at, error = work_queue._connection.execute(
+        "SELECT next_run_at, last_error FROM jobs WHERE id = ?", (job.id,)
+    ).fetchone()
+    assert next_run_at == pytest.approx(time.time() + 60, abs=5)
+    assert error == "ошибка"
+
+    work_queue._connection.execute("UPDATE jobs SET next_run_at = 0")
+    assert work_queue.claim().attempts == 1
+
+
+def test_fail_moves_to_dead_jobs(work_queue):
+    work_queue.enqueue("lead", "lead:1:v1", {"id": 1})
+
+    for _ in range(3):
+        work_queue._connection.execute("UPDATE jobs SET next_run_at = 0")
+        work_queue.fail(work_queue.claim(), "ошибка")
+
+    assert work_queue.claim() is None
+    assert work_queue.stats() == {"dead": 1}
+    assert work_queue._connection.execute(
+        "SELECT key, attempts, last_error FROM dead_jobs"
+    ).fetchall() == [("lead:1:v1", 3, "ошибка")]
+
+
+def test_discard_allows_enqueue_again(work_queue):
+    work_queue.enqueue("record", "record:1", {"id": 1})
+
+    work_queue.discard(work_queue.claim())
+    assert work_queue.stats() == {}
+    assert work_queue.enqueue("record", "record:1", {"id": 1})
+
+
+def test_running_jobs_recovered_on_restart(state_path):
+    store = StateStore(state_path)
+    WorkQueue(store).enqueue("lead", "lead:1:v1", {"id": 1})
+    WorkQueue(store).claim()
+    store.close()
+
+    store = StateStore(state_path)
+    assert WorkQueue(store).stats() == {"pending": 1}
+    store.close()
+
+
+def test_compact_removes_old_finished_jobs(work_queue):
+    work_queue.enqueue("lead", "lead:1:v1", {"id": 1})
+    work_queue.enqueue("lead", "lead:2:v1", {"id": 2})
+    work_queue.complete(work_queue.claim())
+    work_queue._connection.execute("UPDATE jobs SET updated_at = 0")
+
+    assert work_queue.compact(ttl_days=1) == 1
+    assert work_queue.stats() == {"pending": 1}